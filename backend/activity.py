@@ -0,0 +1,111 @@
+import os
+import numpy as np
+
+# Activity pre-pass: cheap frame energy / zero-crossing gating that finds the
+# breathing and snoring regions worth running the STFT-based features on.
+# Off by default: the shipped model was trained on whole clips, and gated vectors
+# differ (higher RMS, lower ZCR); enable it together with a model retrained on it
+ACTIVITY_DETECTION = os.environ.get("ACTIVITY_DETECTION", "0") == "1"
+# A frame is active when it is this much louder than the clip's noise floor...
+ACTIVITY_MARGIN_DB = float(os.environ.get("ACTIVITY_MARGIN_DB", 6.0))
+# ...louder than this absolute level (dBFS), and not noise-like (ZCR at or below the limit)
+ACTIVITY_MIN_DBFS = -60.0
+ACTIVITY_MAX_ZCR = 0.35
+# Non-overlapping gating frames, and the percentile of frame levels taken as the noise floor
+ACTIVITY_FRAME_SECONDS = 0.05
+NOISE_FLOOR_PERCENTILE = 10
+# Runs of active frames shorter than this are dropped as clicks; the rest are
+# padded on both sides, which also bridges the gaps between breaths
+ACTIVITY_MIN_RUN_SECONDS = 0.15
+ACTIVITY_PAD_SECONDS = 0.5
+# Above this active fraction the whole clip is analysed (splicing would save little)
+ACTIVITY_FULL_FRACTION = 0.9
+# Analysed when nothing crosses the gate, so the model still sees the loudest part
+ACTIVITY_FALLBACK_SECONDS = 1.0
+
+def activity_config():
+    """Identifies the gating settings (part of the feature vector config)"""
+    if not ACTIVITY_DETECTION:
+        return "all"
+    return f"act{ACTIVITY_MARGIN_DB:g}/{ACTIVITY_MIN_DBFS:g}/{ACTIVITY_MAX_ZCR:g}"
+
+def frame_levels(y, sr):
+    """Level (dBFS) and zero-crossing rate of consecutive ``ACTIVITY_FRAME_SECONDS`` frames.
+
+    Returns ``(level_db, zcr, frame_length)``; trailing samples shorter than a
+    frame are left out.
+    """
+    frame = max(1, int(sr * ACTIVITY_FRAME_SECONDS))
+    n_frames = len(y) // frame
+    blocks = y[:n_frames * frame].reshape(n_frames, frame)
+    power = np.einsum("ij,ij->i", blocks, blocks, dtype=np.float64) / frame
+    negative = blocks < -1e-10
+    zcr = np.count_nonzero(negative[:, 1:] != negative[:, :-1], axis=1) / frame
+    return 10.0 * np.log10(np.maximum(power, 1e-10)), zcr, frame
+
+def noise_floor(level_db):
+    return float(np.percentile(level_db, NOISE_FLOOR_PERCENTILE)) if len(level_db) else ACTIVITY_MIN_DBFS
+
+def _runs(mask):
+    """``(starts, stops)`` of the runs of True in a boolean array"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return edges[::2], edges[1::2]
+
+def active_segments(level_db, zcr, frame, n_samples, floor_db, frame_seconds=ACTIVITY_FRAME_SECONDS):
+    """Sample ranges ``[[start, stop], ...]`` of the active regions, given a noise floor"""
+    threshold = max(ACTIVITY_MIN_DBFS, floor_db + ACTIVITY_MARGIN_DB)
+    active = (level_db > threshold) & (zcr <= ACTIVITY_MAX_ZCR)
+    starts, stops = _runs(active)
+    keep = stops - starts >= max(1, round(ACTIVITY_MIN_RUN_SECONDS / frame_seconds))
+    pad = round(ACTIVITY_PAD_SECONDS / frame_seconds)
+    mask = np.zeros(len(active) + 1, dtype=np.int32)
+    np.add.at(mask, np.maximum(starts[keep] - pad, 0), 1)
+    np.add.at(mask, np.minimum(stops[keep] + pad, len(active)), -1)
+    starts, stops = _runs(np.cumsum(mask[:-1]) > 0)
+    segments = np.stack([starts * frame, stops * frame], axis=1)
+    if len(segments) and stops[-1] == len(active):
+        segments[-1, 1] = n_samples  # the leftover partial frame goes with the last one
+    return segments
+
+def select_active(y, sr):
+    """Cut ``y`` down to its active regions for feature extraction.
+
+    Returns ``(y_analysed, activity)``, where ``activity`` reports the
+    duration, the fraction analysed, the ``mode`` (``"segments"``, ``"full"``
+    or ``"loudest"``) and the analysed segments in seconds.
+    """
+    duration = len(y) / sr
+    if not ACTIVITY_DETECTION:
+        return y, whole_signal(len(y), sr)
+    level_db, zcr, frame = frame_levels(y, sr)
+    segments = active_segments(level_db, zcr, frame, len(y), noise_floor(level_db))
+    if not len(segments):
+        if not len(level_db) or level_db.max() > ACTIVITY_MIN_DBFS:
+            # Audible but without dynamics (e.g. continuous snoring): cannot separate, keep it all
+            return y, _report("full", duration, [[0, len(y)]], sr)
+        # Silence: only the loudest stretch, so a vector can still be computed
+        width = min(len(y), max(int(ACTIVITY_FALLBACK_SECONDS * sr), 1024))
+        start = min(int(np.argmax(level_db)) * frame, len(y) - width)
+        return y[start:start + width], _report("loudest", duration, [[start, start + width]], sr)
+    analysed = int(np.sum(segments[:, 1] - segments[:, 0]))
+    if analysed >= ACTIVITY_FULL_FRACTION * len(y) or analysed < 1024:
+        return y, _report("full", duration, [[0, len(y)]], sr)
+    return gather(y, segments), _report("segments", duration, segments, sr)
+
+def whole_signal(n_samples, sr):
+    """Activity report for audio analysed in full, e.g. by the ungated streaming paths"""
+    return _report("full", n_samples / sr, [[0, n_samples]], sr)
+
+def gather(y, segments):
+    """The samples of ``y`` inside ``segments``, or ``y`` itself when they cover nearly all of it"""
+    if np.sum(segments[:, 1] - segments[:, 0]) >= ACTIVITY_FULL_FRACTION * len(y):
+        return y
+    return np.concatenate([y[start:stop] for start, stop in segments])
+
+def _report(mode, duration, segments, sr):
+    analysed = sum(int(stop - start) for start, stop in segments) / sr
+    return {"mode": mode,
+            "duration_seconds": round(duration, 3),
+            "analysed_seconds": round(analysed, 3),
+            "analysed_fraction": round(analysed / duration, 4) if duration else 0.0,
+            "segments": [[round(start / sr, 2), round(stop / sr, 2)] for start, stop in segments]}
@@ -0,0 +1,245 @@
+"""Stage-level benchmarks for the analysis pipeline.
+
+    python benchmark.py                         # run and print
+    python benchmark.py --save baseline.json    # record a baseline
+    python benchmark.py --compare baseline.json # flag regressions (exit code 1)
+
+Inputs are ``test_snore.wav`` plus synthetic snore-like recordings (1 min and
+5 min in several codecs, 1 h as FLAC for the full-night path). Each stage
+reports the median wall and CPU time over ``--repeat`` runs, the peak memory
+allocated inside the stage (tracemalloc, measured in a separate untimed run)
+and the process peak RSS after it.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import soundfile as sf
+
+from decoders import RESAMPLE_QUALITY, find_ffmpeg
+from model import (WARMUP_AUDIO, _mel_basis, _spectral_statistics, _zero_crossing_rate, N_MFCC,
+                   FEATURE_N_FFT, FEATURE_HOP_LENGTH, compute_features, compute_spectrogram,
+                   extract_features, feature_stft, feature_vector, generate_spectrogram,
+                   load_audio, load_model, predict_probabilities, warm_up, SPECTROGRAM_HOP_LENGTH)
+from epochs import analyze_recording
+from activity import select_active
+from tiles import build_pyramid
+
+SR = 22050
+SYNTH_SR = 44100  # typical phone/browser rate, so decoding includes resampling
+SHORT_INPUTS = {"1min": 60, "5min": 300}
+LONG_INPUTS = {"1h": 3600}
+# Regressions smaller than this are treated as noise whatever the ratio
+MIN_DELTA_MS = 1.0
+
+def _synthesize(path, seconds, sr, seed=0, block_seconds=60):
+    """Write a snore-like test recording: breathing-modulated low harmonics over noise"""
+    rng = np.random.default_rng(seed)
+    with sf.SoundFile(path, "w", samplerate=sr, channels=1, subtype="PCM_16") as f:
+        for start in range(0, seconds, block_seconds):
+            t = np.arange(int(min(block_seconds, seconds - start) * sr)) / sr + start
+            breath = np.clip(np.sin(2 * np.pi * t / 4.0), 0.0, None) ** 2
+            tone = sum(np.sin(2 * np.pi * f0 * t) / k for k, f0 in enumerate((90, 180, 270, 540), 1))
+            y = 0.25 * breath * tone + 0.02 * rng.standard_normal(len(t))
+            f.write(y.astype(np.float32))
+
+def _reencode(src, dst, subtype=None, block=1 << 16):
+    # Written in blocks: libsndfile's Vorbis encoder can crash on one large write
+    with sf.SoundFile(src) as f, sf.SoundFile(dst, "w", samplerate=f.samplerate, channels=1, subtype=subtype) as out:
+        for y in f.blocks(blocksize=block, dtype="float32"):
+            out.write(y)
+
+def _transcode(src, dst, ffmpeg):
+    subprocess.run([ffmpeg, "-hide_banner", "-loglevel", "error", "-y", "-i", src, dst], check=True)
+
+def prepare_inputs(workdir, quick=False):
+    """Create (or reuse) the benchmark recordings; returns short and long ``{name: path}`` maps"""
+    os.makedirs(workdir, exist_ok=True)
+    ffmpeg = find_ffmpeg()
+    short = {"test_snore.wav": WARMUP_AUDIO}
+    for label, seconds in SHORT_INPUTS.items():
+        wav = os.path.join(workdir, f"synth_{label}.wav")
+        if not os.path.exists(wav):
+            _synthesize(wav, seconds, SYNTH_SR)
+        short[f"{label}.wav"] = wav
+        for ext, subtype in (("flac", None), ("ogg", "VORBIS"), ("mp3", "MPEG_LAYER_III")):
+            path = os.path.join(workdir, f"synth_{label}.{ext}")
+            if not os.path.exists(path):
+                try:
+                    _reencode(wav, path, subtype)
+                except (sf.LibsndfileError, ValueError, TypeError):
+                    if os.path.exists(path):
+                        os.remove(path)
+                    continue  # codec not available in this libsndfile build
+            short[f"{label}.{ext}"] = path
+        if ffmpeg:
+            for ext in ("webm", "m4a"):
+                path = os.path.join(workdir, f"synth_{label}.{ext}")
+                if not os.path.exists(path):
+                    _transcode(wav, path, ffmpeg)
+                short[f"{label}.{ext}"] = path
+
+    long = {}
+    if not quick:
+        for label, seconds in LONG_INPUTS.items():
+            path = os.path.join(workdir, f"synth_{label}.flac")
+            if not os.path.exists(path):
+                wav = os.path.join(workdir, f"synth_{label}.wav")
+                _synthesize(wav, seconds, SR)
+                _reencode(wav, path)
+                os.remove(wav)
+            long[f"{label}.flac"] = path
+    return short, long
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+def _cpu_seconds():
+    # Includes reaped child processes, so ffmpeg decoding is counted
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def measure(fn, repeat):
+    """Median wall/CPU milliseconds over ``repeat`` runs, then one traced run for allocations"""
+    walls, cpus = [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            wall, cpu = time.perf_counter(), _cpu_seconds()
+            fn()
+            walls.append((time.perf_counter() - wall) * 1e3)
+            cpus.append((_cpu_seconds() - cpu) * 1e3)
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {"wall_ms": round(statistics.median(walls), 3), "cpu_ms": round(statistics.median(cpus), 3),
+            "alloc_peak_mb": round(peak / 2**20, 3), "peak_rss_mb": round(_peak_rss_mb(), 1)}
+
+def short_stages(path, model):
+    """Stage callables for one clip, mirroring ``extract_features``"""
+    with open(path, "rb") as f:
+        data = f.read()
+    name = os.path.basename(path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        y, sr = load_audio(data, sr=SR, filename=name)
+    S = feature_stft(y)
+    S_db, freqs = compute_spectrogram(y, sr)
+    X = feature_vector(compute_features(y, sr, S=S)).reshape(1, -1)
+    import librosa
+
+    return {
+        "decode": lambda: load_audio(data, sr=SR, filename=name),
+        "activity": lambda: select_active(y, sr),
+        "features.stft": lambda: feature_stft(y),
+        "features.rms": lambda: librosa.feature.rms(y=y, frame_length=FEATURE_N_FFT, hop_length=FEATURE_HOP_LENGTH),
+        "features.zcr": lambda: _zero_crossing_rate(y),
+        "features.spectral": lambda: _spectral_statistics(S, sr),
+        "features.mfcc": lambda: librosa.feature.mfcc(S=librosa.power_to_db(_mel_basis(sr).dot(S**2)), n_mfcc=N_MFCC),
+        "features.total": lambda: compute_features(y, sr),
+        "spectrogram.stft": lambda: compute_spectrogram(y, sr),
+        "spectrogram.generate": lambda: generate_spectrogram(y, sr, S_db=S_db, freqs=freqs),
+        "spectrogram.tiles": lambda: build_pyramid(S_db, freqs, SPECTROGRAM_HOP_LENGTH / sr),
+        "inference": lambda: predict_probabilities(X, model),
+        "extract_features": lambda: extract_features(data, filename=name),
+    }
+
+def long_stages(path, model):
+    return {
+        "decode": lambda: load_audio(path, sr=SR),
+        "recording": lambda: analyze_recording(path, model, sr=SR),
+    }
+
+def environment():
+    import librosa
+    import scipy
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "numpy": np.__version__, "scipy": scipy.__version__, "librosa": librosa.__version__,
+            "soundfile": sf.__version__, "libsndfile": sf.__libsndfile_version__,
+            "ffmpeg": find_ffmpeg(), "resample_quality": RESAMPLE_QUALITY}
+
+def run(args):
+    short, long = prepare_inputs(args.workdir, quick=args.quick)
+    model = load_model(args.model)
+    with contextlib.redirect_stdout(io.StringIO()):
+        warm_up(model)  # keep one-off imports and JIT compilation out of the first stage
+    results = {}
+    for inputs, stages, repeat in ((short, short_stages, args.repeat), (long, long_stages, 1)):
+        for label, path in inputs.items():
+            if args.only and not any(part in label for part in args.only):
+                continue
+            for stage, fn in stages(path, model).items():
+                key = f"{label}/{stage}"
+                results[key] = measure(fn, repeat)
+                r = results[key]
+                print(f"{key:<38} {r['wall_ms']:>10.2f} ms wall {r['cpu_ms']:>10.2f} ms cpu "
+                      f"{r['alloc_peak_mb']:>9.2f} MB alloc {r['peak_rss_mb']:>8.1f} MB rss", flush=True)
+    return {"environment": environment(), "model": type(model).__name__ if model is not None else "heuristic",
+            "repeat": args.repeat, "results": results}
+
+def compare(current, baseline, threshold):
+    """Print per-stage ratios against a baseline; returns the list of regressed keys"""
+    regressions = []
+    print(f"\n{'stage':<38} {'base ms':>10} {'now ms':>10} {'ratio':>7}  memory")
+    for key, now in current["results"].items():
+        base = baseline["results"].get(key)
+        if base is None:
+            continue
+        ratio = now["wall_ms"] / base["wall_ms"] if base["wall_ms"] else float("inf")
+        slower = ratio > 1 + threshold and now["wall_ms"] - base["wall_ms"] > MIN_DELTA_MS
+        mem_ratio = now["alloc_peak_mb"] / base["alloc_peak_mb"] if base["alloc_peak_mb"] else 1.0
+        heavier = mem_ratio > 1 + threshold and now["alloc_peak_mb"] - base["alloc_peak_mb"] > 1.0
+        flags = " ".join(flag for flag, hit in (("SLOWER", slower), ("MORE-MEMORY", heavier)) if hit)
+        print(f"{key:<38} {base['wall_ms']:>10.2f} {now['wall_ms']:>10.2f} {ratio:>7.2f}  x{mem_ratio:.2f} {flags}")
+        if flags:
+            regressions.append(key)
+    changed = {k: (baseline["environment"].get(k), v) for k, v in current["environment"].items()
+               if baseline["environment"].get(k) != v}
+    if changed:
+        print("\nEnvironment differs from baseline:")
+        for k, (old, new) in changed.items():
+            print(f"  {k}: {old} -> {new}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline stage by stage")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage (median is reported)")
+    parser.add_argument("--quick", action="store_true", help="skip the 1 h recording")
+    parser.add_argument("--only", nargs="*", help="only inputs whose name contains one of these strings")
+    parser.add_argument("--model", default="saved_model.joblib")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "sleepdiagnosis-bench"),
+                        help="where generated recordings are kept between runs")
+    parser.add_argument("--save", metavar="FILE", help="write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown ratio (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    current = run(args)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"\nSaved baseline: {args.save}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) regressed beyond {args.threshold:.0%}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Result cache configuration (overridable from the environment)
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", 64 * 1024 * 1024))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR")  # unset disables the disk tier
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 24 * 3600))
+# Disk entries are swept for expiry after this many writes
+DISK_SWEEP_INTERVAL = 100
+
+def file_digest(path, chunk_size=1 << 20):
+    """Content hash of a file, or ``None`` if it does not exist"""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ResultCache:
+    """Content-addressed cache for analysis results.
+
+    Keys hash the uploaded bytes together with a version string (model and
+    feature configuration), so a new model or changed parameters never serve
+    stale results. Entries live in an in-process LRU bounded by their
+    serialized size, backed by an optional JSON-per-entry directory with TTL
+    expiry. Concurrent requests for the same key share one computation.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES, directory=RESULT_CACHE_DIR, ttl=RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.ttl = ttl
+        self.version = ""
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._writes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "shared": 0, "evictions": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def set_version(self, *parts):
+        self.version = "|".join(str(p) for p in parts)
+
+    def hasher(self, *extra):
+        """Incremental key builder: ``update`` it with the upload as it arrives, then ``hexdigest``"""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(self.version.encode())
+        for part in extra:
+            digest.update(b"\0" + str(part).encode())
+        digest.update(b"\0")
+        return digest
+
+    def key(self, data: bytes, *extra):
+        digest = self.hasher(*extra)
+        digest.update(data)
+        return digest.hexdigest()
+
+    def stats(self):
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = lookups - self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "disk_enabled": bool(self.directory),
+        }
+
+    # Memory tier
+
+    def _remember(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.counters["evictions"] += 1
+
+    def _recall(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    # Disk tier
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                payload = f.read()
+        except (FileNotFoundError, OSError):
+            return None
+        return json.loads(payload), len(payload)
+
+    def _store(self, key, payload):
+        if not self.directory:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(temp_path, path)
+        self._writes += 1
+        if self._writes % DISK_SWEEP_INTERVAL == 0:
+            self.sweep()
+
+    def sweep(self):
+        """Delete disk entries older than the TTL"""
+        if not self.directory:
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+    # Public API
+
+    def get(self, key):
+        value = self._recall(key)
+        if value is not None:
+            self.counters["memory_hits"] += 1
+            return value
+        loaded = self._load(key)
+        if loaded is not None:
+            value, size = loaded
+            self._remember(key, value, size)
+            self.counters["disk_hits"] += 1
+            return value
+        return None
+
+    def put(self, key, value):
+        payload = json.dumps(value)
+        self._remember(key, value, len(payload))
+        self._store(key, payload)
+
+    async def get_or_compute(self, key, compute):
+        """Return ``(value, status)`` where status is "hit", "shared" or "miss".
+
+        ``compute`` is an async callable; a concurrent request for a key that
+        is already being computed awaits that computation instead of starting
+        its own.
+        """
+        value = await asyncio.to_thread(self.get, key)
+        if value is not None:
+            return value, "hit"
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.counters["shared"] += 1
+            return await asyncio.shield(pending), "shared"
+
+        self.counters["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            future.set_result(value)
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        await asyncio.to_thread(self.put, key, value)
+        return value, "miss"
@@ -0,0 +1,233 @@
+import functools
+import io
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Longest stretch of audio decoded for one analysis (seconds)
+MAX_DURATION = 300.0
+# Explicit ffmpeg binary; otherwise PATH and the usual install locations are searched once
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY")
+FFMPEG_CANDIDATES = (
+    "C:\\ffmpeg\\bin\\ffmpeg.exe",
+    "C:\\Program Files\\ffmpeg\\bin\\ffmpeg.exe",
+    os.path.join(os.getcwd(), "ffmpeg.exe"),
+)
+
+# soxr quality used wherever decoded audio is resampled to the analysis rate: "vhq",
+# "hq" (librosa's default), "mq", "lq" or "qq" (fastest). Lower tiers shift the
+# spectral features, so training and serving should use the same setting.
+RESAMPLE_QUALITY = os.environ.get("RESAMPLE_QUALITY", "hq").lower()
+if RESAMPLE_QUALITY not in ("vhq", "hq", "mq", "lq", "qq"):
+    raise ValueError(f"Unknown RESAMPLE_QUALITY: {RESAMPLE_QUALITY}")
+# Precision of ffmpeg's soxr resampler for each tier: vhq and hq reproduce
+# ``resample`` exactly and mq within rounding at 44.1 kHz; ffmpeg has no recipe
+# for lq's wider rolloff or qq's cubic interpolation, so those only get the
+# nearest precision (``drift.py`` reports how far apart the two routes land).
+FFMPEG_SOXR_PRECISION = {"vhq": 28, "hq": 20, "mq": 16, "lq": 16, "qq": 15}
+
+# File extensions treated as audio in uploads, archives, training data and score runs
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".m4a", ".flac", ".webm", ".ogg")
+
+EXTENSION_FORMATS = {
+    ".wav": "wav", ".flac": "flac", ".ogg": "ogg", ".oga": "ogg", ".opus": "ogg",
+    ".aif": "aiff", ".aiff": "aiff", ".mp3": "mp3", ".aac": "aac",
+    ".webm": "webm", ".mkv": "webm", ".m4a": "mp4", ".mp4": "mp4",
+}
+
+# Backends tried for each sniffed format, in order. libsndfile covers the
+# uncompressed and Xiph formats (and MP3 from 1.1), ffmpeg everything else.
+ROUTES = {
+    "wav": ("soundfile", "ffmpeg"),
+    "flac": ("soundfile", "ffmpeg"),
+    "ogg": ("soundfile", "ffmpeg"),
+    "aiff": ("soundfile", "ffmpeg"),
+    "mp3": ("soundfile", "ffmpeg", "audioread"),
+    "aac": ("ffmpeg", "audioread"),
+    "webm": ("ffmpeg",),
+    "mp4": ("ffmpeg", "audioread"),
+    None: ("soundfile", "ffmpeg", "audioread"),
+}
+
+# Containers ffmpeg cannot demux from a pipe (the index may sit at the end of the file)
+NEEDS_SEEK = {"mp4"}
+
+DECODERS = {}
+
+def register_decoder(name):
+    """Register ``fn(data, sr, path, max_duration, fmt) -> y`` under ``name`` for use in ``ROUTES``.
+
+    Decoders receive either the raw bytes (``path`` is None) or a file path.
+    """
+    def register(fn):
+        DECODERS[name] = fn
+        return fn
+    return register
+
+def sniff_format(head: bytes, filename: str = None):
+    """Container format from the leading bytes, falling back to the file extension"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:4] == b"fLaC":
+        return "flac"
+    if head[:4] == b"OggS":
+        return "ogg"
+    if head[:4] == b"FORM" and head[8:12] in (b"AIFF", b"AIFC"):
+        return "aiff"
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    if head[4:8] == b"ftyp":
+        return "mp4"
+    if head[:3] == b"ID3":
+        return "mp3"
+    if len(head) >= 2 and head[0] == 0xFF:
+        if head[1] & 0xF6 == 0xF0:
+            return "aac"  # ADTS
+        if head[1] & 0xE0 == 0xE0:
+            return "mp3"  # MPEG audio frame sync
+    if filename:
+        return EXTENSION_FORMATS.get(os.path.splitext(filename)[1].lower())
+    return None
+
+@functools.lru_cache(maxsize=1)
+def find_ffmpeg():
+    """Path of the ffmpeg binary, looked up once per process; None if it is not installed"""
+    for path in (FFMPEG_BINARY, shutil.which("ffmpeg"), *FFMPEG_CANDIDATES):
+        if path and os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_has_soxr(ffmpeg):
+    """Whether this ffmpeg build includes libsoxr (checked once per binary)"""
+    proc = subprocess.run([ffmpeg, "-hide_banner", "-buildconf"], capture_output=True)
+    if b"--enable-libsoxr" in proc.stdout + proc.stderr:
+        return True
+    logger.warning("%s was built without libsoxr; its own resampler ignores RESAMPLE_QUALITY "
+                   "and shifts the features of audio it decodes", ffmpeg)
+    return False
+
+def ffmpeg_resample_args(sr, ffmpeg, quality=RESAMPLE_QUALITY):
+    """ffmpeg output options that resample to ``sr`` the way ``resample`` does"""
+    args = ["-ar", str(sr)]
+    if ffmpeg_has_soxr(ffmpeg):
+        args = ["-af", f"aresample=resampler=soxr:precision={FFMPEG_SOXR_PRECISION[quality]}", *args]
+    return args
+
+def probe_duration(path):
+    """Duration of an audio file in seconds from its header, or None if it cannot be read cheaply"""
+    import soundfile as sf
+    try:
+        info = sf.info(path)
+        if info.frames > 0:
+            return info.frames / info.samplerate
+    except Exception:
+        pass
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        return None
+    # ffmpeg prints the container duration while probing the input
+    proc = subprocess.run([ffmpeg, "-hide_banner", "-i", path], capture_output=True)
+    match = re.search(rb"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", proc.stderr)
+    if match is None:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def resample(y, orig_sr, target_sr, quality=RESAMPLE_QUALITY):
+    """Resample a whole signal at ``RESAMPLE_QUALITY``"""
+    import librosa
+    return librosa.resample(y, orig_sr=orig_sr, target_sr=target_sr, res_type=f"soxr_{quality}")
+
+def resample_stream(orig_sr, target_sr):
+    """Incremental mono float32 resampler at ``RESAMPLE_QUALITY`` (matches ``resample``)"""
+    import soxr
+    return soxr.ResampleStream(orig_sr, target_sr, 1, dtype="float32", quality=RESAMPLE_QUALITY.upper())
+
+def _to_mono(y):
+    return y.mean(axis=1) if y.shape[1] > 1 else y[:, 0]
+
+@register_decoder("soundfile")
+def _decode_soundfile(data, sr, path, max_duration, fmt=None):
+    import soundfile as sf
+    with sf.SoundFile(path if path is not None else io.BytesIO(data)) as f:
+        native_sr = f.samplerate
+        frames = int(max_duration * native_sr) if max_duration else -1
+        y = _to_mono(f.read(frames, dtype="float32", always_2d=True))
+    if native_sr != sr:
+        y = resample(y, native_sr, sr)
+    return y
+
+@register_decoder("ffmpeg")
+def _decode_ffmpeg(data, sr, path, max_duration, fmt=None):
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        raise ValueError("FFmpeg not found; it is required to decode this format")
+    if path is None and fmt in NEEDS_SEEK:
+        with tempfile.NamedTemporaryFile(suffix="." + fmt) as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            return _decode_ffmpeg(None, sr, temp_file.name, max_duration)
+
+    limit = ["-t", str(max_duration)] if max_duration else []
+    proc = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", path if path is not None else "pipe:0",
+         *limit, "-f", "f32le", "-ac", "1", *ffmpeg_resample_args(sr, ffmpeg), "pipe:1"],
+        input=data if path is None else None, capture_output=True)
+    pcm = proc.stdout
+    if proc.returncode != 0 and not pcm:
+        raise ValueError(f"ffmpeg could not decode the audio: {proc.stderr.decode(errors='replace').strip()}")
+    # Raw PCM goes straight into NumPy; copy once so callers get a writable array
+    return np.frombuffer(pcm, dtype="<f4", count=len(pcm) // 4).copy()
+
+@register_decoder("audioread")
+def _decode_audioread(data, sr, path, max_duration, fmt=None):
+    import librosa
+    res_type = f"soxr_{RESAMPLE_QUALITY}"
+    if path is not None:
+        return librosa.load(path, sr=sr, mono=True, duration=max_duration, res_type=res_type)[0]
+    with tempfile.NamedTemporaryFile() as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        return librosa.load(temp_file.name, sr=sr, mono=True, duration=max_duration, res_type=res_type)[0]
+
+def decode_audio(source, sr=22050, filename=None, max_duration=MAX_DURATION):
+    """Decode ``source`` (path, bytes or binary file-like) to mono float32 at ``sr``.
+
+    The format is sniffed from the first bytes once and only the backends
+    routed for it are tried. Returns ``(y, backend_name)``.
+    """
+    path = None
+    if isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        if not os.path.exists(path):
+            raise ValueError(f"Audio file not found: {path}")
+        with open(path, "rb") as f:
+            head = f.read(16)
+        if not head:
+            raise ValueError("Audio file is empty")
+        data = None
+    else:
+        data = bytes(source) if isinstance(source, (bytes, bytearray, memoryview)) else source.read()
+        if not data:
+            raise ValueError("Audio file is empty")
+        head = data[:16]
+
+    fmt = sniff_format(head, filename or path)
+    errors = []
+    for name in ROUTES.get(fmt, ROUTES[None]):
+        try:
+            y = DECODERS[name](data, sr, path, max_duration, fmt=fmt)
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+            continue
+        if y.size:
+            return y, name
+        errors.append(f"{name}: no audio samples decoded")
+    raise ValueError(f"Cannot decode {fmt or 'unknown'} audio ({'; '.join(errors)})")
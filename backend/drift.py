@@ -0,0 +1,96 @@
+"""Feature drift of each resampling tier, and of the ffmpeg decode route.
+
+    python drift.py             # check every tier (exit code 1 past a bound)
+    python drift.py --tiers hq mq  # only these tiers
+
+Synthetic snore-like recordings at 44.1 and 48 kHz are resampled to the
+analysis rate at every ``RESAMPLE_QUALITY`` tier and their feature vectors are
+compared with the ``hq`` ones, which the models are trained on. Each tier is
+also decoded through ffmpeg, which has to land on the same features as the
+libsndfile route at that tier. Spectral features (rms, zcr, centroid,
+bandwidth, rolloff) are compared relatively, MFCC means absolutely. lq and qq
+move the features too far to share a model with hq and ffmpeg cannot
+reproduce them, so their drift is reported without a bound.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import soundfile as sf
+
+from benchmark import SR, _synthesize
+from decoders import FFMPEG_SOXR_PRECISION, RESAMPLE_QUALITY, ffmpeg_resample_args, find_ffmpeg, resample
+from model import compute_features, feature_vector
+
+INPUT_RATES = (44100, 48000)
+INPUT_SECONDS = 60
+N_SPECTRAL = 5  # leading entries of the feature vector that are not MFCCs
+# Allowed (spectral relative, MFCC absolute) drift of each tier against hq
+TIER_BOUNDS = {"vhq": (0.01, 0.5), "hq": (0.0, 0.0), "mq": (0.01, 0.5)}
+# Allowed drift of the ffmpeg route against libsndfile at the same tier
+ROUTE_BOUNDS = {"vhq": (1e-3, 0.01), "hq": (1e-3, 0.01), "mq": (0.01, 0.5)}
+
+def out_of_bounds(measured, bounds):
+    return bounds is not None and any(d > b for d, b in zip(measured, bounds))
+
+def drift(v, reference):
+    """(max relative spectral drift, max absolute MFCC drift) of ``v`` against ``reference``"""
+    spectral = np.abs(v[:N_SPECTRAL] - reference[:N_SPECTRAL]) / np.maximum(np.abs(reference[:N_SPECTRAL]), 1e-12)
+    return float(spectral.max()), float(np.abs(v[N_SPECTRAL:] - reference[N_SPECTRAL:]).max())
+
+def features(y):
+    return feature_vector(compute_features(y, SR))
+
+def ffmpeg_decode(path, ffmpeg, quality):
+    proc = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", path,
+         "-f", "f32le", "-ac", "1", *ffmpeg_resample_args(SR, ffmpeg, quality), "pipe:1"],
+        capture_output=True, check=True)
+    return np.frombuffer(proc.stdout, dtype="<f4")
+
+def run(args):
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        print("ffmpeg not found; only the libsndfile route is checked")
+    os.makedirs(args.workdir, exist_ok=True)
+    failures = []
+    print(f"{'input':<10} {'tier':<5} {'vs hq spectral':>15} {'mfcc':>7}   {'ffmpeg spectral':>16} {'mfcc':>7}")
+    for rate in INPUT_RATES:
+        path = os.path.join(args.workdir, f"drift_{rate}.wav")
+        if not os.path.exists(path):
+            _synthesize(path, INPUT_SECONDS, rate)
+        y, _ = sf.read(path, dtype="float32")
+        reference = features(resample(y, rate, SR, quality="hq"))
+        for tier in args.tiers:
+            v = features(resample(y, rate, SR, quality=tier))
+            tier_drift = drift(v, reference)
+            row = f"{rate:<10} {tier:<5} {tier_drift[0]:>15.2%} {tier_drift[1]:>7.3f}"
+            if out_of_bounds(tier_drift, TIER_BOUNDS.get(tier)):
+                failures.append(f"{rate} Hz {tier}: drift against hq")
+            if ffmpeg is not None:
+                route_drift = drift(features(ffmpeg_decode(path, ffmpeg, tier)), v)
+                row += f"   {route_drift[0]:>16.2%} {route_drift[1]:>7.3f}"
+                if out_of_bounds(route_drift, ROUTE_BOUNDS.get(tier)):
+                    failures.append(f"{rate} Hz {tier}: ffmpeg against libsndfile")
+            print(row if tier in TIER_BOUNDS else row + "   (unbounded)", flush=True)
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Check feature drift across resampling tiers and decoders")
+    parser.add_argument("--tiers", nargs="*", default=list(FFMPEG_SOXR_PRECISION), choices=list(FFMPEG_SOXR_PRECISION))
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "sleepdiagnosis-bench"),
+                        help="where generated recordings are kept between runs")
+    args = parser.parse_args()
+    print(f"RESAMPLE_QUALITY={RESAMPLE_QUALITY}")
+    failures = run(args)
+    if failures:
+        print(f"\n{len(failures)} check(s) out of bounds:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\nAll within bounds")
+
+if __name__ == "__main__":
+    main()
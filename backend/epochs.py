@@ -0,0 +1,242 @@
+import io
+import os
+import subprocess
+import threading
+import numpy as np
+from decoders import NEEDS_SEEK, ROUTES, ffmpeg_resample_args, find_ffmpeg, resample_stream, sniff_format
+from metrics import span
+from activity import ACTIVITY_DETECTION, active_segments, frame_levels, gather, noise_floor
+from model import (FEATURE_N_FFT, compute_features, feature_stft, feature_vector,
+                   predict_probabilities)
+
+# Length of one analysis epoch, as in polysomnography scoring
+EPOCH_SECONDS = 30.0
+# Samples read from the decoder per call, at the native rate
+READ_BLOCK_SAMPLES = 1 << 18
+# Frequency bands reported per epoch (Hz), matching the spectrogram band analysis
+EPOCH_BANDS = {"low": (0, 100), "mid": (100, 500), "high": (500, 1000)}
+
+def _soundfile_blocks(source, sr):
+    """Yield mono float32 blocks at ``sr`` from anything soundfile can open"""
+    import soundfile as sf
+    with sf.SoundFile(source) as f:
+        resampler = None
+        if f.samplerate != sr:
+            resampler = resample_stream(f.samplerate, sr)
+        while True:
+            block = f.read(READ_BLOCK_SAMPLES, dtype="float32", always_2d=True)
+            last = len(block) < READ_BLOCK_SAMPLES
+            y = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+            if resampler is not None:
+                y = resampler.resample_chunk(y, last=last)
+            if len(y):
+                yield y
+            if last:
+                break
+
+def _ffmpeg_blocks(source, sr, ffmpeg, data=None):
+    """Yield mono float32 blocks at ``sr`` decoded by an ffmpeg subprocess.
+
+    ``source`` is a path, or None to pipe ``data`` through stdin.
+    """
+    proc = subprocess.Popen(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", source if source is not None else "pipe:0",
+         "-f", "f32le", "-ac", "1", *ffmpeg_resample_args(sr, ffmpeg), "pipe:1"],
+        stdin=subprocess.PIPE if source is None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    writer = None
+    if source is None:
+        def feed():
+            try:
+                proc.stdin.write(data)
+            except (BrokenPipeError, ValueError):
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except (BrokenPipeError, ValueError):
+                    pass
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+    try:
+        while True:
+            chunk = proc.stdout.read(READ_BLOCK_SAMPLES * 4)
+            if not chunk:
+                break
+            yield np.frombuffer(chunk[:len(chunk) - len(chunk) % 4], dtype="<f4")
+    finally:
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+        if writer is not None:
+            writer.join()
+
+def iter_audio_blocks(source, sr=22050, filename=None):
+    """Decode ``source`` (path, bytes or file-like) block by block without loading it whole"""
+    import soundfile as sf
+    path = os.fspath(source) if isinstance(source, (str, os.PathLike)) else None
+    data = None
+    if path is None:
+        data = bytes(source) if isinstance(source, (bytes, bytearray, memoryview)) else source.read()
+        head = data[:16]
+    else:
+        with open(path, "rb") as f:
+            head = f.read(16)
+    fmt = sniff_format(head, filename or path)
+
+    soundfile_error = None
+    if "soundfile" in ROUTES.get(fmt, ROUTES[None]):
+        try:
+            yield from _soundfile_blocks(path if path is not None else io.BytesIO(data), sr)
+            return
+        except sf.LibsndfileError as e:
+            soundfile_error = e
+
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        raise ValueError(f"Cannot decode {filename or 'recording'} ({fmt or 'unknown format'}) for "
+                         f"long-recording mode without ffmpeg" + (f": {soundfile_error}" if soundfile_error else ""))
+    if path is not None:
+        yield from _ffmpeg_blocks(path, sr, ffmpeg)
+    elif fmt in NEEDS_SEEK:
+        # ffmpeg needs a seekable container here, so spill it once
+        import tempfile
+        with tempfile.NamedTemporaryFile(suffix="." + fmt) as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            yield from _ffmpeg_blocks(temp_file.name, sr, ffmpeg)
+    else:
+        yield from _ffmpeg_blocks(None, sr, ffmpeg, data=data)
+
+def iter_epochs(blocks, sr=22050, epoch_seconds=EPOCH_SECONDS):
+    """Regroup decoded blocks into consecutive epochs of ``epoch_seconds``.
+
+    The trailing partial epoch is yielded as well if it is long enough to frame.
+    """
+    epoch_samples = int(round(epoch_seconds * sr))
+    buffer = np.empty(epoch_samples, dtype=np.float32)
+    filled = 0
+    for block in blocks:
+        pos = 0
+        while pos < len(block):
+            take = min(epoch_samples - filled, len(block) - pos)
+            buffer[filled:filled + take] = block[pos:pos + take]
+            filled += take
+            pos += take
+            if filled == epoch_samples:
+                yield buffer
+                filled = 0
+    if filled >= FEATURE_N_FFT:
+        yield buffer[:filled]
+
+def band_ratios(S, sr):
+    """Share of spectral power in each of ``EPOCH_BANDS`` for a magnitude STFT"""
+    freqs = np.linspace(0, sr / 2, S.shape[0])
+    power = (S ** 2).sum(axis=1)
+    total = power.sum()
+    return {name: float(power[(freqs >= lo) & (freqs < hi)].sum() / total) if total > 0 else 0.0
+            for name, (lo, hi) in EPOCH_BANDS.items()}
+
+def _count_events(flags):
+    """Number of runs of consecutive flagged epochs"""
+    flags = np.asarray(flags, dtype=bool)
+    return int(np.count_nonzero(flags[1:] & ~flags[:-1]) + (1 if len(flags) and flags[0] else 0))
+
+def analyze_recording(source, model, sr=22050, epoch_seconds=EPOCH_SECONDS, filename=None, progress=None):
+    """Score a recording of any length epoch by epoch.
+
+    The waveform is decoded in blocks and only one epoch is held at a time, so
+    memory stays flat for multi-hour inputs. Returns a compact columnar
+    per-epoch timeline and whole-night aggregate statistics. Epochs are first
+    gated for activity (see activity.py): features run on their breathing and
+    snoring regions only, and epochs without any are not scored: their
+    probability is None and the whole-night statistics cover the scored
+    epochs only (``scored_fraction`` reports the coverage). ``progress`` is
+    called with the seconds of audio scored so far after every epoch.
+    """
+    timeline = {"start": [], "duration": [], "analysed": [], "rms": [], "zcr": [], "spectral_centroid": [],
+                "low_freq_ratio": [], "mid_freq_ratio": [], "high_freq_ratio": []}
+    vectors, scored = [], []
+    start = analysed = 0.0
+    floor_db = None
+    for y in iter_epochs(iter_audio_blocks(source, sr, filename), sr, epoch_seconds):
+        duration = len(y) / sr
+        segments = np.array([[0, len(y)]])
+        if ACTIVITY_DETECTION:
+            with span("activity"):
+                level_db, zcr, frame = frame_levels(y, sr)
+                # The quietest epoch so far sets the floor, so an all-quiet epoch is recognised as such
+                floor_db = min(noise_floor(level_db), floor_db if floor_db is not None else np.inf)
+                segments = active_segments(level_db, zcr, frame, len(y), floor_db)
+        active = gather(y, segments) if len(segments) else y[:0]
+
+        timeline["start"].append(round(start, 3))
+        timeline["duration"].append(round(duration, 3))
+        if len(active) >= FEATURE_N_FFT:
+            with span("features"):
+                S = feature_stft(active)
+                features = compute_features(active, sr, S=S)
+                ratios = band_ratios(S, sr)
+            vectors.append(feature_vector(features))
+            scored.append(len(timeline["start"]) - 1)
+            analysed += len(active) / sr
+            timeline["analysed"].append(round(len(active) / len(y), 4))
+            timeline["rms"].append(float(features["rms"]))
+            timeline["zcr"].append(float(features["zcr"]))
+            timeline["spectral_centroid"].append(float(features["spectral_centroid"]))
+            for band, ratio in ratios.items():
+                timeline[f"{band}_freq_ratio"].append(ratio)
+        else:
+            # No breathing or snoring (or a tail too short to score): the gating
+            # statistics stand in, the spectral columns stay empty
+            if not ACTIVITY_DETECTION:
+                level_db, zcr, _ = frame_levels(y, sr)
+            timeline["analysed"].append(0.0)
+            timeline["rms"].append(float(np.mean(10.0 ** (level_db / 20.0))) if len(level_db) else 0.0)
+            timeline["zcr"].append(float(np.mean(zcr)) if len(zcr) else 0.0)
+            timeline["spectral_centroid"].append(None)
+            for band in EPOCH_BANDS:
+                timeline[f"{band}_freq_ratio"].append(None)
+        start += duration
+        if progress is not None:
+            progress(start)
+
+    if not timeline["start"]:
+        raise ValueError("Audio too short for analysis (minimum one frame required)")
+
+    # Inactive epochs are not scored: they are left out of the averages rather
+    # than counted as 0, so a mostly quiet night does not dilute its apnea epochs
+    n_epochs = len(timeline["start"])
+    probs = np.zeros(0)
+    note = "No breathing or snoring activity detected"
+    if vectors:
+        probs, note = predict_probabilities(np.vstack(vectors), model)
+    timeline["probability"] = [None] * n_epochs
+    for index, p in zip(scored, probs):
+        timeline["probability"][index] = float(p)
+
+    flags = np.zeros(n_epochs, dtype=bool)
+    flags[scored] = probs >= 0.5
+    hours = start / 3600.0
+    events = _count_events(flags)
+    overall = float(np.mean(probs)) if len(probs) else 0.0
+    summary = {
+        "duration_seconds": round(start, 3),
+        "epoch_seconds": epoch_seconds,
+        "epochs": n_epochs,
+        "flagged_epochs": int(flags.sum()),
+        "flagged_fraction": float(flags.sum() / len(scored)) if scored else 0.0,
+        "active_epochs": len(scored),
+        "scored_fraction": round(len(scored) / n_epochs, 4),
+        "analysed_fraction": round(analysed / start, 4) if start > 0 else 0.0,
+        "events": events,
+        "events_per_hour": events / hours if hours > 0 else 0.0,
+        "mean_probability": overall,
+        "max_probability": float(np.max(probs)) if len(probs) else 0.0,
+        "mean_rms": float(np.mean(timeline["rms"])),
+    }
+    return {"probability": overall,
+            "label": "likely_apnea" if overall >= 0.5 else "unlikely",
+            "summary": summary,
+            "epochs": timeline,
+            "note": note}
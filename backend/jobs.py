@@ -0,0 +1,286 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from decoders import probe_duration
+from metrics import listen_stages
+from workers import JobTimeout, PoolSaturated, run_analysis, run_recording_analysis
+
+logger = logging.getLogger(__name__)
+
+# Job queue configuration (overridable from the environment)
+JOBS_DB = os.environ.get("JOBS_DB", "jobs.sqlite3")
+JOBS_DIR = os.environ.get("JOBS_DIR", "job_uploads")  # uploaded audio waiting to be analysed
+JOBS_RETENTION = float(os.environ.get("JOBS_RETENTION", 24 * 3600))  # finished jobs kept this long
+JOBS_MAX_QUEUED = int(os.environ.get("JOBS_MAX_QUEUED", 100))
+JOBS_TIMEOUT = float(os.environ.get("JOBS_TIMEOUT", 3600))
+# Pool workers kept free of jobs for synchronous requests (at most workers - 1)
+JOBS_RESERVED_WORKERS = int(os.environ.get("JOBS_RESERVED_WORKERS", 1))
+# Progress rows are rewritten at most this often per job (stage changes always are)
+PROGRESS_INTERVAL = 0.5
+# Expired jobs are swept this often (seconds)
+SWEEP_INTERVAL = 600
+
+JOB_MODES = ("analyze", "recording")
+FINISHED = ("done", "failed")
+# Percent complete when each stage of a single-clip analysis starts
+STAGE_PROGRESS = {"decode": 5, "features": 35, "spectrogram": 60, "render": 80, "tiles": 88, "inference": 95}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    mode TEXT NOT NULL,
+    filename TEXT,
+    cache_key TEXT,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    expires REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+STATUS_COLUMNS = "id, mode, filename, cache_key, status, stage, progress, error, created, started, finished, expires"
+
+class JobStore:
+    """Persistent job queue in SQLite.
+
+    The API process inserts and claims jobs; pool workers (other processes)
+    open the same database to write progress. Uploaded audio is spooled to
+    ``spool_dir`` and deleted once the job finishes; results are kept until
+    ``retention`` seconds after completion.
+    """
+
+    def __init__(self, path=JOBS_DB, spool_dir=JOBS_DIR, retention=JOBS_RETENTION):
+        self.path = path
+        self.spool_dir = spool_dir
+        self.retention = retention
+        self._local = threading.local()
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def setup(self):
+        """Create the schema and put jobs interrupted by a restart back in the queue"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        db = self._db()
+        db.executescript(SCHEMA)
+        requeued = db.execute("UPDATE jobs SET status = 'queued', stage = NULL, progress = 0, started = NULL "
+                              "WHERE status = 'running'").rowcount
+        if requeued:
+            logger.info("Requeued %d interrupted job(s)", requeued)
+        return requeued
+
+    def new_id(self):
+        return uuid.uuid4().hex
+
+    def spool_path(self, job_id):
+        return os.path.join(self.spool_dir, job_id)
+
+    def create(self, job_id, mode, filename=None, cache_key=None):
+        """Queue a job whose audio has already been written to ``spool_path(job_id)``"""
+        self._db().execute("INSERT INTO jobs (id, mode, filename, cache_key, status, created) "
+                           "VALUES (?, ?, ?, ?, 'queued', ?)", (job_id, mode, filename, cache_key, time.time()))
+
+    def claim(self):
+        """Atomically move the oldest queued job to ``running``; None if the queue is empty"""
+        row = self._db().execute(
+            f"UPDATE jobs SET status = 'running', stage = 'starting', started = ? "
+            f"WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1) "
+            f"AND status = 'queued' RETURNING {STATUS_COLUMNS}", (time.time(),)).fetchone()
+        return dict(row) if row is not None else None
+
+    def release(self, job_id):
+        """Return a claimed job to the queue (e.g. the pool was saturated)"""
+        self._db().execute("UPDATE jobs SET status = 'queued', stage = NULL, started = NULL WHERE id = ?", (job_id,))
+
+    def progress(self, job_id, stage, percent):
+        self._db().execute("UPDATE jobs SET stage = ?, progress = ? WHERE id = ? AND status = 'running'",
+                           (stage, percent, job_id))
+
+    def _finish(self, job_id, status, result=None, error=None):
+        now = time.time()
+        self._db().execute(
+            "UPDATE jobs SET status = ?, stage = ?, progress = COALESCE(?, progress), result = ?, error = ?, "
+            "finished = ?, expires = ? "
+            "WHERE id = ?", (status, status, 100.0 if status == "done" else None, result, error, now,
+                             now + self.retention, job_id))
+        self._discard_audio(job_id)
+
+    def complete(self, job_id, result):
+        self._finish(job_id, "done", result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        self._finish(job_id, "failed", error=str(error))
+
+    def _discard_audio(self, job_id):
+        try:
+            os.remove(self.spool_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def get(self, job_id, with_result=True):
+        columns = STATUS_COLUMNS + (", result" if with_result else "")
+        row = self._db().execute(f"SELECT {columns} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if with_result and job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def counts(self):
+        rows = self._db().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def sweep(self):
+        """Delete jobs whose retention has expired; returns how many were removed"""
+        db = self._db()
+        expired = [row[0] for row in db.execute("SELECT id FROM jobs WHERE expires < ?", (time.time(),))]
+        for job_id in expired:
+            self._discard_audio(job_id)
+        if expired:
+            db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+        return len(expired)
+
+class _ProgressReporter:
+    """Throttled, monotonic progress writes for one running job"""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.stage = None
+        self.percent = 0.0
+        self._written = 0.0
+
+    def __call__(self, stage, percent=None):
+        if percent is not None:
+            self.percent = max(self.percent, min(99.0, percent))
+        now = time.monotonic()
+        if stage == self.stage and now - self._written < PROGRESS_INTERVAL:
+            return
+        self.stage = stage
+        self._written = now
+        try:
+            self.store.progress(self.job_id, stage, round(self.percent, 1))
+        except sqlite3.Error as e:
+            # Progress is best effort; the job itself carries on
+            logger.debug("Progress update for job %s failed: %s", self.job_id, e)
+
+def run_job(job_id, mode, filename=None, db_path=JOBS_DB, spool_dir=JOBS_DIR):
+    """Pool entry point for one queued job; progress goes straight to the job table"""
+    store = JobStore(db_path, spool_dir)
+    path = store.spool_path(job_id)
+    report = _ProgressReporter(store, job_id)
+    if mode == "recording":
+        total = probe_duration(path)
+        report("epochs", 0.0)
+        return run_recording_analysis(
+            path, filename, progress=lambda seconds: report("epochs", 100.0 * seconds / total if total else None))
+    with listen_stages(lambda stage: stage in STAGE_PROGRESS and report(stage, STAGE_PROGRESS[stage])):
+        return run_analysis(path, filename)
+
+class JobRunner:
+    """Feeds queued jobs into the analysis pool from the API process.
+
+    ``concurrency`` dispatch loops each claim one job at a time, and only while
+    ``reserve`` workers would still be idle afterwards, so queued jobs never
+    crowd out synchronous requests. With a single worker nothing can be
+    reserved and jobs only run while the pool is idle. A job that times out is
+    marked failed at once, but its worker keeps running it: it still counts as
+    pending in the pool, and its dispatcher waits for it before claiming more.
+    """
+
+    def __init__(self, store, pool, cache=None, concurrency=None, timeout=JOBS_TIMEOUT,
+                 reserve=JOBS_RESERVED_WORKERS):
+        self.store = store
+        self.pool = pool
+        self.cache = cache
+        self.reserve = max(0, min(reserve, pool.workers - 1))
+        self.concurrency = concurrency or max(1, pool.workers - self.reserve)
+        self.timeout = timeout
+        self._wake = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        self.store.setup()
+        self._tasks = [asyncio.create_task(self._dispatch()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle dispatchers after a job has been queued"""
+        self._wake.set()
+
+    async def _dispatch(self):
+        while True:
+            if self.pool.pending + self.reserve >= self.pool.workers:
+                await asyncio.sleep(0.5)
+                continue
+            job = await asyncio.to_thread(self.store.claim)
+            if job is None:
+                self._wake.clear()
+                try:
+                    # Also polls, for jobs queued by other processes sharing the database
+                    await asyncio.wait_for(self._wake.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job):
+        job_id = job["id"]
+        submit = lambda: self.pool.submit(run_job, job_id, job["mode"], job["filename"], self.store.path,
+                                          self.store.spool_dir, timeout=self.timeout)
+        try:
+            if job["mode"] == "analyze" and self.cache is not None and job["cache_key"]:
+                result, _ = await self.cache.get_or_compute(job["cache_key"], submit)
+            else:
+                result = await submit()
+        except PoolSaturated as e:
+            await asyncio.to_thread(self.store.release, job_id)
+            await asyncio.sleep(min(e.retry_after, 5))
+            return
+        except JobTimeout as e:
+            logger.warning("Job %s failed: %s", job_id, e)
+            await asyncio.to_thread(self.store.fail, job_id, e)
+            # The worker is still busy with it; this dispatcher only takes another job once it is free
+            if e.running is not None:
+                await asyncio.wait([e.running])
+            return
+        except Exception as e:
+            logger.warning("Job %s failed: %s", job_id, e)
+            await asyncio.to_thread(self.store.fail, job_id, e)
+            return
+        await asyncio.to_thread(self.store.complete, job_id, result)
+        logger.debug("Job %s (%s) finished", job_id, job["mode"])
+
+    async def _sweep(self):
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.store.sweep)
+                if removed:
+                    logger.info("Removed %d expired job(s)", removed)
+            except sqlite3.Error as e:
+                logger.warning("Job sweep failed: %s", e)
+            await asyncio.sleep(SWEEP_INTERVAL)
@@ -0,0 +1,123 @@
+"""Replay an audio file to ``/analyze/live`` in real time and report latency.
+
+    python live_client.py                                  # test_snore.wav, PCM, 100 ms chunks
+    python live_client.py --repeat 20 --interval 0.5       # a longer session
+    python live_client.py --encoding opus --chunk-ms 250   # WebM/Opus like MediaRecorder
+
+Prints every update as it arrives, then the median/p95/max of the server's
+per-chunk processing time and of the round trip from sending the chunk that
+completed an interval to receiving its update. Exits 1 if the p95
+processing time is over ``--budget-ms``.
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+import numpy as np
+import soundfile as sf
+import websockets
+
+from decoders import find_ffmpeg
+from model import WARMUP_AUDIO
+
+def pcm_chunks(y, sr, chunk_seconds, encoding):
+    step = max(1, int(sr * chunk_seconds))
+    dtype = "<f4" if encoding == "pcm_f32le" else "<i2"
+    for start in range(0, len(y), step):
+        block = y[start:start + step]
+        if dtype == "<i2":
+            block = np.clip(block * 32768.0, -32768, 32767)
+        yield block.astype(dtype).tobytes(), len(block) / sr
+
+def opus_chunks(y, sr, chunk_seconds):
+    """Encode to WebM/Opus and split it into equal byte slices paced over the duration"""
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        sys.exit("ffmpeg is required for --encoding opus")
+    encoded = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-f", "f32le", "-ar", str(sr), "-ac", "1",
+         "-i", "pipe:0", "-c:a", "libopus", "-f", "webm", "pipe:1"],
+        input=y.astype("<f4").tobytes(), capture_output=True, check=True).stdout
+    count = max(1, int(np.ceil(len(y) / sr / chunk_seconds)))
+    size = -(-len(encoded) // count)
+    for start in range(0, len(encoded), size):
+        yield encoded[start:start + size], chunk_seconds
+
+def percentiles(values):
+    if not values:
+        return "n/a"
+    p50, p95 = np.percentile(values, [50, 95])
+    return f"p50 {p50:.1f} ms, p95 {p95:.1f} ms, max {max(values):.1f} ms"
+
+async def replay(args):
+    y, sr = sf.read(args.file, dtype="float32", always_2d=True)
+    y = np.tile(y.mean(axis=1), args.repeat)
+    chunk_seconds = args.chunk_ms / 1000.0
+    chunks = (opus_chunks(y, sr, chunk_seconds) if args.encoding == "opus"
+              else pcm_chunks(y, sr, chunk_seconds, args.encoding))
+    config = {"encoding": args.encoding, "sample_rate": sr, "channels": 1,
+              "window": args.window, "interval": args.interval}
+
+    processing, round_trips = [], []
+    last_sent = None
+    async with websockets.connect(args.url, max_size=None) as ws:
+        await ws.send(json.dumps(config))
+        ready = json.loads(await ws.recv())
+        if ready.get("type") != "ready":
+            sys.exit(f"Server rejected the session: {ready}")
+
+        async def receive():
+            async for raw in ws:
+                message = json.loads(raw)
+                if message["type"] == "update":
+                    processing.append(message["processing_ms"])
+                    round_trips.append((time.perf_counter() - last_sent) * 1e3)
+                    bands = " ".join(f"{k}={v:.2f}" for k, v in message["bands"].items())
+                    print(f"t={message['time']:7.2f}s  p={message['probability']:.3f}  {bands}  "
+                          f"processing {message['processing_ms']:.1f} ms", flush=True)
+                elif message["type"] == "summary":
+                    return message
+                else:
+                    sys.exit(f"Server error: {message}")
+
+        receiver = asyncio.create_task(receive())
+        start = time.perf_counter()
+        audio_time = 0.0
+        for data, seconds in chunks:
+            # Pace sends by audio time so the server sees a real-time capture
+            delay = start + audio_time / args.speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            last_sent = time.perf_counter()
+            await ws.send(data)
+            audio_time += seconds
+        await ws.send(json.dumps({"type": "end"}))
+        summary = await receiver
+
+    print(f"\nsession: {summary['duration_seconds']:.1f}s audio, {summary['updates']} updates, "
+          f"mean probability {summary['mean_probability']}")
+    print(f"server processing per update: {percentiles(processing)}")
+    print(f"round trip per update:        {percentiles(round_trips)}")
+    if processing and np.percentile(processing, 95) > args.budget_ms:
+        print(f"p95 processing time exceeds the {args.budget_ms:.0f} ms budget")
+        return 1
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an audio file to the live analysis WebSocket")
+    parser.add_argument("--url", default="ws://localhost:8000/analyze/live")
+    parser.add_argument("--file", default=WARMUP_AUDIO)
+    parser.add_argument("--encoding", choices=("pcm_s16le", "pcm_f32le", "opus"), default="pcm_s16le")
+    parser.add_argument("--chunk-ms", type=float, default=100.0, help="audio per WebSocket message")
+    parser.add_argument("--repeat", type=int, default=1, help="loop the file this many times")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed (1.0 = real time)")
+    parser.add_argument("--window", type=float, default=10.0)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--budget-ms", type=float, default=200.0, help="allowed p95 processing time")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(replay(args)))
+
+if __name__ == "__main__":
+    main()
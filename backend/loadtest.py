@@ -0,0 +1,447 @@
+"""End-to-end load test of ``POST /analyze`` against a locally started server.
+
+    python loadtest.py                                     # 1 and all-core workers, 1 and 4 concurrent clients
+    python loadtest.py --workers 1,2,4 --concurrency 2,8 --duration 60 --save load.json
+    python loadtest.py --rate 0.5,2 --compare load.json    # Poisson arrivals; exit 1 on regressions
+    python loadtest.py --env ADAPTIVE_QUALITY=0 --inputs 5min
+
+For every worker count a fresh ``uvicorn main:app`` is started on a free local
+port (after its warm-up has finished) and driven with a round-robin mix of
+``test_snore.wav`` and the synthetic benchmark recordings, either by a fixed
+number of closed-loop clients (``--concurrency``) or by open-loop Poisson
+arrivals (``--rate``, requests per second). Each scenario reports throughput,
+p50/p95/p99 latency, errors by status, the quality tiers served and the
+server's resident memory (PSS summed over the server and its pool workers).
+
+The result cache is disabled and every input comes in several dithered copies,
+so concurrent requests are real analyses rather than cache hits or shared
+computations (``--cache`` keeps the cache on).
+"""
+import argparse
+import collections
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
+import soundfile as sf
+
+from benchmark import _reencode, _transcode, environment, prepare_inputs
+from decoders import find_ffmpeg
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INPUTS = ("test_snore.wav", "1min.wav", "1min.mp3", "1min.webm", "5min.flac")
+# libsndfile subtypes for the formats it can write; the rest go through ffmpeg
+SUBTYPES = {".wav": "PCM_16", ".flac": None, ".ogg": "VORBIS", ".mp3": "MPEG_LAYER_III"}
+# Dither added to each copy of an input: inaudible, but changes every byte of the upload
+DITHER_LEVEL = 1e-4
+MEMORY_SAMPLE_SECONDS = 0.25
+# Regressions smaller than these are treated as noise whatever the ratio
+MIN_DELTA_MS = 20.0
+MIN_DELTA_MB = 16.0
+
+def source_wav(name, path, workdir):
+    """The uncompressed recording an input was encoded from"""
+    if name.endswith(".wav"):
+        return path
+    return os.path.join(workdir, f"synth_{name.rsplit('.', 1)[0]}.wav")
+
+def make_variants(name, path, workdir, count):
+    """``count`` copies of one input with different dither (the first is the input itself)"""
+    stem, ext = os.path.splitext(name)
+    variants = [path]
+    wav = source_wav(name, path, workdir)
+    ffmpeg = find_ffmpeg()
+    for i in range(1, count):
+        target = os.path.join(workdir, "load", f"{stem}.v{i}{ext}")
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            y, sr = sf.read(wav, dtype="float32")
+            y = y + DITHER_LEVEL * np.random.default_rng(i).standard_normal(y.shape).astype(np.float32)
+            dithered = os.path.join(workdir, "load", f"{stem}.v{i}.src.wav")
+            sf.write(dithered, y, sr, subtype="PCM_16")
+            if ext in SUBTYPES:
+                _reencode(dithered, target, SUBTYPES[ext])
+            elif ffmpeg:
+                _transcode(dithered, target, ffmpeg)
+            else:
+                break
+            os.remove(dithered)
+        variants.append(target)
+    return variants
+
+def load_inputs(args):
+    """``[{"name", "seconds", "paths"}, ...]`` for the selected inputs"""
+    short, _ = prepare_inputs(args.workdir, quick=True)
+    selected = [(name, path) for name, path in short.items()
+                if any(part in name for part in args.inputs)]
+    if not selected:
+        sys.exit(f"No inputs match {args.inputs}; available: {', '.join(short)}")
+    count = 1 if args.cache else args.variants or max(args.concurrency or [1])
+    inputs = []
+    for name, path in selected:
+        seconds = sf.info(source_wav(name, path, args.workdir)).duration
+        inputs.append({"name": name, "seconds": seconds,
+                       "paths": make_variants(name, path, args.workdir, count)})
+    return inputs
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class Server:
+    """``uvicorn main:app`` in a subprocess, with memory sampling of its process tree"""
+
+    def __init__(self, workers, args):
+        self.port = free_port()
+        env = dict(os.environ, ANALYSIS_WORKERS=str(workers), LOG_LEVEL="WARNING",
+                   JOBS_DB=os.path.join(args.workdir, "load", "jobs.sqlite3"),
+                   JOBS_DIR=os.path.join(args.workdir, "load", "job_uploads"))
+        if not args.cache:
+            env["RESULT_CACHE_BYTES"] = "0"
+            env.pop("RESULT_CACHE_DIR", None)
+        for setting in args.env:
+            key, _, value = setting.partition("=")
+            env[key] = value
+        self.log_path = os.path.join(args.workdir, "load", f"server-w{workers}.log")
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        self._log = open(self.log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=2)
+                try:
+                    status, _ = request(conn, "GET", "/health")
+                finally:
+                    conn.close()
+                if status == 200:
+                    return
+            except (OSError, http.client.HTTPException):
+                pass
+            time.sleep(0.5)
+        self.stop()
+        with open(self.log_path, "r") as f:
+            tail = f.read()[-2000:]
+        sys.exit(f"Server did not become ready within {timeout:.0f}s:\n{tail}")
+
+    def memory_mb(self):
+        """PSS of the server and all its descendants (shared pages of forked workers counted once)"""
+        return sum(_pss_kb(pid) for pid in _process_tree(self.process.pid)) / 1024
+
+    def start_sampling(self):
+        self.peak_mb = self.memory_mb()
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def stop_sampling(self):
+        self._stop.set()
+        self._sampler.join()
+        return round(self.peak_mb, 1)
+
+    def _sample(self):
+        while not self._stop.wait(MEMORY_SAMPLE_SECONDS):
+            self.peak_mb = max(self.peak_mb, self.memory_mb())
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._log.close()
+
+def _process_tree(root):
+    children = collections.defaultdict(list)
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # The command name may contain spaces; the parent pid follows the closing paren
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[ppid].append(int(entry))
+    tree, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, ()))
+    return tree
+
+def _pss_kb(pid):
+    for path, field in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1])
+        except OSError:
+            continue
+    return 0
+
+def request(conn, method, path, body=None, headers=None):
+    """One HTTP exchange; returns ``(status, response headers)`` after reading the whole body"""
+    conn.request(method, path, body=body, headers=headers or {})
+    response = conn.getresponse()
+    response.read()
+    return response.status, response.msg
+
+class Client:
+    """Sends ``/analyze`` uploads, cycling through the inputs and their copies"""
+
+    def __init__(self, port, inputs, query, timeout):
+        self.port = port
+        self.path = "/analyze" + (f"?{query}" if query else "")
+        self.timeout = timeout
+        # Every input in turn, moving to the next copy of each after a full round
+        copies = max(len(item["paths"]) for item in inputs)
+        self._next = itertools.cycle([(item, item["paths"][i % len(item["paths"])])
+                                      for i in range(copies) for item in inputs])
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def send(self):
+        """Returns one sample: ``{"input", "seconds", "status", "latency", "quality"}``"""
+        with self._lock:
+            item, path = next(self._next)
+        with open(path, "rb") as f:
+            data = f.read()
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="audio"; '
+                f'filename="{os.path.basename(path)}"\r\nContent-Type: application/octet-stream\r\n\r\n'
+                ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+        headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        sample = {"input": item["name"], "seconds": item["seconds"], "quality": None}
+        start = time.perf_counter()
+        try:
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+            sample["status"], response_headers = request(conn, "POST", self.path, body, headers)
+            sample["quality"] = response_headers.get("x-quality")
+        except (OSError, http.client.HTTPException) as e:
+            sample["status"] = type(e).__name__
+            conn.close()
+            self._local.conn = None
+        sample["latency"] = time.perf_counter() - start
+        return sample
+
+def closed_loop(client, concurrency, duration):
+    """``concurrency`` clients sending back to back until ``duration`` has passed"""
+    samples, lock = [], threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def user():
+        while time.perf_counter() < deadline:
+            sample = client.send()
+            with lock:
+                samples.append(sample)
+
+    threads = [threading.Thread(target=user) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+def open_loop(client, rate, duration, max_inflight, seed=0):
+    """Poisson arrivals at ``rate`` per second for ``duration``; arrivals beyond
+    ``max_inflight`` outstanding requests are counted as ``dropped``"""
+    samples, lock = [], threading.Lock()
+    inflight = threading.Semaphore(max_inflight)
+    rng = random.Random(seed)
+    threads = []
+
+    def send():
+        try:
+            sample = client.send()
+            with lock:
+                samples.append(sample)
+        finally:
+            inflight.release()
+
+    start = time.perf_counter()
+    arrival = rng.expovariate(rate)
+    while arrival < duration:
+        delay = start + arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        if inflight.acquire(blocking=False):
+            thread = threading.Thread(target=send)
+            thread.start()
+            threads.append(thread)
+        else:
+            with lock:
+                samples.append({"input": None, "seconds": 0.0, "status": "dropped", "latency": 0.0, "quality": None})
+        arrival += rng.expovariate(rate)
+    for thread in threads:
+        thread.join()
+    return samples
+
+def summarize(samples, elapsed):
+    ok = [s for s in samples if s["status"] == 200]
+    latencies = np.array([s["latency"] for s in ok]) * 1e3
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(ok) else (float("nan"),) * 3
+    errors = collections.Counter(str(s["status"]) for s in samples if s["status"] != 200)
+    by_input = collections.defaultdict(list)
+    for s in ok:
+        by_input[s["input"]].append(s["latency"] * 1e3)
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3),
+        "audio_seconds_per_s": round(sum(s["seconds"] for s in ok) / elapsed, 2),
+        "p50_ms": round(float(p50), 1), "p95_ms": round(float(p95), 1), "p99_ms": round(float(p99), 1),
+        "error_rate": round(1 - len(ok) / len(samples), 4) if samples else 0.0,
+        "errors": dict(errors),
+        "quality": dict(collections.Counter(s["quality"] for s in ok if s["quality"])),
+        "inputs": {name: {"count": len(values), "p50_ms": round(float(np.percentile(values, 50)), 1),
+                          "p95_ms": round(float(np.percentile(values, 95)), 1)}
+                   for name, values in sorted(by_input.items())},
+    }
+
+def run(args):
+    inputs = load_inputs(args)
+    levels = ([("concurrency", c) for c in args.concurrency or []]
+              + [("rate", r) for r in args.rate or []])
+    print(f"inputs: {', '.join(item['name'] for item in inputs)} "
+          f"({len(inputs[0]['paths'])} copies each), {args.duration:g}s per scenario", flush=True)
+    scenarios = {}
+    for workers in args.workers:
+        server = Server(workers, args)
+        try:
+            server.wait_ready(args.startup_timeout)
+            client = Client(server.port, inputs, args.query, args.timeout)
+            for item in inputs:
+                client.send()  # first decode of each format, not measured
+            idle_mb = round(server.memory_mb(), 1)
+            for kind, level in levels:
+                server.start_sampling()
+                start = time.perf_counter()
+                if kind == "concurrency":
+                    samples = closed_loop(client, level, args.duration)
+                else:
+                    samples = open_loop(client, level, args.duration, args.max_inflight)
+                elapsed = time.perf_counter() - start
+                key = f"workers={workers}/{kind}={level:g}"
+                result = scenarios[key] = summarize(samples, elapsed)
+                result["rss_idle_mb"], result["rss_peak_mb"] = idle_mb, server.stop_sampling()
+                errors = " ".join(f"{status}:{n}" for status, n in result["errors"].items())
+                quality = " ".join(f"{tier}:{n}" for tier, n in result["quality"].items())
+                print(f"{key:<28} {result['ok']:>5}/{result['requests']:<5} {result['throughput_rps']:>7.2f} req/s "
+                      f"p50 {result['p50_ms']:>8.0f} p95 {result['p95_ms']:>8.0f} p99 {result['p99_ms']:>8.0f} ms  "
+                      f"rss {result['rss_peak_mb']:>6.0f} MB  {errors or 'no errors'}  [{quality}]", flush=True)
+        finally:
+            server.stop()
+    config = {"inputs": [item["name"] for item in inputs], "copies": len(inputs[0]["paths"]),
+              "duration": args.duration, "query": args.query, "cache": args.cache, "env": args.env}
+    return {"environment": environment(), "config": config, "scenarios": scenarios}
+
+def compare(current, baseline, threshold):
+    """Print per-scenario changes against a baseline; returns the list of regressed scenarios"""
+    regressions = []
+    print(f"\n{'scenario':<28} {'req/s':>15} {'p95 ms':>17} {'errors':>13} {'rss MB':>13}")
+    for key, now in current["scenarios"].items():
+        base = baseline["scenarios"].get(key)
+        if base is None:
+            continue
+        flags = []
+        if now["throughput_rps"] < base["throughput_rps"] * (1 - threshold):
+            flags.append("LOWER-THROUGHPUT")
+        if now["p95_ms"] > base["p95_ms"] * (1 + threshold) and now["p95_ms"] - base["p95_ms"] > MIN_DELTA_MS:
+            flags.append("SLOWER")
+        if now["error_rate"] > base["error_rate"] + 0.01:
+            flags.append("MORE-ERRORS")
+        if (now["rss_peak_mb"] > base["rss_peak_mb"] * (1 + threshold)
+                and now["rss_peak_mb"] - base["rss_peak_mb"] > MIN_DELTA_MB):
+            flags.append("MORE-MEMORY")
+        print(f"{key:<28} {base['throughput_rps']:>7.2f}->{now['throughput_rps']:<7.2f} "
+              f"{base['p95_ms']:>8.0f}->{now['p95_ms']:<8.0f} {base['error_rate']:>6.1%}->{now['error_rate']:<6.1%} "
+              f"{base['rss_peak_mb']:>6.0f}->{now['rss_peak_mb']:<6.0f} {' '.join(flags)}")
+        if flags:
+            regressions.append(key)
+    if current["config"] != baseline.get("config"):
+        print("\nLoad configuration differs from baseline:")
+        for k, v in current["config"].items():
+            if baseline.get("config", {}).get(k) != v:
+                print(f"  {k}: {baseline.get('config', {}).get(k)} -> {v}")
+    changed = {k: (baseline["environment"].get(k), v) for k, v in current["environment"].items()
+               if baseline["environment"].get(k) != v}
+    if changed:
+        print("\nEnvironment differs from baseline:")
+        for k, (old, new) in changed.items():
+            print(f"  {k}: {old} -> {new}")
+    return regressions
+
+def _numbers(kind):
+    return lambda text: [kind(part) for part in text.split(",") if part]
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test POST /analyze on a locally started server")
+    parser.add_argument("--workers", type=_numbers(int), default=sorted({1, os.cpu_count() or 1}),
+                        help="comma-separated ANALYSIS_WORKERS values, one server each (default: 1 and all cores)")
+    parser.add_argument("--concurrency", type=_numbers(int), default=None,
+                        help="comma-separated closed-loop client counts (default: 1,4 unless --rate is given)")
+    parser.add_argument("--rate", type=_numbers(float), default=None,
+                        help="comma-separated open-loop arrival rates in requests/s (Poisson)")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per scenario")
+    parser.add_argument("--max-inflight", type=int, default=64, help="open loop: outstanding requests before dropping")
+    parser.add_argument("--inputs", nargs="*", default=list(DEFAULT_INPUTS),
+                        help="inputs whose name contains one of these strings (e.g. 5min, .mp3, test_snore)")
+    parser.add_argument("--variants", type=int, default=None,
+                        help="dithered copies per input (default: the largest concurrency)")
+    parser.add_argument("--query", default="", help="query string for /analyze, e.g. view=summary")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra server environment, e.g. ADAPTIVE_QUALITY=0 (repeatable)")
+    parser.add_argument("--cache", action="store_true", help="keep the result cache on and send identical uploads")
+    parser.add_argument("--timeout", type=float, default=600.0, help="per-request client timeout in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=180.0)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "sleepdiagnosis-bench"),
+                        help="where generated recordings are kept between runs")
+    parser.add_argument("--save", metavar="FILE", help="write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed regression ratio (0.15 = 15%%)")
+    args = parser.parse_args()
+    if args.concurrency is None and args.rate is None:
+        args.concurrency = [1, 4]
+
+    current = run(args)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"\nSaved baseline: {args.save}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} scenario(s) regressed beyond {args.threshold:.0%}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,48 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from typing import List
 import uvicorn
-import shutil
+import asyncio
+import base64
+import contextlib
+import functools
+import json
 import os
+import tarfile
+import tempfile
 import uuid
-from model import load_model, predict_from_file
+import zipfile
+import numpy as np
+from decoders import AUDIO_EXTENSIONS
+from model import load_model, predict_from_features, predict_probabilities, feature_config, warm_up, warmup_audio
+from streaming import StreamingAnalysis, open_live_session
+from cache import ResultCache, file_digest
+from workers import AnalysisPool, PoolSaturated, JobTimeout, WorkerCrashed, run_analysis, run_recording_analysis, run_feature_extraction
+from metrics import MetricsMiddleware, counter, expose, gauge, span
+from jobs import JobStore, JobRunner, JOB_MODES, JOBS_MAX_QUEUED, FINISHED
+from responses import negotiated_response, parse_include, shape_analysis
+from quality import QualityController, TIER_NAMES
+from tiles import TILE_FORMATS, encode_tile, read_tile
 import logging
 from fastapi.staticfiles import StaticFiles
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
+# LOG_LEVEL=DEBUG shows per-request detail and stage timings; it is skipped entirely at INFO
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 MODEL_PATH = "saved_model.joblib"
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024  # 50MB limit
+# Full-night recordings are spooled to disk and decoded in blocks, so they get their own, larger limit
+MAX_RECORDING_BYTES = int(os.environ.get("MAX_RECORDING_BYTES", 2 * 1024 ** 3))
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", 500))
+# Network chunks are batched to this size before being decoded, to amortise per-call overhead
+STREAM_BLOCK_BYTES = 256 * 1024
+# Run the pipeline once at startup (in this process and every pool worker) before reporting ready
+WARMUP = os.environ.get("WARMUP", "1") != "0"
+# Concurrent /analyze/live sessions; each holds a decoder and a rolling window in memory
+MAX_LIVE_SESSIONS = int(os.environ.get("MAX_LIVE_SESSIONS", 16))
 
 app = FastAPI(
     title="SleepGuard API", 
@@ -38,9 +67,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Cache", "X-Quality", "X-Tile-Shape", "Content-Encoding"],
 )
+app.add_middleware(MetricsMiddleware)
 
 model = None
+analysis_pool = AnalysisPool()
+result_cache = ResultCache()
+quality_controller = QualityController(analysis_pool)
+warmup_state = {"ready": False, "seconds": None, "error": None}
+live_sessions = 0
+job_store = JobStore()
+job_runner = JobRunner(job_store, analysis_pool, result_cache)
+# Seconds between job status polls on /jobs/{id}/events, and between keep-alive comments
+JOB_EVENTS_POLL = 0.5
+JOB_EVENTS_KEEPALIVE = 15.0
 
 # Mount static files (for serving the frontend)
 app.mount("/static", StaticFiles(directory="../"), name="static")
@@ -64,6 +105,41 @@ def startup_event():
     except Exception as e:
         logger.error(f"Error loading model: {e}")
         model = None
+    analysis_pool.start(MODEL_PATH, model, warm=WARMUP)
+    result_cache.set_version(file_digest(MODEL_PATH) or getattr(model, "digest", None) or "heuristic",
+                             feature_config())
+    logger.info(f"Analysis pool started: {analysis_pool.workers} {analysis_pool.kind} workers, "
+                f"queue size {analysis_pool.queue_size}, timeout {analysis_pool.timeout:.0f}s")
+    job_runner.start()
+    if WARMUP:
+        app.state.warmup_task = asyncio.get_event_loop().create_task(warm_up_service())
+    else:
+        warmup_state["ready"] = True
+
+def _warm_up_streaming(data):
+    session = StreamingAnalysis(filename="warmup.wav")
+    session.feed(data)
+    predict_from_features(session.finish(), model)
+
+async def warm_up_service():
+    """Warm this process (streaming and thread-pool paths) and every pool worker, then flip readiness"""
+    started = asyncio.get_running_loop().time()
+    try:
+        data = await asyncio.to_thread(warmup_audio)
+        await asyncio.to_thread(warm_up, model, data)
+        await asyncio.to_thread(_warm_up_streaming, data)
+        await analysis_pool.warm_up()
+    except Exception as e:
+        logger.warning(f"Warm-up failed, serving anyway: {e}")
+        warmup_state["error"] = str(e)
+    warmup_state["seconds"] = round(asyncio.get_running_loop().time() - started, 3)
+    warmup_state["ready"] = True
+    logger.info(f"Warm-up finished in {warmup_state['seconds']:.2f}s")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_runner.stop()
+    analysis_pool.shutdown()
 
 @app.get("/")
 async def root():
@@ -71,19 +147,90 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {
-        "status": "ok", 
+    # 503 until warm-up completes, so health-checked load balancers keep traffic off cold instances
+    pool = analysis_pool.stats()
+    jobs = await asyncio.to_thread(job_store.counts)
+    status = "warming_up" if not warmup_state["ready"] else "pool_broken" if pool["broken"] else "ok"
+    return JSONResponse(status_code=200 if status == "ok" else 503, content={
+        "status": status,
+        "ready": warmup_state["ready"],
+        "warmup": warmup_state,
         "model_loaded": model is not None,
+        "analysis_pool": pool,
+        "cache": result_cache.stats(),
+        "quality": quality_controller.stats(),
+        "jobs": jobs,
         "service": "SleepGuard API",
         "version": "1.0.0"
-    }
+    })
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition: stage/request latency histograms plus pool and cache state"""
+    pool = analysis_pool.stats()
+    cache = result_cache.stats()
+    jobs = await asyncio.to_thread(job_store.counts)
+    quality = quality_controller.stats()
+    return PlainTextResponse(expose(
+        gauge("sleepdiagnosis_ready", "1 once startup warm-up has finished", int(warmup_state["ready"])),
+        gauge("sleepdiagnosis_pool_workers", "Analysis pool worker count", pool["workers"]),
+        gauge("sleepdiagnosis_pool_in_flight", "Analysis jobs currently running", pool["in_flight"]),
+        gauge("sleepdiagnosis_pool_queued", "Analysis jobs waiting for a worker", pool["queued"]),
+        gauge("sleepdiagnosis_pool_queue_size", "Maximum queued analysis jobs before 503", pool["queue_size"]),
+        gauge("sleepdiagnosis_pool_avg_job_seconds", "Moving average analysis job duration", pool["avg_job_seconds"]),
+        counter("sleepdiagnosis_pool_restarts_total", "Process pool rebuilds after a worker died", pool["restarts"]),
+        gauge("sleepdiagnosis_jobs_queued", "Jobs waiting in the persistent queue", jobs.get("queued", 0)),
+        gauge("sleepdiagnosis_jobs_running", "Jobs currently being analysed", jobs.get("running", 0)),
+        gauge("sleepdiagnosis_live_sessions", "Open /analyze/live WebSocket sessions", live_sessions),
+        gauge("sleepdiagnosis_quality_level", "Current /analyze quality tier (0 = full, 3 = features only)",
+              TIER_NAMES.index(quality["tier"])),
+        counter("sleepdiagnosis_quality_served_total", "/analyze responses by quality tier since start",
+                quality["served"], label="tier"),
+        gauge("sleepdiagnosis_cache_entries", "Result cache entries in memory", cache["entries"]),
+        gauge("sleepdiagnosis_cache_bytes", "Result cache memory usage", cache["bytes"]),
+        *(counter(f"sleepdiagnosis_cache_{name}_total", f"Result cache {name.replace('_', ' ')} since start", cache[name])
+          for name in ("memory_hits", "disk_hits", "misses", "shared", "evictions")),
+    ), media_type="text/plain; version=0.0.4")
+
+def spectrogram_url(result_id):
+    return f"/spectrogram/{result_id}"
+
+def tile_url(prefix):
+    """URL template of a result's spectrogram tiles; the client fills in level, x and y"""
+    return prefix + "/tiles/{level}/{x}/{y}"
+
+def tile_response(spectrogram, level, x, y, format, cache_control):
+    """One tile of a result's spectrogram pyramid as PNG, or its raw uint8 codes with ``format=raw``"""
+    if format not in TILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(TILE_FORMATS)}")
+    pyramid = (spectrogram or {}).get("tiles")
+    if not pyramid:
+        raise HTTPException(status_code=404, detail="Spectrogram tiles not found or expired; analyze the audio again")
+    try:
+        codes = read_tile(pyramid, level, x, y)
+    except LookupError:
+        raise HTTPException(status_code=404, detail=f"No tile {level}/{x}/{y}")
+    content, media_type = encode_tile(codes, format)
+    return Response(content=content, media_type=media_type,
+                    headers={"Cache-Control": cache_control, "X-Tile-Shape": f"{codes.shape[0]},{codes.shape[1]}"})
 
 @app.post("/analyze")
-async def analyze(audio: UploadFile = File(...)):
-    logger.info(f"Received file: {audio.filename}, content-type: {audio.content_type}, size: {audio.size if hasattr(audio, 'size') else 'unknown'}")
+async def analyze(request: Request, audio: UploadFile = File(...), include: str = None,
+                  view: str = None, format: str = None):
+    """Analyze one uploaded recording.
+
+    ``view=summary`` returns only the label and probability; ``include`` picks
+    parts of the full result (``features``, ``spectrogram``, ``frequency_analysis``,
+    ``note``, and ``image`` to embed the spectrogram instead of linking it via
+    ``spectrogram.image_url``). ``format=msgpack`` or ``Accept: application/msgpack``
+    selects MessagePack; large bodies are compressed per ``Accept-Encoding``.
+    Under load the spectrogram is degraded or skipped; ``quality`` says which tier was served.
+    """
+    fields = parse_include(include, view)
+    logger.debug("Received file: %s, content-type: %s, size: %s", audio.filename, audio.content_type, getattr(audio, "size", "unknown"))
     
     # Enhanced file validation - prioritize MP3 and WAV for optimal spectrogram generation
-    valid_extensions = ('.mp3', '.wav', '.m4a', '.flac', '.webm', '.ogg')
+    valid_extensions = AUDIO_EXTENSIONS
     # Accept more content types for browser recordings, prioritize MP3
     valid_content_types = ('audio/mpeg', 'audio/mp3', 'audio/wav', 'audio/', 'video/webm', 'application/octet-stream', None)
     
@@ -91,11 +238,11 @@ async def analyze(audio: UploadFile = File(...)):
     content_type_valid = (audio.content_type is None or 
                          any(audio.content_type.startswith(ct) for ct in valid_content_types if ct is not None))
     
-    logger.info(f"File validation: extension={file_extension}, content_type={audio.content_type}")
+    logger.debug("File validation: extension=%s, content_type=%s", file_extension, audio.content_type)
     
     # Log if MP3 format detected for optimal processing
     if file_extension == '.mp3' or (audio.content_type and 'mpeg' in audio.content_type):
-        logger.info("MP3 format detected - optimal for spectrogram generation and sleep apnea analysis")
+        logger.debug("MP3 format detected - optimal for spectrogram generation and sleep apnea analysis")
     
     # For browser recordings, be more lenient - allow if either extension OR content type is valid
     if file_extension and file_extension not in valid_extensions and not content_type_valid:
@@ -105,55 +252,62 @@ async def analyze(audio: UploadFile = File(...)):
             detail="Invalid audio file. Please upload a supported audio file (MP3 recommended for best results)."
         )
 
-    # Create tmp directory if it doesn't exist
-    os.makedirs("tmp_uploads", exist_ok=True)
-    
-    # Save uploaded file temporarily
     file_id = str(uuid.uuid4())
-    ext = os.path.splitext(audio.filename)[1] or ".wav"
-    tmp_path = os.path.join("tmp_uploads", file_id + ext)
 
     try:
         # Read and validate file size
-        file_content = await audio.read()
+        with span("read"):
+            file_content = await audio.read()
         file_size = len(file_content)
-        logger.info(f"File read successfully: {file_size} bytes")
+        logger.debug("File read successfully: %d bytes", file_size)
         
         if file_size == 0:
             raise HTTPException(status_code=400, detail="Empty audio file")
         
-        if file_size > 50 * 1024 * 1024:  # 50MB limit
+        if file_size > MAX_UPLOAD_BYTES:
             raise HTTPException(status_code=400, detail="File too large (max 50MB)")
         
-        with open(tmp_path, "wb") as buffer:
-            buffer.write(file_content)
-        
-        logger.info(f"File saved to {tmp_path} ({file_size} bytes), processing...")
-        
-        # Verify file exists and is readable
-        if not os.path.exists(tmp_path):
-            raise Exception("File was not saved properly")
-            
-        actual_size = os.path.getsize(tmp_path)
-        logger.info(f"File verification: expected {file_size} bytes, actual {actual_size} bytes")
-        
-        # Process the audio file
-        result = predict_from_file(tmp_path, model)
+        # Resubmissions of the same recording are served from the result cache;
+        # otherwise decode straight from memory, off the event loop
+        with span("cache_key"):
+            cache_key = await asyncio.to_thread(result_cache.key, file_content)
+        tier = quality_controller.tier()
+        result = None
+        if tier != "full":
+            # A full-quality result already cached beats a degraded recompute
+            result = await asyncio.to_thread(result_cache.get, cache_key)
+            cache_status = "hit"
+            if result is None:
+                cache_key = f"{cache_key}.{tier}"
+        if result is None:
+            result, cache_status = await result_cache.get_or_compute(
+                cache_key, lambda: analysis_pool.submit(run_analysis, file_content, audio.filename, tier))
+        served = result.get("quality", "full")
+        quality_controller.record(served)
         
-        logger.info(f"Analysis complete: {result['label']} with probability {result['probability']:.3f}")
+        logger.debug("Analysis complete (%s, %s quality): %s with probability %.3f", cache_status, served,
+                     result["label"], result["probability"])
         
         # Return formatted result
-        return JSONResponse(content={
-            "success": True,
-            "label": result["label"],
-            "probability": result["probability"],
-            "confidence_score": round(result["probability"] * 100),
-            "features": result.get("features", {}),
-            "spectrogram": result.get("spectrogram", {}),
-            "note": result.get("note", "Analysis completed"),
-            "timestamp": file_id
-        })
+        with span("serialize"):
+            body = shape_analysis(result, fields, image_url=spectrogram_url(cache_key),
+                                  tile_url=tile_url(spectrogram_url(cache_key)),
+                                  result_id=cache_key, timestamp=file_id, quality=served)
+            return negotiated_response(request, body, format,
+                                       headers={"X-Cache": cache_status, "X-Quality": served})
         
+    except HTTPException:
+        raise
+    except PoolSaturated as e:
+        logger.warning(f"Rejecting {audio.filename}: {e}")
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly",
+                            headers={"Retry-After": str(e.retry_after)})
+    except JobTimeout as e:
+        logger.error(f"Timed out processing {audio.filename}: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except WorkerCrashed as e:
+        logger.error(f"Worker crashed processing {audio.filename}: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Processing error for file {audio.filename}: {str(e)}")
         logger.error(f"Error type: {type(e).__name__}")
@@ -164,7 +318,7 @@ async def analyze(audio: UploadFile = File(...)):
         error_message = str(e)
         if "Empty audio file" in error_message:
             status_code = 400
-        elif "Could not load audio" in error_message or "librosa" in error_message:
+        elif "Could not load audio" in error_message or "Cannot decode" in error_message or "librosa" in error_message:
             status_code = 422
             error_message = "Audio file format not supported or corrupted"
         elif "No such file" in error_message:
@@ -175,14 +329,509 @@ async def analyze(audio: UploadFile = File(...)):
             error_message = f"Audio processing failed: {error_message}"
             
         raise HTTPException(status_code=status_code, detail=error_message)
+
+@app.post("/analyze/stream")
+async def analyze_stream(request: Request, filename: str = None, include: str = None,
+                         view: str = None, format: str = None):
+    """Analyze an audio file sent as the raw request body.
+
+    The body is decoded and folded into running feature accumulators while it
+    is still arriving, so memory stays bounded regardless of upload size and
+    analysis overlaps with the network transfer. The whole signal is analysed
+    (no activity gating). Response options as for /analyze.
+    """
+    fields = parse_include(include, view)
+    logger.debug("Streaming upload: filename=%s, content-type=%s", filename, request.headers.get("content-type"))
+    session = StreamingAnalysis(filename=filename)
+    # Keyed apart from /analyze: the streamed preview image and features differ slightly,
+    # and streamed features are never activity-gated
+    digest = result_cache.hasher("stream", "whole-signal")
+    file_id = str(uuid.uuid4())
+    finished = False
+
+    try:
+        with analysis_pool.reserve():
+            pending = []
+            pending_size = 0
+            async for chunk in request.stream():
+                if session.bytes_received + pending_size + len(chunk) > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=400, detail="File too large (max 50MB)")
+                pending.append(chunk)
+                pending_size += len(chunk)
+                if pending_size >= STREAM_BLOCK_BYTES:
+                    block = b"".join(pending)
+                    digest.update(block)
+                    await asyncio.to_thread(session.feed, block)
+                    pending, pending_size = [], 0
+            if pending:
+                block = b"".join(pending)
+                digest.update(block)
+                await asyncio.to_thread(session.feed, block)
+
+            if session.bytes_received == 0:
+                raise HTTPException(status_code=400, detail="Empty audio file")
+
+            feat = await asyncio.to_thread(session.finish)
+            finished = True
+            result = await asyncio.to_thread(predict_from_features, feat, model)
+
+        logger.debug("Streamed analysis complete (%d bytes): %s with probability %.3f",
+                     session.bytes_received, result["label"], result["probability"])
+        # Cached so the spectrogram can be fetched by URL like /analyze results
+        result_id = digest.hexdigest()
+        await asyncio.to_thread(result_cache.put, result_id, result)
+        with span("serialize"):
+            body = shape_analysis(result, fields, image_url=spectrogram_url(result_id),
+                                  result_id=result_id, timestamp=file_id)
+            return negotiated_response(request, body, format)
+
+    except HTTPException:
+        raise
+    except PoolSaturated as e:
+        logger.warning(f"Rejecting streamed upload: {e}")
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly",
+                            headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        logger.error(f"Streamed upload could not be decoded: {e}")
+        raise HTTPException(status_code=422, detail=f"Audio processing failed: {e}")
     finally:
-        # Clean up temporary file
+        if not finished:
+            # Too large, disconnected or undecodable: stop the decoder (an ffmpeg process) now
+            session.abort()
+
+@app.get("/spectrogram/{result_id}")
+async def spectrogram_image(result_id: str):
+    """Spectrogram image of an /analyze result, referenced by ``spectrogram.image_url``.
+
+    Results are content-addressed, so the image never changes for a given id.
+    """
+    result = await asyncio.to_thread(result_cache.get, result_id)
+    image = (result or {}).get("spectrogram", {}).get("image_base64")
+    if not image:
+        raise HTTPException(status_code=404, detail="Spectrogram not found or expired; analyze the audio again")
+    return Response(content=base64.b64decode(image), media_type=result["spectrogram"].get("image_mime", "image/png"),
+                    headers={"Cache-Control": "public, max-age=86400, immutable", "ETag": f'"{result_id}"'})
+
+@app.get("/spectrogram/{result_id}/tiles/{level}/{x}/{y}")
+async def spectrogram_tile(result_id: str, level: int, x: int, y: int, format: str = "png"):
+    """One tile of an /analyze result's spectrogram pyramid (described by ``spectrogram.tiles``).
+
+    Level 0 is full resolution and each level halves the time axis; ``y`` counts
+    up from the lowest frequencies. Rendering cost and size are the same for
+    every tile, however long the recording.
+    """
+    result = await asyncio.to_thread(result_cache.get, result_id)
+    return await asyncio.to_thread(tile_response, (result or {}).get("spectrogram"), level, x, y, format,
+                                   "public, max-age=86400, immutable")
+
+@app.websocket("/analyze/live")
+async def analyze_live(websocket: WebSocket):
+    """Live capture: audio chunks in, rolling-window score updates out.
+
+    The first message is a JSON config such as ``{"encoding": "pcm_s16le",
+    "sample_rate": 48000, "channels": 1, "window": 10, "interval": 1}``
+    (``encoding`` may also be ``pcm_f32le`` or ``opus`` for MediaRecorder
+    WebM/Ogg). Every following binary message is audio; an update with the
+    probability and band energies is pushed every ``interval`` seconds of
+    audio. Sending ``{"type": "end"}`` returns a session summary and closes.
+    """
+    global live_sessions
+    await websocket.accept()
+    if live_sessions >= MAX_LIVE_SESSIONS:
+        await websocket.close(code=1013, reason="Server busy, please retry shortly")
+        return
+
+    live_sessions += 1
+    session = None
+    try:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
         try:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-                logger.info(f"Cleaned up temporary file: {tmp_path}")
-        except Exception as e:
-            logger.warning(f"Failed to clean up {tmp_path}: {e}")
+            config = json.loads(message.get("text") or "")
+            if not isinstance(config, dict):
+                raise ValueError("The first message must be a JSON object")
+            session = await asyncio.to_thread(open_live_session, config, model)
+        except ValueError as e:
+            await websocket.send_json({"type": "error", "detail": f"Invalid live session config: {e}"})
+            await websocket.close(code=1003)
+            return
+        await websocket.send_json({"type": "ready", "sample_rate": session.sr,
+                                   "window": session.window, "interval": session.interval})
+
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes"):
+                update = await asyncio.to_thread(session.feed, message["bytes"])
+                if update is not None:
+                    await websocket.send_json(update)
+            elif message.get("text"):
+                try:
+                    command = json.loads(message["text"])
+                except ValueError:
+                    command = None
+                if isinstance(command, dict) and command.get("type") == "end":
+                    await websocket.send_json(await asyncio.to_thread(session.finish))
+                    await websocket.close()
+                    session = None
+                    break
+    except WebSocketDisconnect:
+        pass
+    except ValueError as e:
+        logger.warning(f"Live session could not be decoded: {e}")
+        await websocket.send_json({"type": "error", "detail": f"Audio processing failed: {e}"})
+        await websocket.close(code=1003)
+    finally:
+        live_sessions -= 1
+        if session is not None:
+            session.abort()
+
+@app.post("/analyze/recording")
+async def analyze_recording_upload(request: Request, audio: UploadFile = File(...), view: str = None,
+                                   format: str = None):
+    """Full-night mode: score the whole recording in 30 s epochs.
+
+    Unlike /analyze there is no 5 minute cap; the response carries a per-epoch
+    timeline and aggregate statistics such as events per hour instead of a
+    spectrogram image. ``view=summary`` leaves out the timeline.
+    """
+    parse_include(view=view)
+    logger.debug("Received recording: %s, content-type: %s", audio.filename, audio.content_type)
+    if analysis_pool.saturated:
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly",
+                            headers={"Retry-After": str(analysis_pool.retry_after())})
+
+    # Spooled to a file rather than read into memory: the epoch decoder reads it block by block
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(audio.filename or "")[1])
+    os.close(fd)
+    try:
+        size = await asyncio.to_thread(_spool_upload, audio.file, path, limit=MAX_RECORDING_BYTES)
+        if not size:
+            raise HTTPException(status_code=400, detail="Empty audio file" if size == 0 else
+                                f"File too large (max {MAX_RECORDING_BYTES // 2**20}MB)")
+        result = await analysis_pool.submit(run_recording_analysis, path, audio.filename)
+    except PoolSaturated as e:
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly",
+                            headers={"Retry-After": str(e.retry_after)})
+    except JobTimeout as e:
+        logger.error(f"Timed out processing recording {audio.filename}: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except WorkerCrashed as e:
+        logger.error(f"Worker crashed processing recording {audio.filename}: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except ValueError as e:
+        logger.error(f"Recording {audio.filename} could not be analysed: {e}")
+        raise HTTPException(status_code=422, detail=f"Audio processing failed: {e}")
+    finally:
+        await asyncio.to_thread(os.remove, path)
+
+    summary = result["summary"]
+    logger.debug("Recording analysis complete: %d epochs, %.1f events/hour, label %s",
+                 summary["epochs"], summary["events_per_hour"], result["label"])
+    with span("serialize"):
+        return negotiated_response(request, _recording_body(result, view, timestamp=str(uuid.uuid4())), format)
+
+def _recording_body(result, view=None, **extra):
+    body = {
+        "success": True,
+        "label": result["label"],
+        "probability": result["probability"],
+        "confidence_score": round(result["probability"] * 100),
+        "summary": result["summary"],
+        "note": result["note"],
+        **extra,
+    }
+    if view != "summary":
+        body["epochs"] = result["epochs"]
+    return body
+
+def _job_status(job):
+    status = {key: job[key] for key in ("mode", "filename", "status", "stage", "progress", "error",
+                                        "created", "started", "finished", "expires")}
+    return {"job_id": job["id"], **status}
+
+def _spool_upload(upload, path, digest=None, limit=MAX_UPLOAD_BYTES):
+    """Copy an upload to ``path`` (hashing it on the way); returns the size or None if over ``limit``"""
+    size = 0
+    with open(path, "wb") as out:
+        for block in iter(lambda: upload.read(1 << 20), b""):
+            size += len(block)
+            if size > limit:
+                return None
+            if digest is not None:
+                digest.update(block)
+            out.write(block)
+    return size
+
+@app.post("/jobs", status_code=202)
+async def create_job(audio: UploadFile = File(...), mode: str = "analyze"):
+    """Queue an analysis and return at once; poll ``/jobs/{id}`` or follow ``/jobs/{id}/events``.
+
+    ``mode`` is ``analyze`` (as /analyze, first 5 minutes) or ``recording``
+    (full-night epochs, as /analyze/recording). Jobs survive restarts and
+    finished results are kept for ``JOBS_RETENTION`` seconds.
+    """
+    if mode not in JOB_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(JOB_MODES)}")
+    counts = await asyncio.to_thread(job_store.counts)
+    if counts.get("queued", 0) >= JOBS_MAX_QUEUED:
+        raise HTTPException(status_code=503, detail="Job queue is full, please retry later",
+                            headers={"Retry-After": str(analysis_pool.retry_after())})
+
+    job_id = job_store.new_id()
+    path = job_store.spool_path(job_id)
+    # Keyed like /analyze so finished jobs and direct requests share results
+    digest = result_cache.hasher() if mode == "analyze" else None
+    limit = MAX_RECORDING_BYTES if mode == "recording" else MAX_UPLOAD_BYTES
+    try:
+        size = await asyncio.to_thread(_spool_upload, audio.file, path, digest, limit)
+        if not size:
+            raise HTTPException(status_code=400, detail="Empty audio file" if size == 0 else
+                                f"File too large (max {limit // 2**20}MB)")
+        await asyncio.to_thread(job_store.create, job_id, mode, audio.filename,
+                                digest.hexdigest() if digest is not None else None)
+    except BaseException:
+        # Without a job row the sweep never finds the file (disk full, aborted upload, database error)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        raise
+    job_runner.notify()
+    logger.debug("Queued job %s (%s, %d bytes)", job_id, mode, size)
+
+    return JSONResponse(status_code=202, headers={"Location": f"/jobs/{job_id}"}, content={
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+    })
+
+async def _get_job(job_id, with_result=True):
+    job = await asyncio.to_thread(job_store.get, job_id, with_result)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(request: Request, job_id: str, include: str = None, view: str = None, format: str = None):
+    """Job status, stage and percent complete; finished jobs carry their result
+    (shaped by ``include``/``view``/``format`` as for /analyze and /analyze/recording)."""
+    fields = parse_include(include, view)
+    job = await _get_job(job_id)
+    body = _job_status(job)
+    result = job.get("result")
+    if result is not None:
+        if job["mode"] == "recording":
+            body["result"] = _recording_body(result, view)
+        else:
+            body["result"] = shape_analysis(result, fields, image_url=f"/jobs/{job_id}/spectrogram",
+                                            tile_url=tile_url(f"/jobs/{job_id}/spectrogram"),
+                                            result_id=job["cache_key"])
+    return negotiated_response(request, body, format)
+
+@app.get("/jobs/{job_id}/spectrogram")
+async def job_spectrogram(job_id: str):
+    """Spectrogram image of a finished ``analyze`` job, kept as long as the job"""
+    job = await _get_job(job_id)
+    spectrogram = (job.get("result") or {}).get("spectrogram") or {}
+    if not spectrogram.get("image_base64"):
+        raise HTTPException(status_code=404, detail="No spectrogram for this job")
+    return Response(content=base64.b64decode(spectrogram["image_base64"]),
+                    media_type=spectrogram.get("image_mime", "image/png"),
+                    headers={"Cache-Control": "private, max-age=3600"})
+
+@app.get("/jobs/{job_id}/spectrogram/tiles/{level}/{x}/{y}")
+async def job_spectrogram_tile(job_id: str, level: int, x: int, y: int, format: str = "png"):
+    """One spectrogram tile of a finished ``analyze`` job (as ``/spectrogram/{id}/tiles/...``)"""
+    job = await _get_job(job_id)
+    return await asyncio.to_thread(tile_response, (job.get("result") or {}).get("spectrogram"), level, x, y, format,
+                                   "private, max-age=3600")
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events: a ``progress`` event whenever the stage or percent changes,
+    then one ``done`` or ``failed`` event before the stream ends."""
+    await _get_job(job_id, with_result=False)
+
+    async def events():
+        last = None
+        quiet = 0.0
+        while True:
+            job = await asyncio.to_thread(job_store.get, job_id, False)
+            if job is None:
+                yield f"event: failed\ndata: {json.dumps({'job_id': job_id, 'error': 'Job expired'})}\n\n"
+                return
+            state = (job["status"], job["stage"], job["progress"])
+            if state != last:
+                event = job["status"] if job["status"] in FINISHED else "progress"
+                yield f"event: {event}\ndata: {json.dumps(_job_status(job))}\n\n"
+                last, quiet = state, 0.0
+            elif quiet >= JOB_EVENTS_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                quiet = 0.0
+            if job["status"] in FINISHED:
+                return
+            await asyncio.sleep(JOB_EVENTS_POLL)
+            quiet += JOB_EVENTS_POLL
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _read_tar_member(archive, member):
+    return archive.extractfile(member).read()
+
+def _raise(error):
+    raise error
+
+def _batch_items(files):
+    """Yield ``(filename, read)`` for every audio file in a batch upload, expanding zip/tar archives.
+
+    ``read`` returns the bytes lazily so only files currently being analysed
+    are held in memory. An unreadable archive yields a single item whose
+    ``read`` raises, so the rest of the batch still runs.
+    """
+    for upload in files:
+        name = upload.filename or "upload"
+        lower = name.lower()
+        try:
+            if lower.endswith(".zip"):
+                archive = zipfile.ZipFile(upload.file)
+                members = [(info.filename, functools.partial(archive.read, info))
+                           for info in archive.infolist()
+                           if not info.is_dir() and info.filename.lower().endswith(AUDIO_EXTENSIONS)]
+            elif lower.endswith((".tar", ".tar.gz", ".tgz")):
+                archive = tarfile.open(fileobj=upload.file, mode="r:*")
+                members = [(member.name, functools.partial(_read_tar_member, archive, member))
+                           for member in archive.getmembers()
+                           if member.isfile() and member.name.lower().endswith(AUDIO_EXTENSIONS)]
+            else:
+                members = [(name, upload.file.read)]
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            members = [(name, functools.partial(_raise, ValueError(f"Unreadable archive: {e}")))]
+        yield from members
+
+async def _extract_with_retry(data, filename, spectrogram):
+    """Submit one batch item, waiting out pool saturation instead of failing the whole batch"""
+    while True:
+        try:
+            return await analysis_pool.submit(run_feature_extraction, data, filename, spectrogram)
+        except PoolSaturated as e:
+            await asyncio.sleep(min(e.retry_after, 1))
+
+@app.post("/analyze/batch")
+async def analyze_batch(files: List[UploadFile] = File(...), spectrogram: bool = False):
+    """Analyze many recordings in one request (multiple files and/or zip/tar archives).
+
+    Features are extracted in parallel on the analysis pool. Whatever has
+    finished extracting is scored together with one ``predict_proba`` call
+    and streamed straight away, so results (and spectrograms) are not held
+    until the whole batch is done. The response is NDJSON: one line per file,
+    in completion order, and a final ``summary`` line.
+    """
+    if analysis_pool.saturated:
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly",
+                            headers={"Retry-After": str(analysis_pool.retry_after())})
+    spectrogram_mode = "image" if spectrogram else "analysis"
+    logger.debug("Batch upload with %d part(s), spectrogram=%s", len(files), spectrogram)
+
+    async def results():
+        slots = asyncio.Semaphore(analysis_pool.workers)
+        done = asyncio.Queue()
+        count = 0
+
+        async def extract(index, filename, read):
+            try:
+                data = await asyncio.to_thread(read)
+                if len(data) == 0:
+                    raise ValueError("Empty audio file")
+                if len(data) > MAX_UPLOAD_BYTES:
+                    raise ValueError("File too large (max 50MB)")
+                feat = await _extract_with_retry(data, filename, spectrogram_mode)
+                await done.put((index, filename, feat, None))
+            except Exception as e:
+                await done.put((index, filename, None, e))
+            finally:
+                slots.release()
+
+        truncated = False
+        tasks = set()
+
+        async def produce():
+            nonlocal count, truncated
+            items = _batch_items(files)
+            try:
+                while True:
+                    await slots.acquire()
+                    item = await asyncio.to_thread(next, items, None)
+                    if item is None or count >= MAX_BATCH_FILES:
+                        truncated = item is not None
+                        slots.release()
+                        break
+                    task = asyncio.create_task(extract(count, *item))
+                    # The loop only keeps weak references to tasks
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    count += 1
+                # Wait for the in-flight extractions by draining every slot
+                for _ in range(analysis_pool.workers):
+                    await slots.acquire()
+            finally:
+                await done.put(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            scored = failed = 0
+            finished = False
+            while not finished:
+                # Score every extraction that has completed since the last pass as one micro-batch
+                entries = [await done.get()]
+                while not done.empty():
+                    entries.append(done.get_nowait())
+                batch = []
+                for entry in entries:
+                    if entry is None:
+                        finished = True
+                        continue
+                    index, filename, feat, error = entry
+                    if error is not None:
+                        failed += 1
+                        yield json.dumps({"index": index, "filename": filename, "success": False,
+                                          "error": str(error)}) + "\n"
+                    else:
+                        batch.append((index, filename, feat))
+                if not batch:
+                    continue
+                scored += len(batch)
+                X = np.vstack([feat["vector"] for _, _, feat in batch])
+                probs, note = await asyncio.to_thread(predict_probabilities, X, model)
+                for (index, filename, feat), prob in zip(batch, probs):
+                    prob = float(prob)
+                    yield json.dumps({
+                        "index": index,
+                        "filename": filename,
+                        "success": True,
+                        "label": "likely_apnea" if prob >= 0.5 else "unlikely",
+                        "probability": prob,
+                        "confidence_score": round(prob * 100),
+                        "features": feat["summary"],
+                        "spectrogram": feat["spectrogram"],
+                        "analysed_fraction": feat["activity"]["analysed_fraction"],
+                        "note": note,
+                    }) + "\n"
+
+            await producer
+
+            logger.debug("Batch complete: %d scored, %d failed", scored, failed)
+            yield json.dumps({"summary": {"files": count, "scored": scored, "failed": failed,
+                                          "truncated": truncated}}) + "\n"
+        finally:
+            # A disconnected client stops the batch: no more items are read or extracted
+            producer.cancel()
+            for task in list(tasks):
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
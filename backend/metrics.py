@@ -0,0 +1,248 @@
+import bisect
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets in seconds, from sub-millisecond stages up to whole-night recordings
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values (Prometheus semantics)"""
+
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+        for label_values, (counts, total, count) in sorted(series.items()):
+            labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            braced = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{braced} {total}")
+            lines.append(f"{self.name}_count{braced} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+            braced = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}{braced} {value}")
+        return lines
+
+# Peak memory buckets in bytes, 8 MB to 4 GB
+MEMORY_BUCKETS = tuple(2 ** i * 2 ** 20 for i in range(3, 13))
+
+STAGE_SECONDS = Histogram("sleepdiagnosis_stage_seconds", "Time spent in one pipeline stage", ("stage",))
+REQUEST_SECONDS = Histogram("sleepdiagnosis_request_seconds", "HTTP request latency", ("route", "method"))
+PEAK_MEMORY = Histogram("sleepdiagnosis_request_peak_memory_bytes",
+                        "Peak resident memory growth of the process that ran the request's analysis",
+                        ("route",), MEMORY_BUCKETS)
+REQUESTS_TOTAL = Counter("sleepdiagnosis_requests_total", "HTTP requests by status", ("route", "method", "status"))
+
+class Trace:
+    """Stage durations collected for one request (or one pool job)"""
+
+    def __init__(self):
+        self.spans = {}
+        self.peak_memory = None
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def add_memory(self, nbytes):
+        with self._lock:
+            self.peak_memory = max(self.peak_memory or 0, nbytes)
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_stage_listener = contextvars.ContextVar("stage_listener", default=None)
+
+@contextlib.contextmanager
+def collect_spans():
+    """Collect every ``span`` run in this context (and in threads started via asyncio.to_thread)"""
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+def record(stage, seconds):
+    """Attribute ``seconds`` to ``stage`` in the active trace, or straight to the histogram"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+    else:
+        STAGE_SECONDS.observe(seconds, stage)
+
+def record_spans(spans):
+    for stage, seconds in spans.items():
+        record(stage, seconds)
+
+def record_memory(nbytes):
+    """Attribute a peak memory reading to the active trace"""
+    trace = _current_trace.get()
+    if trace is not None and nbytes is not None:
+        trace.add_memory(nbytes)
+
+def _proc_status_kb(field):
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise OSError(f"{field} not in /proc/self/status")
+
+@contextlib.contextmanager
+def track_peak_memory():
+    """Measure how far this process's resident memory peaks above its level at entry.
+
+    Resets the kernel's high-water mark (Linux ``clear_refs``), so it is exact for a
+    process running one job at a time, such as a pool worker; yields a dict whose
+    ``peak_bytes`` is filled in on exit (None where unsupported).
+    """
+    reading = {"peak_bytes": None}
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        baseline = _proc_status_kb("VmRSS")
+    except OSError:
+        yield reading
+        return
+    try:
+        yield reading
+    finally:
+        reading["peak_bytes"] = max(0, _proc_status_kb("VmHWM") - baseline) * 1024
+        record_memory(reading["peak_bytes"])
+
+@contextlib.contextmanager
+def listen_stages(callback):
+    """Call ``callback(stage)`` whenever a ``span`` starts in this context (e.g. for job progress)"""
+    token = _stage_listener.set(callback)
+    try:
+        yield
+    finally:
+        _stage_listener.reset(token)
+
+@contextlib.contextmanager
+def span(stage):
+    """Time a block as one pipeline stage"""
+    listener = _stage_listener.get()
+    if listener is not None:
+        listener(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+def observe_trace(trace):
+    for stage, seconds in trace.spans.items():
+        STAGE_SECONDS.observe(seconds, stage)
+
+def server_timing(trace):
+    """``Server-Timing`` header value for a trace (durations in milliseconds)"""
+    return ", ".join(f"{stage};dur={seconds * 1e3:.2f}" for stage, seconds in trace.spans.items())
+
+class MetricsMiddleware:
+    """ASGI middleware: one trace per HTTP request, request latency/status metrics and a
+    ``Server-Timing`` header with the stages finished before the response started."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        with collect_spans() as trace:
+            async def send_with_timing(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    extra = []
+                    if trace.spans:
+                        extra.append((b"server-timing", server_timing(trace).encode("latin-1")))
+                    if trace.peak_memory is not None:
+                        extra.append((b"x-peak-memory", str(trace.peak_memory).encode("latin-1")))
+                    if extra:
+                        message["headers"] = [*message.get("headers", ()), *extra]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                elapsed = time.perf_counter() - start
+                # Route templates keep label cardinality bounded
+                route = getattr(scope.get("route"), "path", "unmatched")
+                REQUEST_SECONDS.observe(elapsed, route, scope["method"])
+                REQUESTS_TOTAL.inc(route, scope["method"], status)
+                observe_trace(trace)
+                if trace.peak_memory is not None:
+                    PEAK_MEMORY.observe(trace.peak_memory, route)
+                if logger.isEnabledFor(logging.DEBUG):
+                    memory = f" peak {trace.peak_memory / 2**20:.1f}MB" if trace.peak_memory is not None else ""
+                    logger.debug("%s %s %d %.1fms%s %s", scope["method"], route, status, elapsed * 1e3, memory,
+                                 {stage: round(seconds * 1e3, 2) for stage, seconds in trace.spans.items()})
+
+def gauge(name, help_text, value, labels=None):
+    label_text = "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}" if labels else ""
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name}{label_text} {value}"]
+
+def counter(name, help_text, values, label=None):
+    """Counter lines for a running total kept elsewhere: one value, or ``{label value: total}``"""
+    metric = Counter(name, help_text, (label,) if label else ())
+    for key, value in (values.items() if label else [(None, values)]):
+        metric.inc(*([key] if label else []), amount=value)
+    return metric.expose()
+
+def expose(*extra_lines):
+    """Prometheus text exposition of every metric plus caller-supplied gauge and counter lines"""
+    lines = STAGE_SECONDS.expose() + REQUEST_SECONDS.expose() + PEAK_MEMORY.expose() + REQUESTS_TOTAL.expose()
+    for block in extra_lines:
+        lines.extend(block)
+    return "\n".join(lines) + "\n"
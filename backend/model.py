@@ -1,185 +1,320 @@
 import numpy as np
-import librosa
-import librosa.display
-import joblib
 import os
-import numpy as np
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
+from render import SPECTROGRAM_HEIGHT, SPECTROGRAM_MODE, SPECTROGRAM_WIDTH, render_fast, render_config
+from decoders import RESAMPLE_QUALITY, decode_audio
+from activity import activity_config, select_active
+from tiles import SPECTROGRAM_TILES, build_pyramid, tile_config
+from metrics import span
 import io
+import json
 import base64
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Frame parameters for the summary features (librosa defaults, which the saved model was trained on)
+FEATURE_N_FFT = 2048
+FEATURE_HOP_LENGTH = 512
+N_MFCC = 13
+
+# pyplot keeps global figure state, so renders are serialised when analysis runs in threads
+_render_lock = threading.Lock()
+
+# Higher frequency resolution used for the spectrogram and band-energy analysis
+SPECTROGRAM_N_FFT = 4096
+SPECTROGRAM_HOP_LENGTH = 1024
+
+# Report (matplotlib) spectrogram resolution, and the image scale of ``spectrogram="preview"``
+REPORT_DPI = 200
+PREVIEW_SCALE = 0.5
+
+# Bump when feature definitions change without a parameter change
+FEATURE_CONFIG_VERSION = 2
+
+# LOW_MEMORY=1 builds STFTs block by block into float32 arrays and converts to dB
+# in place, so no full-size complex or float64 intermediate is ever allocated.
+LOW_MEMORY = os.environ.get("LOW_MEMORY", "0") == "1"
+# Per-request memory budget; a clip whose estimated analysis peak exceeds it is
+# processed in chunks with the streaming accumulator instead (0 disables).
+MEMORY_BUDGET_MB = float(os.environ.get("MEMORY_BUDGET_MB", 0))
+# STFT frames per block in low-memory mode, and waveform samples per chunk past the budget
+STFT_BLOCK_FRAMES = 256
+CHUNK_SAMPLES = 1 << 18
+# Peak bytes allocated per waveform sample by each analysis stage, keyed by
+# LOW_MEMORY, plus a fixed per-stage overhead (tracemalloc, librosa 0.11);
+# used to decide when a clip has to be processed in chunks
+STAGE_BYTES_PER_SAMPLE = {
+    False: {"features": 27, "spectrogram": 46},
+    True: {"features": 11, "spectrogram": 8},
+}
+STAGE_FIXED_BYTES = 16 * 2**20
+
+def vector_config():
+    """Identifies every setting that shapes the feature vector (used in cache keys)"""
+    return f"v{FEATURE_CONFIG_VERSION}:{FEATURE_N_FFT}/{FEATURE_HOP_LENGTH}/{N_MFCC}:{RESAMPLE_QUALITY}:{activity_config()}"
+
+def feature_config():
+    """Identifies every setting that shapes ``extract_features`` output, spectrogram included"""
+    memory = ":low" if LOW_MEMORY else ""
+    if MEMORY_BUDGET_MB:
+        memory += f":budget={MEMORY_BUDGET_MB:g}"
+    return f"{vector_config()}:{SPECTROGRAM_N_FFT}/{SPECTROGRAM_HOP_LENGTH}:{render_config()}:{tile_config()}{memory}"
+
+def estimate_peak_bytes(n_samples, spectrogram="image"):
+    """Estimated peak memory of ``extract_features`` on a decoded clip of ``n_samples``"""
+    per_sample = STAGE_BYTES_PER_SAMPLE[LOW_MEMORY]
+    stage = max(per_sample["features"], per_sample["spectrogram"] if spectrogram != "none" else 0)
+    # The float32 waveform stays alive through every stage
+    return n_samples * (4 + stage) + STAGE_FIXED_BYTES
+
+def over_budget(n_samples, spectrogram="image"):
+    return bool(MEMORY_BUDGET_MB) and estimate_peak_bytes(n_samples, spectrogram) > MEMORY_BUDGET_MB * 2**20
+
+def compute_features(y, sr, S=None):
+    """Compute every summary feature from one magnitude STFT of ``y``.
+
+    RMS and ZCR are time-domain and only frame the signal; the spectral
+    statistics and the MFCCs all share the same 2048-point STFT instead of
+    each librosa feature building its own. Pass ``S`` if the caller already
+    holds that magnitude STFT.
+    """
+    import librosa
+    # ZCR first, so its temporaries are freed before the STFT is allocated
+    zcr = _zero_crossing_rate(y)
+    if S is None:
+        S = feature_stft(y)
+
+    if LOW_MEMORY:
+        rms = _blockwise_rms(y)
+        centroid, bandwidth, rolloff, mel = _blockwise_spectral(S, sr)
+    else:
+        rms = librosa.feature.rms(y=y, frame_length=FEATURE_N_FFT, hop_length=FEATURE_HOP_LENGTH)
+        centroid, bandwidth, rolloff = _spectral_statistics(S, sr)
+        mel = _mel_basis(sr).dot(S**2)
+    mfcc = librosa.feature.mfcc(S=librosa.power_to_db(mel), n_mfcc=N_MFCC)
+
+    return {
+        "rms": rms.mean(),
+        "zcr": zcr.mean(),
+        "spectral_centroid": centroid.mean(),
+        "spectral_bandwidth": bandwidth.mean(),
+        "spectral_rolloff": rolloff.mean(),
+        "mfcc_means": mfcc.mean(axis=1),
+    }
+
+@functools.lru_cache(maxsize=8)
+def _mel_basis(sr):
+    import librosa
+    return librosa.filters.mel(sr=sr, n_fft=FEATURE_N_FFT)
+
+def _zero_crossing_rate(y):
+    """Per-frame zero-crossing rate, equal to ``librosa.feature.zero_crossing_rate``.
+
+    Sign changes are found once over the whole signal and counted per frame
+    with a cumulative sum instead of re-scanning every overlapping frame.
+    """
+    pad = FEATURE_N_FFT // 2
+    x = np.pad(y, pad, mode="edge")
+    # librosa zeroes |x| <= 1e-10 and counts zero as positive, so only x < -1e-10 is negative
+    negative = x < -1e-10
+    changes = negative[1:] != negative[:-1]
+    n_frames = 1 + (len(x) - FEATURE_N_FFT) // FEATURE_HOP_LENGTH
+    del x, negative
+    counts = np.zeros(len(changes) + 1, dtype=np.int32)
+    np.cumsum(changes, out=counts[1:])
+    starts = np.arange(n_frames) * FEATURE_HOP_LENGTH
+    return (counts[starts + FEATURE_N_FFT - 1] - counts[starts]) / FEATURE_N_FFT
+
+def _spectral_statistics(S, sr):
+    """Per-frame spectral centroid, bandwidth (p=2) and 85% rolloff of a magnitude STFT.
+
+    Matches the librosa feature functions but shares the per-frame sums, which
+    reduces each statistic to a matrix-vector product over ``S``.
+    """
+    import librosa
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=FEATURE_N_FFT)
+    total, first, second = np.vstack([np.ones_like(freqs), freqs, freqs ** 2]).dot(S.astype(np.float64))
+    weight = np.where(total > np.finfo(S.dtype).tiny, total, 1.0)
+    centroid = first / weight
+    # sum(S * (f - centroid)^2) expanded into the raw moments
+    spread = (second - 2 * centroid * first + centroid ** 2 * total) / weight
+    bandwidth = np.sqrt(np.maximum(spread, 0.0))
+
+    cumulative = np.cumsum(S, axis=0)
+    rolloff = freqs[np.sum(cumulative < 0.85 * cumulative[-1], axis=0)]
+    return centroid, bandwidth, rolloff
+
+def _blockwise_spectral(S, sr):
+    """``_spectral_statistics`` and the mel power spectrum a block of frames at a time.
+
+    Avoids the full-size float64, cumulative-sum and squared copies of ``S``;
+    equal to the one-shot version up to float64 rounding in the matrix products.
+    """
+    frames = S.shape[1]
+    basis = _mel_basis(sr)
+    centroid, bandwidth, rolloff = np.empty(frames), np.empty(frames), np.empty(frames)
+    mel = np.empty((basis.shape[0], frames), dtype=np.float32)
+    for start in range(0, frames, STFT_BLOCK_FRAMES):
+        stop = min(frames, start + STFT_BLOCK_FRAMES)
+        block = S[:, start:stop]
+        centroid[start:stop], bandwidth[start:stop], rolloff[start:stop] = _spectral_statistics(block, sr)
+        mel[:, start:stop] = basis.dot(block ** 2)
+    return centroid, bandwidth, rolloff, mel
+
+def _centered_blocks(y, n_fft, hop_length):
+    """Yield ``(start, stop, segment)``: librosa's centred, zero-padded frames in blocks of
+    ``STFT_BLOCK_FRAMES``; each ``segment`` is framed with ``center=False``"""
+    half = n_fft // 2
+    frames = 1 + len(y) // hop_length
+    for start in range(0, frames, STFT_BLOCK_FRAMES):
+        stop = min(frames, start + STFT_BLOCK_FRAMES)
+        # Sample range of these frames in the padded signal, shifted back onto y
+        lo, hi = start * hop_length - half, (stop - 1) * hop_length + n_fft - half
+        segment = y[max(lo, 0):min(hi, len(y))]
+        if lo < 0 or hi > len(y):
+            segment = np.pad(segment, (max(0, -lo), max(0, hi - len(y))))
+        yield start, stop, segment
+
+def _blockwise_rms(y):
+    """``librosa.feature.rms`` without framing the whole signal at once (bit-identical)"""
+    import librosa
+    rms = np.empty((1, 1 + len(y) // FEATURE_HOP_LENGTH), dtype=np.float32)
+    for start, stop, segment in _centered_blocks(y, FEATURE_N_FFT, FEATURE_HOP_LENGTH):
+        rms[:, start:stop] = librosa.feature.rms(y=segment, frame_length=FEATURE_N_FFT,
+                                                 hop_length=FEATURE_HOP_LENGTH, center=False)
+    return rms
+
+def magnitude_stft(y, n_fft, hop_length):
+    """``np.abs(librosa.stft(y))`` with the same framing; in low-memory mode it is
+    filled block by block so the complex STFT never exists at full size (bit-identical)"""
+    import librosa
+    if not LOW_MEMORY:
+        return np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length, window='hann'))
+    S = np.empty((1 + n_fft // 2, 1 + len(y) // hop_length), dtype=np.float32)
+    for start, stop, segment in _centered_blocks(y, n_fft, hop_length):
+        S[:, start:stop] = np.abs(librosa.stft(segment, n_fft=n_fft, hop_length=hop_length,
+                                               window='hann', center=False))
+    return S
+
+def feature_stft(y):
+    """Magnitude STFT at the feature resolution, as used by ``compute_features``"""
+    return magnitude_stft(y, FEATURE_N_FFT, FEATURE_HOP_LENGTH)
+
+def _amplitude_to_db_inplace(S, amin=1e-5, top_db=80.0):
+    """``librosa.amplitude_to_db(S, ref=np.max)`` computed in ``S``'s own buffer (bit-identical)"""
+    ref_power = S.max() ** 2
+    np.square(S, out=S)
+    np.maximum(S, amin ** 2, out=S)
+    np.log10(S, out=S)
+    S *= 10.0
+    S -= 10.0 * np.log10(np.maximum(amin ** 2, ref_power))
+    np.maximum(S, S.max() - top_db, out=S)
+    return S
+
+def feature_vector(features):
+    """Flatten a ``compute_features`` result into the model's input layout."""
+    return np.hstack([features["rms"], features["zcr"], features["spectral_centroid"],
+                      features["spectral_bandwidth"], features["spectral_rolloff"],
+                      features["mfcc_means"]]).astype(float)
+
+def feature_summary(features):
+    """JSON-friendly subset of a ``compute_features`` result returned to clients"""
+    return {
+        "rms": float(features["rms"]),
+        "zcr": float(features["zcr"]),
+        "spectral_centroid": float(features["spectral_centroid"]),
+        "spectral_bandwidth": float(features["spectral_bandwidth"]),
+        "spectral_rolloff": float(features["spectral_rolloff"]),
+        "mfcc_1": float(features["mfcc_means"][0]),
+    }
+
+def compute_spectrogram(y, sr):
+    """Return the dB-scaled magnitude spectrogram and its frequency axis."""
+    import librosa
+    with span("spectrogram"):
+        if LOW_MEMORY:
+            S_db = _amplitude_to_db_inplace(magnitude_stft(y, SPECTROGRAM_N_FFT, SPECTROGRAM_HOP_LENGTH))
+        else:
+            D = librosa.stft(y, n_fft=SPECTROGRAM_N_FFT, hop_length=SPECTROGRAM_HOP_LENGTH, window='hann')
+            S_db = librosa.amplitude_to_db(np.abs(D), ref=np.max)
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=SPECTROGRAM_N_FFT)
+    return S_db, freqs
+
+def load_audio(source, sr: int = 22050, filename: str = None):
+    """Decode ``source`` to a mono waveform at ``sr``.
 
-def extract_features(file_path: str, sr: int = 22050):
+    ``source`` may be a path, raw bytes or a binary file-like object;
+    ``filename`` is an optional extension hint. The container is sniffed once
+    and routed straight to its decoder (see ``decoders.ROUTES``).
+    """
+    with span("decode"):
+        y, backend = decode_audio(source, sr=sr, filename=filename)
+    logger.debug("Decoded %s with %s: duration=%.2fs, sample_rate=%dHz",
+                 filename or (source if isinstance(source, (str, os.PathLike)) else "<upload>"), backend, len(y) / sr, sr)
+    return y, sr
+
+def extract_features(source, sr: int = 22050, filename: str = None, spectrogram: str = "image"):
+    """Decode ``source`` (path, bytes or file-like) and extract model features
+
+    ``spectrogram`` controls the 4096-point spectrogram work: ``"image"``
+    renders it (plus its zoomable tile pyramid), ``"preview"`` renders it at ``PREVIEW_SCALE``, ``"analysis"``
+    only computes the band-energy analysis and ``"none"`` skips it entirely
+    (e.g. for training).
+    """
     try:
-        print(f"Loading audio file: {file_path}")
-        if not os.path.exists(file_path):
-            raise ValueError(f"Audio file not found: {file_path}")
-            
-        file_size = os.path.getsize(file_path)
-        print(f"Audio file size: {file_size} bytes")
-        
-        if file_size == 0:
-            raise ValueError("Audio file is empty")
-            
-        # Load audio with error handling and format detection
-        # Prioritize MP3 and WAV for optimal spectrogram generation
-        try:
-            # Check if it's MP3 format for optimal processing
-            if file_path.lower().endswith('.mp3'):
-                print("MP3 format detected - using optimized loading for spectrogram generation")
-                # Use librosa with specific parameters optimized for MP3 and spectrogram analysis
-                y, sr = librosa.load(file_path, sr=22050, mono=True, duration=300.0, offset=0.0)
-                print(f"MP3 audio loaded with optimized settings: duration={len(y)/sr:.2f}s, sample_rate={sr}Hz")
-            else:
-                # Standard loading for other formats
-                y, sr = librosa.load(file_path, sr=sr, mono=True, duration=300.0)
-                print(f"Audio loaded with librosa: duration={len(y)/sr:.2f}s, sample_rate={sr}Hz")
-        except Exception as librosa_error:
-            print(f"Librosa loading failed: {librosa_error}")
-            
-            # Try alternative loading methods for browser recordings
-            try:
-                import soundfile as sf
-                y, sr = sf.read(file_path)
-                if len(y.shape) > 1:  # Convert stereo to mono
-                    y = y.mean(axis=1)
-                # Resample if needed
-                if sr != 22050:
-                    y = librosa.resample(y, orig_sr=sr, target_sr=22050)
-                    sr = 22050
-                print(f"Audio loaded with soundfile: duration={len(y)/sr:.2f}s, sample_rate={sr}Hz")
-            except Exception as sf_error:
-                print(f"Soundfile loading failed: {sf_error}")
-                
-                # Last resort: try to convert using ffmpeg if available
-                try:
-                    # Try loading as raw audio
-                    with open(file_path, 'rb') as f:
-                        data = f.read()
-                    print(f"File contains {len(data)} bytes of data")
-                    
-                    # Check if it's a WebM file (common for browser recordings)
-                    if data.startswith(b'\x1a\x45\xdf\xa3'):  # WebM signature
-                        print("WebM format detected, attempting conversion...")
-                        try:
-                            # Method 1: Try using pydub for WebM conversion
-                            from pydub import AudioSegment
-                            from pydub.utils import which
-                            
-                            # Check if ffmpeg is available
-                            if not which("ffmpeg"):
-                                # Try common Windows ffmpeg locations
-                                import subprocess
-                                ffmpeg_paths = [
-                                    "ffmpeg",
-                                    "C:\\ffmpeg\\bin\\ffmpeg.exe",
-                                    "C:\\Program Files\\ffmpeg\\bin\\ffmpeg.exe",
-                                    os.path.join(os.getcwd(), "ffmpeg.exe")
-                                ]
-                                
-                                ffmpeg_found = False
-                                for path in ffmpeg_paths:
-                                    try:
-                                        subprocess.run([path, "-version"], capture_output=True, check=True)
-                                        AudioSegment.converter = path
-                                        ffmpeg_found = True
-                                        print(f"Found ffmpeg at: {path}")
-                                        break
-                                    except (subprocess.CalledProcessError, FileNotFoundError):
-                                        continue
-                                
-                                if not ffmpeg_found:
-                                    raise ValueError("FFmpeg not found. WebM conversion requires FFmpeg to be installed.")
-                            
-                            # Load WebM file with pydub
-                            print("Loading WebM file with pydub...")
-                            audio = AudioSegment.from_file(file_path, format="webm")
-                            
-                            # Convert to numpy array
-                            samples = audio.get_array_of_samples()
-                            if audio.channels == 2:
-                                samples = samples[0::2]  # Take only left channel for stereo
-                            
-                            # Convert to float32 and normalize
-                            y = np.array(samples, dtype=np.float32) / 32768.0
-                            sr = audio.frame_rate
-                            
-                            # Resample to target sample rate if needed
-                            if sr != 22050:
-                                print(f"Resampling from {sr}Hz to 22050Hz...")
-                                y = librosa.resample(y, orig_sr=sr, target_sr=22050)
-                                sr = 22050
-                                
-                            print(f"WebM conversion successful: duration={len(y)/sr:.2f}s, sample_rate={sr}Hz")
-                            
-                        except ImportError:
-                            raise ValueError("WebM format detected but pydub is not installed. Please install pydub and ffmpeg for WebM support.")
-                        except Exception as webm_error:
-                            print(f"WebM conversion error: {webm_error}")
-                            # Try alternative method with ffmpeg-python
-                            try:
-                                import ffmpeg
-                                import tempfile
-                                
-                                print("Trying ffmpeg-python for WebM conversion...")
-                                
-                                # Create temporary WAV file
-                                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_wav:
-                                    temp_wav_path = temp_wav.name
-                                
-                                # Convert WebM to WAV using ffmpeg
-                                (
-                                    ffmpeg
-                                    .input(file_path)
-                                    .output(temp_wav_path, acodec='pcm_s16le', ac=1, ar=22050)
-                                    .overwrite_output()
-                                    .run(capture_stdout=True, capture_stderr=True)
-                                )
-                                
-                                # Load the converted WAV file
-                                y, sr = librosa.load(temp_wav_path, sr=22050, mono=True)
-                                
-                                # Clean up temporary file
-                                os.unlink(temp_wav_path)
-                                
-                                print(f"FFmpeg conversion successful: duration={len(y)/sr:.2f}s, sample_rate={sr}Hz")
-                                
-                            except Exception as ffmpeg_error:
-                                raise ValueError(f"WebM conversion failed with both pydub and ffmpeg: {webm_error}, {ffmpeg_error}")
-                    else:
-                        # If we get here, the file format is unsupported
-                        raise ValueError(f"Unsupported audio format. Original errors: librosa='{librosa_error}', soundfile='{sf_error}'")
-                    
-                except Exception as final_error:
-                    raise ValueError(f"Cannot load audio file. File may be corrupted or in unsupported format. Details: {final_error}")
-        
+        y, sr = load_audio(source, sr=sr, filename=filename)
+
         if y.size == 0:
             raise ValueError("Empty audio data after loading")
             
         if len(y) < 1024:
             raise ValueError("Audio too short for analysis (minimum 1024 samples required)")
 
-        # Extract audio features
-        rms = librosa.feature.rms(y=y).mean()
-        zcr = librosa.feature.zero_crossing_rate(y).mean()
-        spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr).mean()
-        spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr).mean()
-        spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr).mean()
-        mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-        mfcc_means = mfcc.mean(axis=1)
+        # Only the active (breathing/snoring) regions go through the expensive stages
+        with span("activity"):
+            y, activity = select_active(y, sr)
+        logger.debug("Activity: %s, analysing %.1fs of %.1fs", activity["mode"],
+                     activity["analysed_seconds"], activity["duration_seconds"])
+
+        if over_budget(len(y), spectrogram):
+            return {**_extract_features_chunked(y, sr, spectrogram), "activity": activity}
+
+        # Extract audio features from a single shared STFT
+        with span("features"):
+            features = compute_features(y, sr)
+        rms = features["rms"]
+        zcr = features["zcr"]
+        spectral_centroid = features["spectral_centroid"]
         
-        print(f"Features extracted: RMS={rms:.4f}, ZCR={zcr:.4f}, SC={spectral_centroid:.1f}")
+        logger.debug("Features extracted: RMS=%.4f, ZCR=%.4f, SC=%.1f", rms, zcr, spectral_centroid)
 
-        vector = np.hstack([rms, zcr, spectral_centroid, spectral_bandwidth,
-                            spectral_rolloff, mfcc_means]).astype(float)
+        vector = feature_vector(features)
 
         # Generate spectrogram data with error handling
         try:
-            spectrogram_data = generate_spectrogram(y, sr)
-            print(f"Spectrogram generation: {'successful' if spectrogram_data.get('image_base64') else 'failed'}")
+            if spectrogram == "none":
+                spectrogram_data = {}
+            elif spectrogram == "analysis":
+                S_db, freqs = compute_spectrogram(y, sr)
+                spectrogram_data = {
+                    "image_base64": None,
+                    "frequency_analysis": analyze_frequency_bands(S_db, freqs),
+                    "time_duration": float((S_db.shape[1] - 1) * SPECTROGRAM_HOP_LENGTH / sr),
+                }
+            else:
+                S_db, freqs = compute_spectrogram(y, sr)
+                spectrogram_data = generate_spectrogram(y, sr, S_db=S_db, freqs=freqs,
+                                                        scale=PREVIEW_SCALE if spectrogram == "preview" else 1.0)
+                if spectrogram == "image" and SPECTROGRAM_TILES and spectrogram_data.get("image_base64"):
+                    # Zoomable tiles from the same STFT, so views never recompute it
+                    with span("tiles"):
+                        spectrogram_data["tiles"] = build_pyramid(S_db, freqs, SPECTROGRAM_HOP_LENGTH / sr)
+                logger.debug("Spectrogram generation: %s", "successful" if spectrogram_data.get("image_base64") else "failed")
         except Exception as e:
-            print(f"Warning: Spectrogram generation failed: {e}")
+            logger.warning("Spectrogram generation failed: %s", e)
             spectrogram_data = {
                 "image_base64": None,
                 "frequency_analysis": {},
@@ -187,182 +322,205 @@ def extract_features(file_path: str, sr: int = 22050):
                 "error": str(e)
             }
 
-        summary = {
-            "rms": float(rms),
-            "zcr": float(zcr),
-            "spectral_centroid": float(spectral_centroid),
-            "spectral_bandwidth": float(spectral_bandwidth),
-            "spectral_rolloff": float(spectral_rolloff),
-            "mfcc_1": float(mfcc_means[0]),
-        }
-        return {"vector": vector, "summary": summary, "spectrogram": spectrogram_data}
+        summary = feature_summary(features)
+        return {"vector": vector, "summary": summary, "spectrogram": spectrogram_data, "activity": activity}
         
     except Exception as e:
-        print(f"Error during audio processing: {e}")
+        logger.info("Audio processing failed: %s", e)
         raise ValueError(f"Audio processing failed: {str(e)}")
 
-def generate_spectrogram(y, sr):
-    """Generate spectrogram data for visualization - optimized for MP3 format"""
-    try:
-        print(f"Generating enhanced spectrogram for audio: length={len(y)}, sr={sr}")  # Debug log
-        
-        # Ensure we have enough audio data
-        if len(y) < 1024:
-            print("Audio too short for spectrogram analysis")
-            return {
-                "image_base64": None,
-                "frequency_analysis": {},
-                "time_duration": 0.0,
-                "error": "Audio too short for analysis"
-            }
-        
-        # Enhanced STFT parameters optimized for MP3 audio and sleep apnea analysis
-        # Increased frequency resolution for better MP3 spectrogram quality
-        n_fft = 4096  # Increased from 2048 for better frequency resolution with MP3
-        hop_length = 1024  # Adjusted for MP3 format
-        
-        # Create spectrogram with enhanced parameters
-        D = librosa.stft(y, n_fft=n_fft, hop_length=hop_length, window='hann')
-        S_db = librosa.amplitude_to_db(np.abs(D), ref=np.max)
+def analyze_frequency_bands(S_db, freqs):
+    """Summarise band energies of a dB spectrogram over the 0-1000 Hz sleep apnea range"""
+    return summarize_average_spectrum(np.mean(S_db, axis=1), freqs)
+
+def summarize_average_spectrum(avg_spectrum, freqs):
+    """Band energies from a time-averaged dB spectrum (see ``analyze_frequency_bands``)"""
+    relevant_freqs = freqs[freqs <= 1000]  # Focus on sleep apnea relevant frequency range
+    relevant_spectrum = avg_spectrum[:len(relevant_freqs)]
+
+    # Enhanced frequency features extraction optimized for MP3 and sleep apnea analysis
+    if len(relevant_spectrum) > 0:
+        dominant_freq_idx = np.argmax(relevant_spectrum)
+        dominant_freq = relevant_freqs[dominant_freq_idx] if dominant_freq_idx < len(relevant_freqs) else 0
         
-        # Get time and frequency axes
-        times = librosa.times_like(S_db, sr=sr, hop_length=hop_length)
-        freqs = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+        # Calculate energy in frequency bands (optimized for MP3 sleep apnea analysis)
+        low_mask = relevant_freqs <= 100    # Deep breathing, body movements
+        mid_mask = (relevant_freqs > 100) & (relevant_freqs <= 500)  # Primary snoring range
+        high_mask = relevant_freqs > 500    # Airway turbulence, apnea events
         
-        print(f"Enhanced spectrogram shape: {S_db.shape}, Frequency range: {freqs[0]:.1f}-{freqs[-1]:.1f} Hz")
+        # Enhanced frequency analysis for MP3 format
+        freq_range_energy = {
+            "low_freq_energy": float(np.mean(relevant_spectrum[low_mask])) if np.any(low_mask) else 0.0,
+            "mid_freq_energy": float(np.mean(relevant_spectrum[mid_mask])) if np.any(mid_mask) else 0.0,
+            "high_freq_energy": float(np.mean(relevant_spectrum[high_mask])) if np.any(high_mask) else 0.0,
+            "dominant_frequency": float(dominant_freq),
+            "spectral_peak": float(np.max(relevant_spectrum)),
+            "frequency_spread": float(np.std(relevant_spectrum)),  # Added for MP3 analysis
+            "spectral_centroid_enhanced": float(np.sum(relevant_freqs * relevant_spectrum) / np.sum(relevant_spectrum)) if np.sum(relevant_spectrum) > 0 else 0.0
+        }
         
-        # Generate enhanced base64 encoded plot optimized for MP3 analysis
+        # Add MP3-specific sleep apnea indicators
+        total_energy = np.sum(relevant_spectrum)
+        if total_energy > 0:
+            freq_range_energy.update({
+                "low_freq_ratio": float(np.sum(relevant_spectrum[low_mask]) / total_energy) if np.any(low_mask) else 0.0,
+                "mid_freq_ratio": float(np.sum(relevant_spectrum[mid_mask]) / total_energy) if np.any(mid_mask) else 0.0,
+                "high_freq_ratio": float(np.sum(relevant_spectrum[high_mask]) / total_energy) if np.any(high_mask) else 0.0
+            })
+    else:
+        freq_range_energy = {
+            "low_freq_energy": 0.0, "mid_freq_energy": 0.0, "high_freq_energy": 0.0,
+            "dominant_frequency": 0.0, "spectral_peak": 0.0, "frequency_spread": 0.0,
+            "spectral_centroid_enhanced": 0.0, "low_freq_ratio": 0.0, "mid_freq_ratio": 0.0, "high_freq_ratio": 0.0
+        }
+    return freq_range_energy
+
+def render_spectrogram(S_db, freqs, times, avg_spectrum=None, mode=None, scale=1.0):
+    """Render a dB spectrogram to a base64 image; returns ``(image_base64, mime_type)``.
+
+    ``mode`` is ``"fast"`` (NumPy colormap LUT, see render.py) or ``"report"``
+    for the full matplotlib figure; it defaults to ``SPECTROGRAM_MODE``.
+    ``scale`` shrinks the image size (fast) or DPI (report), e.g. for previews.
+    """
+    with span("render"):
+        if (mode or SPECTROGRAM_MODE) == "report":
+            return render_report_spectrogram(S_db, freqs, times, avg_spectrum,
+                                             dpi=max(50, int(REPORT_DPI * scale))), "image/png"
+        return render_fast(S_db, freqs, width=max(16, int(SPECTROGRAM_WIDTH * scale)),
+                           height=max(16, int(SPECTROGRAM_HEIGHT * scale)))
+
+def _pyplot():
+    """Import matplotlib on first use; only the report renderer needs it and it dominates import time"""
+    import matplotlib
+    matplotlib.use('Agg')  # Use non-interactive backend
+    import matplotlib.pyplot as plt
+    return plt
+
+def render_report_spectrogram(S_db, freqs, times, avg_spectrum=None, dpi=None):
+    """Render a dB spectrogram and its average spectrum to a base64 PNG with matplotlib.
+
+    ``freqs``/``times`` are the row and column coordinates of ``S_db``, so
+    callers may pass a frequency-cropped or time-decimated matrix.
+    """
+    import librosa
+    plt = _pyplot()
+    # Generate enhanced base64 encoded plot optimized for MP3 analysis
+    with _render_lock:
         plt.figure(figsize=(16, 10))  # Larger figure for better MP3 spectrogram detail
-        
+
         # Main spectrogram plot with enhanced parameters
         plt.subplot(2, 1, 1)
         # Use enhanced frequency range for MP3 sleep apnea analysis
-        librosa.display.specshow(S_db, sr=sr, hop_length=hop_length, x_axis='time', y_axis='hz',
+        librosa.display.specshow(S_db, x_coords=times, y_coords=freqs, x_axis='time', y_axis='hz',
                                 fmax=1000, cmap='plasma', shading='gouraud')  # Enhanced for MP3
         plt.colorbar(format='%+2.0f dB')
         plt.title('🎵 Enhanced MP3 Audio Spectrogram - Sleep Apnea Analysis', fontsize=16, fontweight='bold')
         plt.ylabel('Frequency (Hz)', fontsize=14)
-        
+
         # Enhanced average frequency spectrum plot
         plt.subplot(2, 1, 2)
-        avg_spectrum = np.mean(S_db, axis=1)
+        if avg_spectrum is None:
+            avg_spectrum = np.mean(S_db, axis=1)
         relevant_freqs = freqs[freqs <= 1000]  # Focus on sleep apnea relevant frequency range
         relevant_spectrum = avg_spectrum[:len(relevant_freqs)]
-        
+
         # Enhanced visualization with frequency band highlighting
         plt.plot(relevant_freqs, relevant_spectrum, linewidth=2.5, color='darkblue', label='Average Spectrum')
         plt.fill_between(relevant_freqs, relevant_spectrum, alpha=0.4, color='lightblue')
-        
+
         # Highlight important frequency bands for sleep apnea
         plt.axvspan(0, 100, alpha=0.2, color='green', label='Low Freq (0-100Hz)')
         plt.axvspan(100, 500, alpha=0.2, color='yellow', label='Mid Freq (100-500Hz)')
         plt.axvspan(500, 1000, alpha=0.2, color='red', label='High Freq (500Hz+)')
-        
+
         plt.title('🔍 Enhanced Frequency Analysis - Sleep Apnea Detection', fontsize=16, fontweight='bold')
         plt.xlabel('Frequency (Hz)', fontsize=14)
         plt.ylabel('Magnitude (dB)', fontsize=14)
         plt.xlim(0, 1000)
         plt.legend(fontsize=10)
         plt.grid(True, alpha=0.3)
-        
+
         plt.tight_layout()
-        
+
         # Convert plot to high-quality base64 string
         img_buffer = io.BytesIO()
-        plt.savefig(img_buffer, format='png', dpi=200, bbox_inches='tight', 
+        plt.savefig(img_buffer, format='png', dpi=dpi or REPORT_DPI, bbox_inches='tight',
                    facecolor='white', edgecolor='none')  # Higher DPI for MP3 analysis
         img_buffer.seek(0)
         img_base64 = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
         plt.close()
+    return img_base64
+
+def _extract_features_chunked(y, sr, spectrogram="image"):
+    """``extract_features`` past the memory budget: fold the decoded clip into the
+    streaming accumulator chunk by chunk, so memory stays flat beyond the waveform"""
+    from streaming import FeatureAccumulator
+    logger.debug("Estimated peak %.0f MB exceeds the %g MB budget; analysing in chunks",
+                 estimate_peak_bytes(len(y), spectrogram) / 2**20, MEMORY_BUDGET_MB)
+    accumulator = FeatureAccumulator(sr, max_duration=None, render=spectrogram in ("image", "preview"))
+    with span("features"):
+        for start in range(0, len(y), CHUNK_SAMPLES):
+            accumulator.update(y[start:start + CHUNK_SAMPLES])
+        feat = accumulator.finalize()
+    if spectrogram == "none":
+        feat["spectrogram"] = {}
+    return feat
+
+def generate_spectrogram(y, sr, S_db=None, freqs=None, mode=None, scale=1.0):
+    """Generate spectrogram data for visualization - optimized for MP3 format
+
+    ``S_db``/``freqs`` may be passed in from ``compute_spectrogram`` so the
+    4096-point STFT is not recomputed. ``mode`` and ``scale`` select the
+    renderer and image size (see ``render_spectrogram``).
+    """
+    import librosa
+    try:
+        logger.debug("Generating spectrogram: length=%d, sr=%d", len(y), sr)
         
-        print(f"Enhanced MP3-optimized spectrogram generated, base64 length: {len(img_base64)}")
-        
-        # Enhanced frequency features extraction optimized for MP3 and sleep apnea analysis
-        if len(relevant_spectrum) > 0:
-            dominant_freq_idx = np.argmax(relevant_spectrum)
-            dominant_freq = relevant_freqs[dominant_freq_idx] if dominant_freq_idx < len(relevant_freqs) else 0
-            
-            # Calculate energy in frequency bands (optimized for MP3 sleep apnea analysis)
-            low_mask = relevant_freqs <= 100    # Deep breathing, body movements
-            mid_mask = (relevant_freqs > 100) & (relevant_freqs <= 500)  # Primary snoring range
-            high_mask = relevant_freqs > 500    # Airway turbulence, apnea events
-            
-            # Enhanced frequency analysis for MP3 format
-            freq_range_energy = {
-                "low_freq_energy": float(np.mean(relevant_spectrum[low_mask])) if np.any(low_mask) else 0.0,
-                "mid_freq_energy": float(np.mean(relevant_spectrum[mid_mask])) if np.any(mid_mask) else 0.0,
-                "high_freq_energy": float(np.mean(relevant_spectrum[high_mask])) if np.any(high_mask) else 0.0,
-                "dominant_frequency": float(dominant_freq),
-                "spectral_peak": float(np.max(relevant_spectrum)),
-                "frequency_spread": float(np.std(relevant_spectrum)),  # Added for MP3 analysis
-                "spectral_centroid_enhanced": float(np.sum(relevant_freqs * relevant_spectrum) / np.sum(relevant_spectrum)) if np.sum(relevant_spectrum) > 0 else 0.0
-            }
-            
-            # Add MP3-specific sleep apnea indicators
-            total_energy = np.sum(relevant_spectrum)
-            if total_energy > 0:
-                freq_range_energy.update({
-                    "low_freq_ratio": float(np.sum(relevant_spectrum[low_mask]) / total_energy) if np.any(low_mask) else 0.0,
-                    "mid_freq_ratio": float(np.sum(relevant_spectrum[mid_mask]) / total_energy) if np.any(mid_mask) else 0.0,
-                    "high_freq_ratio": float(np.sum(relevant_spectrum[high_mask]) / total_energy) if np.any(high_mask) else 0.0
-                })
-        else:
-            freq_range_energy = {
-                "low_freq_energy": 0.0, "mid_freq_energy": 0.0, "high_freq_energy": 0.0,
-                "dominant_frequency": 0.0, "spectral_peak": 0.0, "frequency_spread": 0.0,
-                "spectral_centroid_enhanced": 0.0, "low_freq_ratio": 0.0, "mid_freq_ratio": 0.0, "high_freq_ratio": 0.0
+        # Ensure we have enough audio data
+        if len(y) < 1024:
+            logger.debug("Audio too short for spectrogram analysis")
+            return {
+                "image_base64": None,
+                "frequency_analysis": {},
+                "time_duration": 0.0,
+                "error": "Audio too short for analysis"
             }
         
-        result = {
-            "image_base64": img_base64,
-            "frequency_analysis": freq_range_energy,
-            "time_duration": float(times[-1]) if len(times) > 0 else 0.0,
-            "mp3_optimized": True  # Flag to indicate enhanced MP3 processing
-        }
+        # Enhanced STFT parameters optimized for MP3 audio and sleep apnea analysis
+        # Increased frequency resolution for better MP3 spectrogram quality
+        hop_length = SPECTROGRAM_HOP_LENGTH
+        if S_db is None or freqs is None:
+            S_db, freqs = compute_spectrogram(y, sr)
         
-        print(f"Enhanced MP3 spectrogram analysis complete. Dominant frequency: {freq_range_energy['dominant_frequency']:.1f} Hz")
-        print(f"Frequency distribution - Low: {freq_range_energy.get('low_freq_ratio', 0)*100:.1f}%, Mid: {freq_range_energy.get('mid_freq_ratio', 0)*100:.1f}%, High: {freq_range_energy.get('high_freq_ratio', 0)*100:.1f}%")
-        return result
+        # Get time axis
+        times = librosa.times_like(S_db, sr=sr, hop_length=hop_length)
         
-        # Extract key frequency features with better handling
-        if len(relevant_spectrum) > 0:
-            dominant_freq_idx = np.argmax(relevant_spectrum)
-            dominant_freq = relevant_freqs[dominant_freq_idx] if dominant_freq_idx < len(relevant_freqs) else 0
-            
-            # Calculate energy in frequency bands
-            low_mask = relevant_freqs <= 100
-            mid_mask = (relevant_freqs > 100) & (relevant_freqs <= 500)
-            high_mask = relevant_freqs > 500
-            
-            freq_range_energy = {
-                "low_freq_energy": float(np.mean(relevant_spectrum[low_mask])) if np.any(low_mask) else 0.0,
-                "mid_freq_energy": float(np.mean(relevant_spectrum[mid_mask])) if np.any(mid_mask) else 0.0,
-                "high_freq_energy": float(np.mean(relevant_spectrum[high_mask])) if np.any(high_mask) else 0.0,
-                "dominant_frequency": float(dominant_freq),
-                "spectral_peak": float(np.max(relevant_spectrum))
-            }
-        else:
-            freq_range_energy = {
-                "low_freq_energy": 0.0,
-                "mid_freq_energy": 0.0,
-                "high_freq_energy": 0.0,
-                "dominant_frequency": 0.0,
-                "spectral_peak": 0.0
-            }
+        logger.debug("Spectrogram shape: %s, frequency range: %.1f-%.1f Hz", S_db.shape, freqs[0], freqs[-1])
+        
+        img_base64, img_mime = render_spectrogram(S_db, freqs, times, mode=mode, scale=scale)
+        
+        logger.debug("Spectrogram rendered, base64 length: %d", len(img_base64))
+        
+        freq_range_energy = analyze_frequency_bands(S_db, freqs)
         
         result = {
             "image_base64": img_base64,
+            "image_mime": img_mime,
             "frequency_analysis": freq_range_energy,
-            "time_duration": float(times[-1]) if len(times) > 0 else 0.0
+            "time_duration": float(times[-1]) if len(times) > 0 else 0.0,
+            "mp3_optimized": True  # Flag to indicate enhanced MP3 processing
         }
         
-        print(f"Spectrogram generation successful. Dominant frequency: {freq_range_energy['dominant_frequency']:.1f} Hz")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Spectrogram analysis complete. Dominant frequency: %.1f Hz, bands low/mid/high: "
+                         "%.1f%%/%.1f%%/%.1f%%", freq_range_energy["dominant_frequency"],
+                         freq_range_energy.get("low_freq_ratio", 0) * 100, freq_range_energy.get("mid_freq_ratio", 0) * 100,
+                         freq_range_energy.get("high_freq_ratio", 0) * 100)
         return result
         
     except Exception as e:
-        print(f"Error generating spectrogram: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error generating spectrogram: %s", e)
         return {
             "image_base64": None,
             "frequency_analysis": {},
@@ -370,36 +528,126 @@ def generate_spectrogram(y, sr):
             "error": str(e)
         }
 
+class CompiledForest:
+    """Random forest flattened into contiguous NumPy arrays (see ``train.export_forest``).
+
+    All nodes of all trees live in shared arrays; ``roots`` holds each tree's
+    first node and leaves point to themselves, so every row descends all trees
+    at once in ``depth`` vectorised steps. The arrays are memory-mapped, so
+    worker processes share one copy through the page cache. ``predict_proba``
+    reproduces sklearn's ``RandomForestClassifier.predict_proba`` bit for bit:
+    inputs are rounded to float32 like sklearn does and the per-tree leaf
+    distributions are summed in tree order.
+    """
+
+    ARRAYS = ("roots", "feature", "threshold", "left", "right", "missing_left", "value")
+
+    def __init__(self, directory: str, mmap_mode: str = "r"):
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.classes_ = np.asarray(meta["classes"])
+        self.n_features_in_ = meta["n_features"]
+        self.depth = meta["depth"]
+        self.digest = meta["digest"]
+        self.vector_config = meta.get("vector_config")
+        for name in self.ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode))
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} features, got shape {X.shape}")
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.depth):
+            x = X[rows, self.feature[node]]
+            go_left = (x <= self.threshold[node]) | (np.isnan(x) & self.missing_left[node])
+            node = np.where(go_left, self.left[node], self.right[node])
+        # cumsum adds trees strictly in order, matching sklearn's accumulation
+        return np.cumsum(self.value[node], axis=1)[:, -1] / len(self.roots)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+def forest_path(path: str):
+    """Directory holding the compiled export of a joblib model file"""
+    return os.path.splitext(path)[0] + ".forest"
+
 def load_model(path: str):
-    return joblib.load(path) if os.path.exists(path) else None
+    """Load the compiled forest next to ``path`` if present, else the joblib model, else None.
 
-def predict_from_file(file_path: str, model):
-    feat = extract_features(file_path)
-    x = feat["vector"].reshape(1, -1)
+    A model trained on a different ``vector_config()`` is refused (None, so the
+    heuristic is used) rather than fed vectors it has never seen.
+    """
+    compiled = forest_path(path)
+    if os.path.exists(os.path.join(compiled, "meta.json")):
+        model = CompiledForest(compiled)
+    elif not os.path.exists(path):
+        return None
+    else:
+        import joblib  # pulls in sklearn only when a pickled model is actually used
+        model = joblib.load(path)
+    trained = getattr(model, "vector_config", None)
+    if trained is None:
+        logger.warning("%s does not record the feature configuration it was trained with; "
+                       "assuming it matches %s", path, vector_config())
+    elif trained != vector_config():
+        logger.error("%s was trained on feature configuration %s but features are now computed as %s; "
+                     "retrain it with train.py. Using the heuristic instead.", path, trained, vector_config())
+        return None
+    return model
+
+WARMUP_AUDIO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_snore.wav")
+
+def warmup_audio(path: str = WARMUP_AUDIO):
+    """Bytes of the bundled test recording, or a synthetic 3 s snore-like WAV if it is missing"""
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    import soundfile as sf
+    sr = 22050
+    t = np.arange(3 * sr) / sr
+    rng = np.random.default_rng(0)
+    y = 0.3 * np.sin(2 * np.pi * 80 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 0.5 * t)) + 0.01 * rng.standard_normal(len(t))
+    buffer = io.BytesIO()
+    sf.write(buffer, y.astype(np.float32), sr, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+def warm_up(model=None, data: bytes = None):
+    """Run decode, features, spectrogram and scoring once so imports, numba JIT and FFT
+    plans are paid before the first request. Returns the elapsed seconds."""
+    start = time.perf_counter()
+    feat = extract_features(data if data is not None else warmup_audio(), filename="warmup.wav")
+    predict_probabilities(feat["vector"].reshape(1, -1), model)
+    return time.perf_counter() - start
 
+def predict_from_file(source, model, filename: str = None, spectrogram: str = "image"):
+    return predict_from_features(extract_features(source, filename=filename, spectrogram=spectrogram), model)
+
+def predict_from_features(feat, model):
+    """Score an ``extract_features``-shaped result with the model (or the heuristic fallback)"""
+    probs, note = predict_probabilities(feat["vector"].reshape(1, -1), model)
+    prob = float(probs[0])
+    label = "likely_apnea" if prob >= 0.5 else "unlikely"
+    result = {"probability": prob, "label": label,
+              "features": feat["summary"],
+              "spectrogram": feat["spectrogram"],
+              "note": note}
+    if feat.get("activity") is not None:
+        result["activity"] = feat["activity"]
+    return result
+
+def predict_probabilities(X, model):
+    """Apnea probability for every row of a feature matrix, plus a note on how it was obtained"""
+    with span("inference"):
+        return _predict_probabilities(X, model)
+
+def _predict_probabilities(X, model):
     if model is not None:
         try:
-            probs = model.predict_proba(x)[0]
-            prob = float(probs[1])
-            label = "likely_apnea" if prob >= 0.5 else "unlikely"
-            return {"probability": prob, "label": label,
-                    "features": feat["summary"],
-                    "spectrogram": feat["spectrogram"],
-                    "note": "Model-based prediction"}
+            return model.predict_proba(X)[:, 1].astype(float), "Model-based prediction"
         except Exception:
-            pred = int(model.predict(x)[0])
-            prob = float(pred)
-            label = "likely_apnea" if pred == 1 else "unlikely"
-            return {"probability": prob, "label": label,
-                    "features": feat["summary"],
-                    "spectrogram": feat["spectrogram"],
-                    "note": "Prediction (no probability)"}
-    else:
-        s = feat["summary"]
-        score = min(1.0, s["rms"] * 10.0) + max(0.0, (0.2 - s["zcr"]) * 5.0)
-        prob = max(0.0, min(1.0, score / 2.0))
-        label = "likely_apnea" if prob >= 0.5 else "unlikely"
-        return {"probability": prob, "label": label,
-                "features": feat["summary"],
-                "spectrogram": feat["spectrogram"],
-                "note": "Heuristic fallback"}
+            return model.predict(X).astype(float), "Prediction (no probability)"
+    # Heuristic on the RMS and ZCR columns of the feature vector
+    score = np.minimum(1.0, X[:, 0] * 10.0) + np.maximum(0.0, (0.2 - X[:, 1]) * 5.0)
+    return np.clip(score / 2.0, 0.0, 1.0), "Heuristic fallback"
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+
+# Load-adaptive quality (overridable from the environment)
+ADAPTIVE_QUALITY = os.environ.get("ADAPTIVE_QUALITY", "1") == "1"
+# Queued analysis jobs (admitted but not yet running) per worker at which each degraded tier starts
+QUALITY_THRESHOLDS = tuple(float(x) for x in os.environ.get("QUALITY_THRESHOLDS", "0.5,1,1.5").split(","))
+# A tier is relaxed one step at a time, once load has stayed below it this long (seconds)
+QUALITY_RECOVER_SECONDS = float(os.environ.get("QUALITY_RECOVER_SECONDS", 5))
+
+# Quality tiers from best to cheapest, and the ``extract_features`` spectrogram mode each uses
+QUALITY_TIERS = {
+    "full": "image",        # full-resolution spectrogram image
+    "reduced": "preview",   # image at a lower resolution / DPI
+    "no_image": "analysis", # band-energy analysis only, no image
+    "minimal": "none",      # features and label only
+}
+TIER_NAMES = tuple(QUALITY_TIERS)
+
+class QualityController:
+    """Pick the spectrogram quality tier for each new request from analysis pool load.
+
+    Load is the number of analysis jobs waiting for a worker, per worker:
+    busy workers alone are normal operation, not overload. Crossing ``thresholds[i]`` moves straight to tier ``i + 1``; when
+    load falls again the tier is relaxed one step per ``recover_seconds``, so
+    a burst does not make quality flap from request to request.
+    """
+
+    def __init__(self, pool, thresholds=QUALITY_THRESHOLDS, recover_seconds=QUALITY_RECOVER_SECONDS,
+                 enabled=ADAPTIVE_QUALITY):
+        if len(thresholds) != len(TIER_NAMES) - 1:
+            raise ValueError(f"QUALITY_THRESHOLDS needs {len(TIER_NAMES) - 1} values, got {len(thresholds)}")
+        self.pool = pool
+        self.thresholds = tuple(sorted(thresholds))
+        self.recover_seconds = recover_seconds
+        self.enabled = enabled
+        self.served = dict.fromkeys(TIER_NAMES, 0)
+        self._level = 0
+        self._changed = time.monotonic()
+        self._lock = threading.Lock()
+
+    def load(self):
+        return self.pool.queued / self.pool.workers
+
+    def tier(self):
+        """Tier for a request being admitted now"""
+        if not self.enabled:
+            return TIER_NAMES[0]
+        target = sum(self.load() >= threshold for threshold in self.thresholds)
+        now = time.monotonic()
+        with self._lock:
+            if target >= self._level:
+                self._level = target
+                self._changed = now
+            else:
+                # One step back towards the target per full recovery period that has passed
+                steps = int((now - self._changed) // self.recover_seconds) if self.recover_seconds > 0 else self._level
+                if steps:
+                    self._level = max(target, self._level - steps)
+                    self._changed = now
+            return TIER_NAMES[self._level]
+
+    def record(self, tier):
+        """Count a tier actually served (a cached full result can beat the chosen one)"""
+        self.served[tier] += 1
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "tier": TIER_NAMES[self._level],
+            "load": round(self.load(), 3),
+            "thresholds": dict(zip(TIER_NAMES[1:], self.thresholds)),
+            "served": dict(self.served),
+        }
@@ -0,0 +1,93 @@
+import base64
+import functools
+import io
+import os
+import struct
+import zlib
+import numpy as np
+
+# Fast renderer defaults (overridable from the environment)
+SPECTROGRAM_MODE = os.environ.get("SPECTROGRAM_MODE", "fast")  # "fast" or "report" (matplotlib)
+SPECTROGRAM_WIDTH = int(os.environ.get("SPECTROGRAM_WIDTH", 800))
+SPECTROGRAM_HEIGHT = int(os.environ.get("SPECTROGRAM_HEIGHT", 256))
+SPECTROGRAM_FORMAT = os.environ.get("SPECTROGRAM_FORMAT", "png")  # "png" or "webp"
+SPECTROGRAM_QUALITY = int(os.environ.get("SPECTROGRAM_QUALITY", 80))  # WebP quality, 0-100
+SPECTROGRAM_FMAX = float(os.environ.get("SPECTROGRAM_FMAX", 1000))
+SPECTROGRAM_CMAP = "plasma"
+# dB range mapped onto the colormap (amplitude_to_db clips at -80 dB below the peak)
+DB_FLOOR = -80.0
+
+IMAGE_MIME = {"png": "image/png", "webp": "image/webp"}
+
+def render_config():
+    """Renderer settings that affect the produced image"""
+    return (f"{SPECTROGRAM_MODE}:{SPECTROGRAM_WIDTH}x{SPECTROGRAM_HEIGHT}:{SPECTROGRAM_FORMAT}:"
+            f"{SPECTROGRAM_QUALITY}:{SPECTROGRAM_FMAX}:{SPECTROGRAM_CMAP}")
+
+@functools.lru_cache(maxsize=4)
+def colormap_lut(name=SPECTROGRAM_CMAP):
+    """256-entry RGB lookup table for a matplotlib colormap, built once per process"""
+    from matplotlib import colormaps
+    return (colormaps[name](np.linspace(0.0, 1.0, 256))[:, :3] * 255).round().astype(np.uint8)
+
+def _resize_axis(matrix, size, axis):
+    """Resample one axis to ``size`` cells: mean-pool when shrinking, repeat when growing"""
+    n = matrix.shape[axis]
+    if n == size:
+        return matrix
+    if n > size:
+        edges = np.linspace(0, n, size + 1).astype(np.int64)[:-1]
+        counts = np.diff(np.append(edges, n))
+        shape = [1, 1]
+        shape[axis] = size
+        return np.add.reduceat(matrix, edges, axis=axis) / counts.reshape(shape)
+    index = np.minimum((np.arange(size) * n) // size, n - 1)
+    return np.take(matrix, index, axis=axis)
+
+def spectrogram_pixels(S_db, freqs, width=SPECTROGRAM_WIDTH, height=SPECTROGRAM_HEIGHT,
+                       fmax=SPECTROGRAM_FMAX, cmap=SPECTROGRAM_CMAP):
+    """Map a dB spectrogram to an (height, width, 3) uint8 RGB image, low frequencies at the bottom"""
+    S_db = np.asarray(S_db, dtype=np.float32)
+    top = float(S_db.max()) if S_db.size else 0.0  # colour scale stays relative to the full-band peak
+    if fmax:
+        S_db = S_db[:max(1, int(np.searchsorted(freqs, fmax, side="right")))]
+    scaled = _resize_axis(_resize_axis(S_db, height, 0), width, 1)
+    return colormap_lut(cmap)[quantize_db(scaled, top)[::-1]]
+
+def quantize_db(S_db, top):
+    """dB values to colormap indices: 0 at ``DB_FLOOR`` below ``top`` (or quieter), 255 at ``top``"""
+    return np.clip((S_db - top - DB_FLOOR) * (255.0 / -DB_FLOOR), 0, 255).astype(np.uint8)
+
+def encode_png(rgb, compression=6):
+    """Encode an RGB uint8 array as PNG with the stdlib only"""
+    height, width, _ = rgb.shape
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)  # filter byte 0 per row
+    raw[:, 1:] = rgb.reshape(height, width * 3)
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), compression)) + chunk(b"IEND", b""))
+
+def encode_webp(rgb, quality=SPECTROGRAM_QUALITY):
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ValueError("WebP spectrograms require Pillow to be installed")
+    buffer = io.BytesIO()
+    Image.fromarray(rgb, "RGB").save(buffer, format="WEBP", quality=quality)
+    return buffer.getvalue()
+
+def render_fast(S_db, freqs, width=SPECTROGRAM_WIDTH, height=SPECTROGRAM_HEIGHT,
+                image_format=SPECTROGRAM_FORMAT, quality=SPECTROGRAM_QUALITY, fmax=SPECTROGRAM_FMAX):
+    """Render a dB spectrogram through the colormap LUT; returns (base64 image, mime type)"""
+    rgb = spectrogram_pixels(S_db, freqs, width, height, fmax)
+    if image_format == "webp":
+        data = encode_webp(rgb, quality)
+    elif image_format == "png":
+        data = encode_png(rgb)
+    else:
+        raise ValueError(f"Unsupported spectrogram format: {image_format}")
+    return base64.b64encode(data).decode("ascii"), IMAGE_MIME[image_format]
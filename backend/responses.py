@@ -0,0 +1,125 @@
+import gzip
+import json
+import os
+from fastapi import HTTPException
+from fastapi.responses import Response
+from tiles import pyramid_info
+
+try:
+    import msgpack
+except ImportError:  # MessagePack output is optional
+    msgpack = None
+try:
+    import brotli
+except ImportError:  # without it only gzip is offered
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed (headers would eat the gain)
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+# Fast settings: responses are compressed per request, not once ahead of time
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+# Optional parts of an analysis response, selectable with ``?include=``
+INCLUDE_FIELDS = {"features", "spectrogram", "frequency_analysis", "image", "note", "activity"}
+DEFAULT_INCLUDE = ("features", "spectrogram", "note")
+
+def parse_include(include: str = None, view: str = None):
+    """Field groups requested by ``?include=a,b`` / ``?view=summary|full``"""
+    if view not in (None, "full", "summary"):
+        raise HTTPException(status_code=400, detail="view must be 'full' or 'summary'")
+    if include is None:
+        return set() if view == "summary" else set(DEFAULT_INCLUDE)
+    fields = {part.strip() for part in include.split(",") if part.strip()}
+    unknown = fields - INCLUDE_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown include field(s): {', '.join(sorted(unknown))} "
+                                                    f"(choose from {', '.join(sorted(INCLUDE_FIELDS))})")
+    return fields
+
+def shape_analysis(result, fields, image_url=None, tile_url=None, **extra):
+    """Build the ``/analyze`` response body from a cached result and the requested fields.
+
+    The spectrogram image is referenced by ``image_url`` rather than embedded,
+    unless ``image`` is requested explicitly. Its tile pyramid is described
+    (without the tile data) together with the ``tile_url`` template.
+    """
+    body = {
+        "success": True,
+        "label": result["label"],
+        "probability": result["probability"],
+        "confidence_score": round(result["probability"] * 100),
+        **extra,
+    }
+    activity = result.get("activity")
+    if activity:
+        body["analysed_fraction"] = activity["analysed_fraction"]
+        if "activity" in fields:
+            body["activity"] = activity
+    if "features" in fields:
+        body["features"] = result.get("features", {})
+    spectrogram = result.get("spectrogram") or {}
+    if "spectrogram" in fields:
+        body["spectrogram"] = {k: v for k, v in spectrogram.items() if k not in ("image_base64", "tiles")}
+        if spectrogram.get("tiles") and tile_url:
+            body["spectrogram"]["tiles"] = {**pyramid_info(spectrogram["tiles"]), "url": tile_url}
+    elif "frequency_analysis" in fields:
+        body["spectrogram"] = {"frequency_analysis": spectrogram.get("frequency_analysis", {})}
+    if spectrogram.get("image_base64"):
+        if "image" in fields:
+            body.setdefault("spectrogram", {})["image_base64"] = spectrogram["image_base64"]
+            body["spectrogram"]["image_mime"] = spectrogram.get("image_mime", "image/png")
+        elif "spectrogram" in fields and image_url:
+            body["spectrogram"]["image_url"] = image_url
+    if "note" in fields:
+        body["note"] = result.get("note", "Analysis completed")
+    return body
+
+def _accepts(header, token):
+    """Whether a comma-separated Accept(-Encoding) header allows ``token`` (q > 0)"""
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() == token:
+            q = params.strip()
+            if not q.startswith("q="):
+                return True
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+def wants_msgpack(request, format=None):
+    if format is not None:
+        if format not in ("json", "msgpack"):
+            raise HTTPException(status_code=400, detail="format must be 'json' or 'msgpack'")
+        wanted = format == "msgpack"
+    else:
+        wanted = any(_accepts(request.headers.get("accept"), t) for t in MSGPACK_TYPES)
+    if wanted and msgpack is None:
+        raise HTTPException(status_code=406, detail="MessagePack output is not available on this server")
+    return wanted
+
+def compress(body: bytes, accept_encoding: str):
+    """``(body, content_encoding)``, preferring brotli over gzip for large bodies"""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if brotli is not None and _accepts(accept_encoding, "br"):
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    if _accepts(accept_encoding, "gzip"):
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), "gzip"
+    return body, None
+
+def negotiated_response(request, content, format=None, status_code=200, headers=None):
+    """Serialize ``content`` as JSON or MessagePack and compress it as the client allows"""
+    if wants_msgpack(request, format):
+        body, media_type = msgpack.packb(content), "application/msgpack"
+    else:
+        body = json.dumps(content, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        media_type = "application/json"
+    body, encoding = compress(body, request.headers.get("accept-encoding"))
+    headers = {**(headers or {}), "Vary": "Accept, Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
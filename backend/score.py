@@ -0,0 +1,198 @@
+"""Score an archive of recordings offline with the current model.
+
+    python score.py recordings/ --out scores.jsonl              # every audio file under a directory
+    python score.py manifest.csv --out scores.jsonl --jobs 8     # CSV/JSONL manifest with a ``path`` column
+    python score.py recordings/ --out scores.jsonl --spectrogram analysis --features
+
+Results are appended to a JSONL file as each file finishes, one line per
+file. Rerunning the same command resumes: files already scored with the same
+model and feature configuration are skipped (failed ones are retried with
+``--retry-failed``). Spectrograms are only computed when ``--spectrogram`` asks
+for them.
+"""
+import os
+
+# One BLAS/OpenMP thread per process: the parallelism comes from the process pool
+for _var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+import argparse
+import base64
+import concurrent.futures
+import csv
+import hashlib
+import json
+import sys
+import time
+import workers
+from cache import file_digest
+from decoders import AUDIO_EXTENSIONS
+from model import load_model, predict_from_file, vector_config
+from render import IMAGE_MIME
+
+MODEL_PATH = "saved_model.joblib"
+# Results are flushed to disk after this many lines (and at exit)
+FLUSH_EVERY = 32
+
+def model_version(model_path, model):
+    """The loaded compiled forest's digest, else the joblib's ("heuristic" when no model loaded)"""
+    if model is None:
+        return "heuristic"
+    return getattr(model, "digest", None) or file_digest(model_path) or "heuristic"
+
+def list_inputs(source):
+    """``[(path, id), ...]`` from a directory (recursive) or a CSV/JSONL manifest.
+
+    Manifests need a ``path`` column (relative paths are resolved against the
+    manifest's directory) and may carry an ``id`` that is copied to the output.
+    """
+    if os.path.isdir(source):
+        found = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            found.extend(os.path.join(root, name) for name in sorted(files)
+                         if name.lower().endswith(AUDIO_EXTENSIONS))
+        return [(path, None) for path in found]
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r", encoding="utf-8", newline="") as f:
+        if source.lower().endswith((".jsonl", ".ndjson")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        elif source.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            raise ValueError(f"{source} is neither a directory nor a .csv/.jsonl manifest")
+    items = []
+    for number, row in enumerate(rows, 1):
+        if not row.get("path"):
+            raise ValueError(f"{source}: entry {number} has no path")
+        items.append((os.path.join(base, row["path"]), row.get("id")))
+    return items
+
+def read_done(out_path, version, config, retry_failed=False):
+    """Paths already scored in ``out_path`` by this model and feature configuration.
+
+    A line cut short by an interruption is dropped from the file so appending
+    continues on a clean line.
+    """
+    done, stale = set(), 0
+    if not os.path.exists(out_path):
+        return done, stale
+    with open(out_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            row = json.loads(line)
+        except ValueError:
+            continue
+        if row.get("model") != version or row.get("config") != config:
+            stale += 1
+        elif not (retry_failed and row.get("error")):
+            done.add(row["path"])
+    return done, stale
+
+def score_file(path, spectrogram="none", features=False, image_dir=None):
+    """Pool entry point: one output row for one file (errors are reported in the row)"""
+    started = time.perf_counter()
+    try:
+        result = predict_from_file(path, workers._worker_model, filename=path, spectrogram=spectrogram)
+    except Exception as e:
+        return {"path": path, "error": str(e)}
+    row = {"path": path, "label": result["label"], "probability": result["probability"]}
+    activity = result.get("activity")
+    if activity:
+        row["duration_seconds"] = activity["duration_seconds"]
+        row["analysed_fraction"] = activity["analysed_fraction"]
+    if features:
+        row["features"] = result["features"]
+    if spectrogram != "none":
+        row["frequency_analysis"] = result["spectrogram"].get("frequency_analysis", {})
+        image = result["spectrogram"].get("image_base64")
+        if image and image_dir:
+            mime = result["spectrogram"].get("image_mime", "image/png")
+            extension = next((ext for ext, value in IMAGE_MIME.items() if value == mime), "png")
+            name = hashlib.blake2b(path.encode("utf-8"), digest_size=10).hexdigest()
+            row["image"] = os.path.join(image_dir, f"{name}.{extension}")
+            with open(row["image"], "wb") as f:
+                f.write(base64.b64decode(image))
+    row["seconds"] = round(time.perf_counter() - started, 3)
+    return row
+
+def run(args):
+    items = list_inputs(args.source)
+    model = load_model(args.model)
+    version, config = model_version(args.model, model), vector_config()
+    done, stale = read_done(args.out, version, config, args.retry_failed)
+    todo = [(path, item_id) for path, item_id in items if path not in done]
+    print(f"{len(items)} files: {len(items) - len(todo)} already scored, {len(todo)} to score"
+          + (f" ({stale} lines from another model/config in {args.out})" if stale else ""), file=sys.stderr)
+    if not todo:
+        return 0
+    image_dir = None
+    if args.spectrogram == "image":
+        image_dir = args.image_dir or os.path.splitext(args.out)[0] + "_images"
+        os.makedirs(image_dir, exist_ok=True)
+
+    jobs = args.jobs or os.cpu_count() or 1
+    ids = dict(todo)
+    scored = failed = 0
+    started = time.perf_counter()
+    with open(args.out, "a", encoding="utf-8") as out, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=workers._init_worker,
+                                                   initargs=(args.model,)) as pool:
+        pending = set()
+        queue = iter(todo)
+
+        def fill():
+            # A couple of files per worker in flight: workers never idle, memory stays bounded
+            for path, _ in queue:
+                pending.add(pool.submit(score_file, path, args.spectrogram, args.features, image_dir))
+                if len(pending) >= 2 * jobs:
+                    break
+
+        fill()
+        while pending:
+            finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                pending.discard(future)
+                row = future.result()
+                if ids.get(row["path"]) is not None:
+                    row["id"] = ids[row["path"]]
+                row["model"], row["config"] = version, config
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                if row.get("error"):
+                    failed += 1
+                    print(f"Failed {row['path']}: {row['error']}", file=sys.stderr)
+                else:
+                    scored += 1
+                count = scored + failed
+                if count % FLUSH_EVERY == 0:
+                    out.flush()
+                    rate = count / (time.perf_counter() - started)
+                    print(f"{count}/{len(todo)} files, {rate:.1f} files/s", file=sys.stderr)
+            fill()
+
+    elapsed = time.perf_counter() - started
+    print(f"Scored {scored}, failed {failed} in {elapsed:.1f}s "
+          f"({(scored + failed) / elapsed:.1f} files/s on {jobs} processes) -> {args.out}", file=sys.stderr)
+    return 1 if failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a directory or manifest of recordings offline")
+    parser.add_argument("source", help="directory of audio files, or a .csv/.jsonl manifest with a 'path' column")
+    parser.add_argument("--out", required=True, help="JSONL results file (appended to; reruns resume)")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--jobs", type=int, default=None, help="scoring processes (default: all cores)")
+    parser.add_argument("--spectrogram", choices=("none", "analysis", "image"), default="none",
+                        help="'analysis' adds band energies, 'image' also writes spectrogram images")
+    parser.add_argument("--image-dir", default=None, help="where --spectrogram image writes (default: <out>_images)")
+    parser.add_argument("--features", action="store_true", help="include the feature summary in each line")
+    parser.add_argument("--retry-failed", action="store_true", help="rescore files whose last attempt failed")
+    args = parser.parse_args()
+    sys.exit(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,629 @@
+import queue
+import struct
+import subprocess
+import threading
+import time
+import numpy as np
+from decoders import NEEDS_SEEK, ffmpeg_resample_args, find_ffmpeg, resample_stream, sniff_format
+from activity import whole_signal
+from epochs import band_ratios
+from metrics import span
+from model import (FEATURE_N_FFT, FEATURE_HOP_LENGTH, N_MFCC,
+                   SPECTROGRAM_N_FFT, SPECTROGRAM_HOP_LENGTH,
+                   compute_features, feature_stft, feature_vector, feature_summary,
+                   predict_probabilities, summarize_average_spectrum, render_spectrogram)
+
+# Largest number of spectrogram columns kept for the preview image; older
+# columns are max-pooled pairwise once the limit is reached.
+PREVIEW_COLUMNS = 512
+# Resolution of the dB histograms used to reproduce librosa's top_db clipping
+DB_BIN_WIDTH = 0.5
+DB_RANGE = (-100.0, 160.0)
+# Only this part of the spectrum feeds the band-energy analysis
+BAND_ANALYSIS_FMAX = 1000
+# Live capture: seconds of audio scored per update, and audio seconds between updates
+LIVE_WINDOW_SECONDS = 10.0
+LIVE_INTERVAL_SECONDS = 1.0
+# Headerless PCM accepted on the live endpoint: (WAV format tag, bits per sample)
+PCM_ENCODINGS = {"pcm_s16le": (1, 16), "pcm_f32le": (3, 32)}
+
+class _Framer:
+    """Cuts a signal that arrives in blocks into the same centred frames as librosa.
+
+    ``pad_mode`` mirrors librosa: ``constant`` for stft/rms, ``edge`` for zcr.
+    Only the ``frame_length - hop_length`` overlap is kept between blocks.
+    """
+
+    def __init__(self, frame_length, hop_length, pad_mode="constant"):
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self.pad_mode = pad_mode
+        self._buffer = None
+        self._last = 0.0
+
+    def _pad(self, value):
+        fill = value if self.pad_mode == "edge" else 0.0
+        return np.full(self.frame_length // 2, fill, dtype=np.float32)
+
+    def _take(self):
+        count = 1 + (len(self._buffer) - self.frame_length) // self.hop_length
+        if len(self._buffer) < self.frame_length or count <= 0:
+            return None
+        used = (count - 1) * self.hop_length + self.frame_length
+        segment = self._buffer[:used]
+        self._buffer = self._buffer[count * self.hop_length:]
+        return segment
+
+    def push(self, y):
+        """Append samples and return the completed span of frames (or ``None``)"""
+        if len(y) == 0:
+            return None
+        if self._buffer is None:
+            self._buffer = np.concatenate([self._pad(y[0]), y])
+        else:
+            self._buffer = np.concatenate([self._buffer, y])
+        self._last = y[-1]
+        return self._take()
+
+    def flush(self):
+        """Apply the trailing centre padding and return the remaining frames"""
+        if self._buffer is None:
+            return None
+        self._buffer = np.concatenate([self._buffer, self._pad(self._last)])
+        return self._take()
+
+class _ClippedDbMean:
+    """Per-row time average of a dB matrix with librosa's global ``top_db`` floor.
+
+    ``power_to_db``/``amplitude_to_db`` clip every value to ``max - top_db``
+    where ``max`` is taken over the whole matrix, so the floor is only known
+    at the end. A fixed-size histogram of (count, sum) per row lets the mean
+    be recovered exactly, up to the bin that straddles the final floor.
+    """
+
+    def __init__(self, n_rows):
+        self._edges_min, edges_max = DB_RANGE
+        n_bins = int((edges_max - self._edges_min) / DB_BIN_WIDTH) + 1
+        self._counts = np.zeros((n_rows, n_bins), dtype=np.int64)
+        self._sums = np.zeros((n_rows, n_bins), dtype=np.float64)
+        self._offsets = (np.arange(n_rows) * n_bins)[:, None]
+        self.frames = 0
+
+    def update(self, db):
+        n_bins = self._counts.shape[1]
+        bins = ((db - self._edges_min) / DB_BIN_WIDTH).astype(np.int64)
+        np.clip(bins, 0, n_bins - 1, out=bins)
+        flat = (bins + self._offsets).ravel()
+        self._counts += np.bincount(flat, minlength=self._counts.size).reshape(self._counts.shape)
+        self._sums += np.bincount(flat, weights=db.ravel(), minlength=self._sums.size).reshape(self._sums.shape)
+        self.frames += db.shape[1]
+
+    def mean(self, floor):
+        """Mean of ``max(value, floor)`` per row"""
+        if self.frames == 0:
+            return np.zeros(self._counts.shape[0])
+        centers = self._sums / np.maximum(self._counts, 1)
+        above = centers >= floor
+        total = np.where(above, self._sums, floor * self._counts).sum(axis=1)
+        return total / self.frames
+
+class FeatureAccumulator:
+    """Running version of ``compute_features`` plus the band-energy analysis.
+
+    Feed mono float blocks at ``sr`` with ``update``; ``finalize`` returns
+    the same ``vector``/``summary``/``spectrogram`` structure as
+    ``extract_features``. Memory use depends only on the frame sizes and
+    ``PREVIEW_COLUMNS``, never on the length of the recording.
+
+    Every sample is analysed: activity gating needs the whole clip's noise
+    floor up front, so streamed and live results are always whole-signal
+    (reported as activity mode ``"full"``) even when ``ACTIVITY_DETECTION`` is on.
+    """
+
+    def __init__(self, sr=22050, max_duration=300.0, render=True):
+        import librosa
+        self.sr = sr
+        self.max_samples = int(max_duration * sr) if max_duration else None
+        self.render = render
+        self.samples = 0
+
+        self._feature_frames = _Framer(FEATURE_N_FFT, FEATURE_HOP_LENGTH, "constant")
+        self._zcr_frames = _Framer(FEATURE_N_FFT, FEATURE_HOP_LENGTH, "edge")
+        self._spec_frames = _Framer(SPECTROGRAM_N_FFT, SPECTROGRAM_HOP_LENGTH, "constant")
+
+        self._n_feature_frames = 0
+        self._n_zcr_frames = 0
+        self._sums = {"rms": 0.0, "zcr": 0.0, "spectral_centroid": 0.0,
+                      "spectral_bandwidth": 0.0, "spectral_rolloff": 0.0}
+        self._mel_basis = librosa.filters.mel(sr=sr, n_fft=FEATURE_N_FFT)
+        self._mel_db = _ClippedDbMean(self._mel_basis.shape[0])
+        self._mel_peak = -np.inf
+
+        self.freqs = librosa.fft_frequencies(sr=sr, n_fft=SPECTROGRAM_N_FFT)
+        self._band_rows = int(np.sum(self.freqs <= BAND_ANALYSIS_FMAX))
+        self._spec_db = _ClippedDbMean(self._band_rows)
+        self._spec_peak = -np.inf
+        self._preview = []
+        self._preview_pool = 1
+        self._pending_column = None
+        self._pending_count = 0
+
+    @property
+    def full(self):
+        return self.max_samples is not None and self.samples >= self.max_samples
+
+    def update(self, y):
+        y = np.asarray(y, dtype=np.float32)
+        if self.max_samples is not None:
+            y = y[:max(0, self.max_samples - self.samples)]
+        if len(y) == 0:
+            return
+        self.samples += len(y)
+        self._consume(self._feature_frames.push(y), self._zcr_frames.push(y), self._spec_frames.push(y))
+
+    def _consume(self, feature_span, zcr_span, spec_span):
+        import librosa
+        if feature_span is not None:
+            self._add_feature_frames(feature_span)
+        if zcr_span is not None:
+            frames = librosa.util.frame(zcr_span, frame_length=FEATURE_N_FFT, hop_length=FEATURE_HOP_LENGTH)
+            self._sums["zcr"] += float(librosa.zero_crossings(frames, axis=-2, pad=False).mean(axis=-2).sum())
+            self._n_zcr_frames += frames.shape[1]
+        if spec_span is not None:
+            self._add_spectrogram_frames(spec_span)
+
+    def _add_feature_frames(self, span):
+        import librosa
+        frames = librosa.util.frame(span, frame_length=FEATURE_N_FFT, hop_length=FEATURE_HOP_LENGTH)
+        self._sums["rms"] += float(np.sqrt(np.mean(np.abs(frames) ** 2, axis=0)).sum())
+
+        S = np.abs(librosa.stft(span, n_fft=FEATURE_N_FFT, hop_length=FEATURE_HOP_LENGTH, center=False))
+        sr = self.sr
+        centroid = librosa.feature.spectral_centroid(S=S, sr=sr, n_fft=FEATURE_N_FFT)
+        bandwidth = librosa.feature.spectral_bandwidth(S=S, sr=sr, n_fft=FEATURE_N_FFT, centroid=centroid)
+        rolloff = librosa.feature.spectral_rolloff(S=S, sr=sr, n_fft=FEATURE_N_FFT)
+        self._sums["spectral_centroid"] += float(centroid.sum())
+        self._sums["spectral_bandwidth"] += float(bandwidth.sum())
+        self._sums["spectral_rolloff"] += float(rolloff.sum())
+
+        # power_to_db(ref=1.0) before its top_db clip
+        mel_db = 10.0 * np.log10(np.maximum(1e-10, self._mel_basis.dot(S ** 2)))
+        self._mel_peak = max(self._mel_peak, float(mel_db.max()))
+        self._mel_db.update(mel_db)
+        self._n_feature_frames += S.shape[1]
+
+    def _add_spectrogram_frames(self, span):
+        import librosa
+        S = np.abs(librosa.stft(span, n_fft=SPECTROGRAM_N_FFT, hop_length=SPECTROGRAM_HOP_LENGTH,
+                                window='hann', center=False))
+        # amplitude_to_db before the ref=np.max shift and top_db clip
+        db = 20.0 * np.log10(np.maximum(1e-5, S))
+        self._spec_peak = max(self._spec_peak, float(db.max()))
+        self._spec_db.update(db[:self._band_rows])
+        if self.render:
+            self._add_preview(S)
+
+    def _add_preview(self, S):
+        for column in S.T:
+            if self._pending_column is None:
+                self._pending_column = column.copy()
+            else:
+                np.maximum(self._pending_column, column, out=self._pending_column)
+            self._pending_count += 1
+            if self._pending_count == self._preview_pool:
+                self._preview.append(self._pending_column)
+                self._pending_column = None
+                self._pending_count = 0
+            if len(self._preview) >= PREVIEW_COLUMNS:
+                self._preview = [np.maximum(a, b) for a, b in zip(self._preview[0::2], self._preview[1::2])]
+                self._preview_pool *= 2
+
+    def finalize(self):
+        """Flush the trailing frames and return an ``extract_features``-shaped result"""
+        self._consume(self._feature_frames.flush(), self._zcr_frames.flush(), self._spec_frames.flush())
+        if self.samples < 1024:
+            raise ValueError("Audio too short for analysis (minimum 1024 samples required)")
+
+        n = self._n_feature_frames
+        log_mel = self._mel_db.mean(self._mel_peak - 80.0)
+        import scipy.fftpack
+        mfcc_means = scipy.fftpack.dct(log_mel, type=2, norm='ortho')[:N_MFCC]
+        features = {
+            "rms": self._sums["rms"] / n,
+            "zcr": self._sums["zcr"] / self._n_zcr_frames,
+            "spectral_centroid": self._sums["spectral_centroid"] / n,
+            "spectral_bandwidth": self._sums["spectral_bandwidth"] / n,
+            "spectral_rolloff": self._sums["spectral_rolloff"] / n,
+            "mfcc_means": mfcc_means,
+        }
+
+        peak_db = max(self._spec_peak, -100.0)
+        avg_spectrum = self._spec_db.mean(peak_db - 80.0) - peak_db
+        spectrogram = {
+            "image_base64": None,
+            "frequency_analysis": summarize_average_spectrum(avg_spectrum, self.freqs[:self._band_rows]),
+            "time_duration": float((self._spec_db.frames - 1) * SPECTROGRAM_HOP_LENGTH / self.sr),
+            "streamed": True,
+        }
+        if self.render:
+            try:
+                spectrogram["image_base64"], spectrogram["image_mime"] = self._render_preview(avg_spectrum, peak_db)
+            except Exception as e:
+                spectrogram["error"] = str(e)
+
+        return {"vector": feature_vector(features), "summary": feature_summary(features),
+                "spectrogram": spectrogram, "activity": whole_signal(self.samples, self.sr)}
+
+    def _render_preview(self, avg_spectrum, peak_db):
+        columns = list(self._preview)
+        if self._pending_column is not None:
+            columns.append(self._pending_column)
+        if not columns:
+            return None, None
+        S_db = 20.0 * np.log10(np.maximum(1e-5, np.stack(columns, axis=1))) - peak_db
+        np.maximum(S_db, -80.0, out=S_db)
+        times = np.arange(S_db.shape[1]) * (self._preview_pool * SPECTROGRAM_HOP_LENGTH / self.sr)
+        return render_spectrogram(S_db, self.freqs, times, avg_spectrum=avg_spectrum)
+
+class WavStreamDecoder:
+    """Incremental RIFF/WAVE PCM decoder producing mono float32 at ``sr``"""
+
+    def __init__(self, sr=22050):
+        self.sr = sr
+        self._header = b""
+        self._remainder = b""
+        self._format = None
+        self._resampler = None
+        self._data_left = None  # bytes of the data chunk still to come; None when unbounded
+
+    @classmethod
+    def raw(cls, sr=22050, rate=22050, channels=1, encoding="pcm_s16le"):
+        """Decoder for headerless interleaved PCM, as sent by live capture clients"""
+        tag, bits = PCM_ENCODINGS[encoding]
+        decoder = cls(sr)
+        decoder._format = (tag, channels, rate, channels * bits // 8, bits)
+        if rate != sr:
+            decoder._resampler = resample_stream(rate, sr)
+        return decoder
+
+    def _parse_header(self):
+        data = self._header
+        pos = 12
+        fmt = None
+        while pos + 8 <= len(data):
+            chunk_id, size = struct.unpack("<4sI", data[pos:pos + 8])
+            body = pos + 8
+            if chunk_id == b"fmt ":
+                if body + size > len(data):
+                    return False
+                tag, channels, rate, _, block_align, bits = struct.unpack("<HHIIHH", data[body:body + 16])
+                if tag == 0xFFFE and size >= 40:
+                    tag = struct.unpack("<H", data[body + 24:body + 26])[0]
+                fmt = (tag, channels, rate, block_align, bits)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError("WAV data chunk precedes fmt chunk")
+                tag, channels, rate, block_align, bits = fmt
+                if (tag, bits) not in ((1, 8), (1, 16), (1, 24), (1, 32), (3, 32)):
+                    raise ValueError(f"Unsupported WAV encoding: format={tag}, bits={bits}")
+                if channels == 0 or rate == 0 or block_align != channels * bits // 8:
+                    raise ValueError(f"Malformed WAV header: channels={channels}, rate={rate}, "
+                                     f"block_align={block_align}")
+                self._format = fmt
+                if rate != self.sr:
+                    self._resampler = resample_stream(rate, self.sr)
+                # Streaming writers leave the size at 0 or 0xFFFFFFFF; otherwise chunks after
+                # the audio (LIST, id3 ...) must not be decoded as samples
+                if size not in (0, 0xFFFFFFFF):
+                    self._data_left = size
+                self._remainder = self._take(data[body:])
+                self._header = b""
+                return True
+            pos = body + size + (size & 1)
+        return False
+
+    def _take(self, raw):
+        """The part of ``raw`` that still belongs to the data chunk"""
+        if self._data_left is None:
+            return raw
+        raw = raw[:self._data_left]
+        self._data_left -= len(raw)
+        return raw
+
+    def _convert(self, raw):
+        tag, channels, rate, block_align, bits = self._format
+        usable = len(raw) - len(raw) % block_align
+        raw, self._remainder = raw[:usable], raw[usable:]
+        if not raw:
+            return np.zeros(0, dtype=np.float32)
+        if tag == 3:
+            y = np.frombuffer(raw, dtype="<f4")
+        elif bits == 8:
+            y = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+        elif bits == 16:
+            y = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+        elif bits == 24:
+            b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+            ints = (b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) << 8 >> 8
+            y = ints.astype(np.float32) / 8388608.0
+        else:
+            y = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+        if channels > 1:
+            y = y.reshape(-1, channels).mean(axis=1)
+        return y.astype(np.float32, copy=False)
+
+    def _resample(self, y, last=False):
+        if self._resampler is None:
+            return y
+        return self._resampler.resample_chunk(y, last=last)
+
+    def feed(self, chunk):
+        if self._format is None:
+            self._header += chunk
+            if not self._parse_header():
+                return np.zeros(0, dtype=np.float32)
+            return self._resample(self._convert(self._remainder))
+        return self._resample(self._convert(self._remainder + self._take(chunk)))
+
+    def close(self):
+        if self._format is None:
+            raise ValueError("Incomplete WAV header")
+        return self._resample(np.zeros(0, dtype=np.float32), last=True)
+
+    def abort(self):
+        pass
+
+class FfmpegStreamDecoder:
+    """Pipes compressed chunks through ffmpeg and returns mono float32 PCM at ``sr``.
+
+    ``low_latency`` skips ffmpeg's input probing (several seconds of audio by
+    default) so live chunks are decoded as soon as they arrive.
+    """
+
+    def __init__(self, sr=22050, ffmpeg="ffmpeg", low_latency=False):
+        probing = ["-fflags", "nobuffer", "-probesize", "32", "-analyzeduration", "0"] if low_latency else []
+        self._proc = subprocess.Popen(
+            [ffmpeg, "-hide_banner", "-loglevel", "error", *probing, "-i", "pipe:0",
+             "-f", "f32le", "-ac", "1", *ffmpeg_resample_args(sr, ffmpeg), "pipe:1"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._output = queue.Queue()
+        self._partial = b""
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            data = self._proc.stdout.read1(65536)
+            if not data:
+                break
+            self._output.put(data)
+        self._output.put(None)
+
+    def _drain(self, block=False):
+        pieces = [self._partial]
+        while True:
+            try:
+                data = self._output.get(block=block)
+            except queue.Empty:
+                break
+            if data is None:
+                break
+            pieces.append(data)
+        raw = b"".join(pieces)
+        usable = len(raw) - len(raw) % 4
+        self._partial = raw[usable:]
+        return np.frombuffer(raw[:usable], dtype="<f4")
+
+    def feed(self, chunk):
+        try:
+            self._proc.stdin.write(chunk)
+            self._proc.stdin.flush()
+        except BrokenPipeError:
+            raise ValueError("ffmpeg could not decode the audio stream")
+        return self._drain()
+
+    def close(self):
+        self._proc.stdin.close()
+        y = self._drain(block=True)
+        if self._proc.wait() != 0 and len(y) == 0:
+            raise ValueError("ffmpeg could not decode the audio stream")
+        return y
+
+    def abort(self):
+        if self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+
+class BufferedDecoder:
+    """Fallback when no incremental decoder applies: decode once the upload completes"""
+
+    def __init__(self, sr=22050, filename=None):
+        self.sr = sr
+        self.filename = filename
+        self._chunks = []
+
+    def feed(self, chunk):
+        self._chunks.append(chunk)
+        return np.zeros(0, dtype=np.float32)
+
+    def close(self):
+        from model import load_audio
+        y, _ = load_audio(b"".join(self._chunks), sr=self.sr, filename=self.filename)
+        self._chunks = []
+        return y
+
+    def abort(self):
+        self._chunks = []
+
+def open_stream_decoder(head: bytes, sr=22050, filename=None):
+    """Pick a decoder from the first bytes of the stream"""
+    fmt = sniff_format(head, filename)
+    if fmt == "wav":
+        return WavStreamDecoder(sr)
+    ffmpeg = find_ffmpeg()
+    if ffmpeg and fmt not in NEEDS_SEEK:
+        return FfmpegStreamDecoder(sr, ffmpeg)
+    return BufferedDecoder(sr, filename)
+
+class StreamingAnalysis:
+    """Decode-and-accumulate session for one upload arriving in chunks"""
+
+    # Bytes needed before the format can be sniffed
+    SNIFF_BYTES = 12
+
+    def __init__(self, sr=22050, filename=None, max_duration=300.0, render=True):
+        self.sr = sr
+        self.filename = filename
+        self.accumulator = FeatureAccumulator(sr, max_duration=max_duration, render=render)
+        self.bytes_received = 0
+        self._decoder = None
+        self._head = b""
+
+    def feed(self, chunk: bytes):
+        self.bytes_received += len(chunk)
+        if self._decoder is None:
+            self._head += chunk
+            if len(self._head) < self.SNIFF_BYTES:
+                return
+            self._decoder = open_stream_decoder(self._head, self.sr, self.filename)
+            chunk, self._head = self._head, b""
+        if not self.accumulator.full:
+            self._process(self._decoder.feed, chunk)
+
+    def _process(self, decode, *args):
+        with span("decode"):
+            y = decode(*args)
+        with span("features"):
+            self.accumulator.update(y)
+
+    def finish(self):
+        if self._decoder is None:
+            if not self._head:
+                raise ValueError("Audio file is empty")
+            self._decoder = open_stream_decoder(self._head, self.sr, self.filename)
+            self._process(self._decoder.feed, self._head)
+        self._process(self._decoder.close)
+        return self.accumulator.finalize()
+
+    def abort(self):
+        """Release the decoder (and its ffmpeg process) of an upload that will not be finished"""
+        if self._decoder is not None:
+            self._decoder.abort()
+
+class LiveAnalysis:
+    """Rolling-window scoring of a live capture.
+
+    Decoded audio goes into a ring buffer holding the last ``window`` seconds.
+    Every ``interval`` seconds of audio the window is scored with the same
+    ``compute_features`` as a full upload, so the cost of an update depends on
+    the window length only, not on how long the session has been running.
+    """
+
+    def __init__(self, decoder, model, sr=22050, window=LIVE_WINDOW_SECONDS, interval=LIVE_INTERVAL_SECONDS):
+        self.sr = sr
+        self.model = model
+        self.window = window
+        self.interval = interval
+        self.samples = 0
+        self.filled = 0
+        self._decoder = decoder
+        self._buffer = np.zeros(int(window * sr), dtype=np.float32)
+        self._step = max(1, int(interval * sr))
+        self._next_update = self._step
+        self._probabilities = []
+
+    def _append(self, y):
+        n = len(y)
+        if n == 0:
+            return
+        if n >= len(self._buffer):
+            self._buffer[:] = y[-len(self._buffer):]
+        else:
+            self._buffer[:-n] = self._buffer[n:]
+            self._buffer[-n:] = y
+        self.filled = min(len(self._buffer), self.filled + n)
+        self.samples += n
+
+    def feed(self, chunk: bytes):
+        """Decode one chunk; returns an update once an interval boundary has been crossed"""
+        start = time.perf_counter()
+        with span("decode"):
+            self._append(self._decoder.feed(chunk))
+        if self.samples < self._next_update:
+            return None
+        # A burst spanning several intervals yields one update for the latest window
+        self._next_update = (self.samples // self._step + 1) * self._step
+        return self._score(start)
+
+    def _score(self, start):
+        if self.filled < FEATURE_N_FFT:
+            return None
+        y = self._buffer[-self.filled:]
+        with span("features"):
+            S = feature_stft(y)
+            features = compute_features(y, self.sr, S=S)
+            bands = band_ratios(S, self.sr)
+        probs, note = predict_probabilities(feature_vector(features).reshape(1, -1), self.model)
+        probability = float(probs[0])
+        self._probabilities.append(probability)
+        return {
+            "type": "update",
+            "time": round(self.samples / self.sr, 3),
+            "window_seconds": round(self.filled / self.sr, 3),
+            "probability": probability,
+            "label": "likely_apnea" if probability >= 0.5 else "unlikely",
+            "bands": bands,
+            "features": feature_summary(features),
+            "note": note,
+            "processing_ms": round((time.perf_counter() - start) * 1e3, 2),
+        }
+
+    def finish(self):
+        """Flush the decoder, score the tail and return the session summary"""
+        start = time.perf_counter()
+        with span("decode"):
+            self._append(self._decoder.close())
+        last = self._score(start) if self.samples > self._next_update - self._step else None
+        probs = np.asarray(self._probabilities)
+        return {
+            "type": "summary",
+            "duration_seconds": round(self.samples / self.sr, 3),
+            "updates": len(probs),
+            "mean_probability": float(probs.mean()) if len(probs) else None,
+            "max_probability": float(probs.max()) if len(probs) else None,
+            "flagged_fraction": float((probs >= 0.5).mean()) if len(probs) else None,
+            "last": last,
+        }
+
+    def abort(self):
+        self._decoder.abort()
+
+def open_live_session(config: dict, model, sr=22050):
+    """Build a ``LiveAnalysis`` from the client's opening message.
+
+    ``encoding`` is ``pcm_s16le``/``pcm_f32le`` (headerless, at ``sample_rate``
+    with ``channels`` interleaved) or ``opus`` (WebM or Ogg, as produced by
+    ``MediaRecorder``).
+    """
+    encoding = config.get("encoding", "pcm_s16le")
+    window = float(config.get("window", LIVE_WINDOW_SECONDS))
+    interval = float(config.get("interval", LIVE_INTERVAL_SECONDS))
+    if not 1.0 <= window <= 60.0:
+        raise ValueError("window must be between 1 and 60 seconds")
+    if not 0.25 <= interval <= window:
+        raise ValueError("interval must be between 0.25 seconds and the window length")
+
+    if encoding in PCM_ENCODINGS:
+        rate = int(config.get("sample_rate", sr))
+        channels = int(config.get("channels", 1))
+        if not 8000 <= rate <= 192000 or not 1 <= channels <= 8:
+            raise ValueError("Unsupported sample_rate or channels")
+        decoder = WavStreamDecoder.raw(sr, rate, channels, encoding)
+    elif encoding == "opus":
+        ffmpeg = find_ffmpeg()
+        if ffmpeg is None:
+            raise ValueError("FFmpeg not found; it is required for Opus streams (send PCM instead)")
+        decoder = FfmpegStreamDecoder(sr, ffmpeg, low_latency=True)
+    else:
+        raise ValueError(f"Unsupported encoding: {encoding} (use {', '.join([*PCM_ENCODINGS, 'opus'])})")
+    return LiveAnalysis(decoder, model, sr, window=window, interval=interval)
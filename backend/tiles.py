@@ -0,0 +1,86 @@
+import base64
+import math
+import os
+import zlib
+import numpy as np
+from render import DB_FLOOR, SPECTROGRAM_CMAP, SPECTROGRAM_FMAX, colormap_lut, encode_png, quantize_db
+
+# Zoomable spectrogram tiles (overridable from the environment)
+SPECTROGRAM_TILES = os.environ.get("SPECTROGRAM_TILES", "1") == "1"
+# Tile edge in spectrogram cells: STFT frames across, frequency bins up
+TILE_SIZE = int(os.environ.get("TILE_SIZE", 256))
+TILE_COMPRESSION = 6
+TILE_FORMATS = ("png", "raw")
+
+def tile_config():
+    """Identifies the pyramid settings (part of the feature config)"""
+    return f"tiles{TILE_SIZE}" if SPECTROGRAM_TILES else "notiles"
+
+def _halve(matrix, axis):
+    """Mean of neighbouring cell pairs along ``axis`` (an odd last cell is kept as is)"""
+    n = matrix.shape[axis]
+    starts = np.arange(0, n, 2)
+    shape = [1, 1]
+    shape[axis] = len(starts)
+    counts = np.minimum(2, n - starts).astype(matrix.dtype).reshape(shape)
+    return np.add.reduceat(matrix, starts, axis=axis) / counts
+
+def build_pyramid(S_db, freqs, seconds_per_frame, fmax=SPECTROGRAM_FMAX, tile_size=TILE_SIZE):
+    """Cut a dB spectrogram into a pyramid of ``tile_size`` square uint8 tiles.
+
+    Level 0 is the STFT at full resolution; each further level halves the time
+    axis (and the frequency axis while it spans more than one tile) until the
+    whole spectrogram fits in one tile. Cells are quantized with the same dB
+    scale as the rendered image and stored zlib-compressed, indexed
+    ``data[level][x][y]`` with ``y = 0`` holding the lowest frequencies.
+    """
+    S_db = np.asarray(S_db, dtype=np.float32)
+    top = float(S_db.max()) if S_db.size else 0.0
+    if fmax:
+        S_db = S_db[:max(1, int(np.searchsorted(freqs, fmax, side="right")))]
+    hz_per_bin = float(freqs[1] - freqs[0]) if len(freqs) > 1 else 0.0
+    levels, data = [], []
+    level, time_factor, freq_factor = S_db, 1, 1
+    while True:
+        bins, frames = level.shape
+        codes = quantize_db(level, top)
+        columns, rows = math.ceil(frames / tile_size), math.ceil(bins / tile_size)
+        data.append([[base64.b64encode(zlib.compress(
+                         np.ascontiguousarray(codes[y * tile_size:(y + 1) * tile_size,
+                                                    x * tile_size:(x + 1) * tile_size]).tobytes(),
+                         TILE_COMPRESSION)).decode("ascii")
+                      for y in range(rows)] for x in range(columns)])
+        levels.append({"frames": frames, "bins": bins, "columns": columns, "rows": rows,
+                       "seconds_per_frame": seconds_per_frame * time_factor, "hz_per_bin": hz_per_bin * freq_factor})
+        if frames <= tile_size and bins <= tile_size:
+            break
+        if frames > tile_size:
+            level, time_factor = _halve(level, 1), time_factor * 2
+        if bins > tile_size:
+            level, freq_factor = _halve(level, 0), freq_factor * 2
+    return {"tile_size": tile_size, "encoding": "uint8", "db_range": [DB_FLOOR, 0.0],
+            "fmax": hz_per_bin * S_db.shape[0], "levels": levels, "data": data}
+
+def pyramid_info(pyramid):
+    """The pyramid's description without the tile data (for API responses)"""
+    return {k: v for k, v in pyramid.items() if k != "data"}
+
+def read_tile(pyramid, level, x, y):
+    """uint8 codes of one tile, shaped ``(bins, frames)`` with low frequencies first.
+
+    Raises ``LookupError`` for a tile outside the pyramid.
+    """
+    if min(level, x, y) < 0:
+        raise IndexError(f"No tile {level}/{x}/{y}")
+    meta = pyramid["levels"][level]
+    encoded = pyramid["data"][level][x][y]
+    tile_size = pyramid["tile_size"]
+    bins = min(tile_size, meta["bins"] - y * tile_size)
+    frames = min(tile_size, meta["frames"] - x * tile_size)
+    return np.frombuffer(zlib.decompress(base64.b64decode(encoded)), dtype=np.uint8).reshape(bins, frames)
+
+def encode_tile(codes, tile_format="png", cmap=SPECTROGRAM_CMAP):
+    """``(bytes, mime type)`` of a tile: a colour PNG (low frequencies at the bottom) or the raw codes"""
+    if tile_format == "raw":
+        return codes.tobytes(), "application/octet-stream"
+    return encode_png(colormap_lut(cmap)[codes[::-1]]), "image/png"
@@ -1,42 +1,274 @@
+import argparse
+import concurrent.futures
+import hashlib
+import json
 import os
+import shutil
 import joblib
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from model import extract_features
+from sklearn.model_selection import GridSearchCV, StratifiedKFold, cross_val_score, train_test_split
+from cache import file_digest
+from metrics import collect_spans, span
+from decoders import AUDIO_EXTENSIONS
+from model import CompiledForest, extract_features, forest_path, vector_config
 
 DATA_DIR = "data"
 MODEL_OUT = "saved_model.joblib"
+FEATURE_STORE_DIR = "feature_store"
+# Hyperparameter grid searched with --search (forest size is fixed at N_ESTIMATORS)
+N_ESTIMATORS = 200
+PARAM_GRID = {"max_depth": [None, 12, 24], "min_samples_leaf": [1, 2, 4], "max_features": ["sqrt", 0.5]}
 
-def gather_features(data_dir):
-    X, y = [], []
+def list_dataset(data_dir):
+    """Return ``[(path, label), ...]`` for every audio file under ``data_dir/{normal,apnea}``"""
+    items = []
     classes = {"normal": 0, "apnea": 1}
     for label in classes:
         folder = os.path.join(data_dir, label)
         if not os.path.isdir(folder): continue
-        for fname in os.listdir(folder):
-            if not fname.lower().endswith((".wav", ".mp3", ".m4a", ".flac")):
+        for fname in sorted(os.listdir(folder)):
+            if not fname.lower().endswith(AUDIO_EXTENSIONS):
                 continue
-            path = os.path.join(folder, fname)
-            try:
-                feat = extract_features(path)
-                X.append(feat["vector"])
-                y.append(classes[label])
-            except Exception as e:
-                print(f"Skipping {path}: {e}")
-    return np.vstack(X), np.array(y)
+            items.append((os.path.join(folder, fname), classes[label]))
+    return items
+
+class FeatureStore:
+    """Append-only on-disk matrix of feature vectors keyed by audio content hash.
+
+    Rows are raw float32 in ``vectors.f32`` and are read back through a
+    memory map; ``keys.txt`` holds one key per row, in row order. Each
+    ``vector_config()`` gets its own subdirectory, so changing feature
+    parameters starts a fresh store instead of mixing vectors. Rows are
+    written before their keys, and a store cut short by an interruption is
+    trimmed to the rows that have both on open.
+    """
+
+    def __init__(self, root=FEATURE_STORE_DIR, config=None):
+        config = config or vector_config()
+        self.path = os.path.join(root, hashlib.blake2b(config.encode(), digest_size=8).hexdigest())
+        self._vectors_path = os.path.join(self.path, "vectors.f32")
+        self._keys_path = os.path.join(self.path, "keys.txt")
+        self._meta_path = os.path.join(self.path, "meta.json")
+        os.makedirs(self.path, exist_ok=True)
+        self.width = None
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                self.width = json.load(f)["width"]
+        else:
+            self._write_meta(config)
+        self.config = config
+        self.index = {}
+        self._load()
+        self._vectors = self._keys = None
+
+    def _write_meta(self, config, width=None):
+        with open(self._meta_path, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "width": width, "dtype": "float32"}, f)
+
+    def _load(self):
+        text = ""
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path, "r", encoding="utf-8") as f:
+                text = f.read()
+        keys = text.split("\n")[:-1]  # a trailing partial line is dropped
+        rows = 0
+        if self.width and os.path.exists(self._vectors_path):
+            rows = min(len(keys), os.path.getsize(self._vectors_path) // (4 * self.width))
+            # Trim anything past the last complete row/key pair (an interrupted append)
+            if os.path.getsize(self._vectors_path) != rows * 4 * self.width:
+                with open(self._vectors_path, "r+b") as f:
+                    f.truncate(rows * 4 * self.width)
+        if len(text) != sum(len(key) + 1 for key in keys[:rows]):
+            with open(self._keys_path, "w", encoding="utf-8") as f:
+                f.writelines(key + "\n" for key in keys[:rows])
+        self.index = {key: row for row, key in enumerate(keys[:rows])}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def append(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        if self.width is None:
+            self.width = len(vector)
+            self._write_meta(self.config, self.width)
+        elif len(vector) != self.width:
+            raise ValueError(f"Feature vector has {len(vector)} values, the store holds {self.width}")
+        if self._vectors is None:
+            self._vectors = open(self._vectors_path, "ab")
+            self._keys = open(self._keys_path, "a", encoding="utf-8")
+        self._vectors.write(vector.tobytes())
+        self._vectors.flush()
+        self._keys.write(key + "\n")
+        self._keys.flush()
+        self.index[key] = len(self.index)
+
+    def close(self):
+        if self._vectors is not None:
+            self._vectors.close()
+            self._keys.close()
+            self._vectors = self._keys = None
+
+    def matrix(self):
+        """Every row as a read-only ``(rows, width)`` float32 memory map"""
+        if not self.index:
+            return np.empty((0, self.width or 0), dtype=np.float32)
+        self.close()
+        return np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(len(self.index), self.width))
+
+    def rows(self, keys):
+        """Matrix rows for ``keys``; the memory map itself when they are the whole store in order"""
+        indices = np.fromiter((self.index[key] for key in keys), dtype=np.int64, count=len(keys))
+        X = self.matrix()
+        if len(indices) == len(X) and np.array_equal(indices, np.arange(len(X))):
+            return X
+        return X[indices]
+
+def _file_vector_job(path):
+    """Pool entry point: ``(path, vector, error)``. Spectrograms are never computed here."""
+    try:
+        return path, extract_features(path, filename=path, spectrogram="none")["vector"], None
+    except Exception as e:
+        return path, None, str(e)
+
+def gather_features(data_dir, jobs=None, store_dir=FEATURE_STORE_DIR, recompute=False):
+    """Extract features for the whole dataset into the feature store across ``jobs`` processes.
+
+    Only files whose content is not in the store yet are decoded. Returns the
+    feature matrix (memory-mapped where possible) and the labels.
+    """
+    with span("train.list"):
+        items = list_dataset(data_dir)
+    with span("train.hash"):
+        keys = {path: file_digest(path) for path, _ in items}
+    store = FeatureStore(store_dir)
+    if recompute:
+        shutil.rmtree(store.path)
+        store = FeatureStore(store_dir)
+    todo = [path for path, _ in items if keys[path] not in store]
+    failed = set()
+    with span("train.extract"):
+        if todo:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+                for path, vector, error in pool.map(_file_vector_job, todo, chunksize=8):
+                    if error is not None:
+                        print(f"Skipping {path}: {error}")
+                        failed.add(path)
+                    elif keys[path] not in store:  # identical files share one row
+                        store.append(keys[path], vector)
+    store.close()
+    items = [(path, label) for path, label in items if path not in failed]
+    print(f"Features: {len(items)} files ({len(items) - len(todo) + len(failed)} from the store, "
+          f"{len(todo) - len(failed)} computed), store {store.path} holds {len(store)} rows")
+    with span("train.load"):
+        X = store.rows([keys[path] for path, _ in items])
+    return X, np.array([label for _, label in items])
+
+def export_forest(clf, out_dir, X_check=None):
+    """Flatten a fitted RandomForestClassifier into the arrays ``CompiledForest`` memory-maps.
+
+    Node indices are global across trees; leaves get an infinite threshold and
+    point to themselves. Leaf values are stored already normalised the way
+    ``DecisionTreeClassifier.predict_proba`` normalises them. If ``X_check`` is
+    given, the export is verified bit for bit against ``clf.predict_proba``.
+    """
+    parts = {name: [] for name in CompiledForest.ARRAYS if name != "roots"}
+    roots, offset, depth = [], 0, 0
+    for estimator in clf.estimators_:
+        tree = estimator.tree_
+        n = tree.node_count
+        leaf = tree.children_left == -1
+        own = np.arange(offset, offset + n, dtype=np.int32)
+        value = tree.value[:, 0, :].copy()
+        normalizer = value.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        value /= normalizer
+
+        parts["feature"].append(np.where(leaf, 0, tree.feature).astype(np.int32))
+        parts["threshold"].append(np.where(leaf, np.inf, tree.threshold))
+        parts["left"].append(np.where(leaf, own, tree.children_left + offset).astype(np.int32))
+        parts["right"].append(np.where(leaf, own, tree.children_right + offset).astype(np.int32))
+        missing = getattr(tree, "missing_go_to_left", np.zeros(n, dtype=np.uint8))
+        parts["missing_left"].append(np.asarray(missing, dtype=bool) & ~leaf)
+        parts["value"].append(value)
+        roots.append(offset)
+        offset += n
+        depth = max(depth, tree.max_depth)
+
+    arrays = {name: np.ascontiguousarray(np.concatenate(chunks)) for name, chunks in parts.items()}
+    arrays["roots"] = np.asarray(roots, dtype=np.int32)
+    os.makedirs(out_dir, exist_ok=True)
+    digest = hashlib.blake2b(digest_size=16)
+    for name in CompiledForest.ARRAYS:
+        np.save(os.path.join(out_dir, f"{name}.npy"), arrays[name])
+        digest.update(arrays[name].tobytes())
+    meta = {"classes": clf.classes_.tolist(), "n_features": int(clf.n_features_in_),
+            "depth": int(depth), "trees": len(roots), "nodes": int(offset), "digest": digest.hexdigest(),
+            "vector_config": getattr(clf, "vector_config", None)}
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    if X_check is not None:
+        if not np.array_equal(CompiledForest(out_dir).predict_proba(X_check), clf.predict_proba(X_check)):
+            raise RuntimeError("Compiled forest does not reproduce predict_proba exactly")
+    return meta
 
 def main():
-    X, y = gather_features(DATA_DIR)
-    print("Shapes:", X.shape, y.shape)
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    clf = RandomForestClassifier(n_estimators=200, random_state=42)
-    clf.fit(X_train, y_train)
-    print("Train acc:", clf.score(X_train, y_train))
-    print("Test acc:", clf.score(X_test, y_test))
-    joblib.dump(clf, MODEL_OUT)
-    print("Saved model:", MODEL_OUT)
+    parser = argparse.ArgumentParser(description="Train the snore apnea classifier")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--out", default=MODEL_OUT)
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="processes for feature extraction and threads for fitting (default: all cores)")
+    parser.add_argument("--store-dir", default=FEATURE_STORE_DIR, help="on-disk feature store")
+    parser.add_argument("--recompute", action="store_true", help="rebuild the feature store from scratch")
+    parser.add_argument("--search", action="store_true", help="grid-search the forest hyperparameters first")
+    parser.add_argument("--cv", type=int, default=0, help="also report k-fold cross-validated accuracy")
+    args = parser.parse_args()
+    jobs = args.jobs or os.cpu_count() or 1
+
+    with collect_spans() as trace:
+        X, y = gather_features(args.data_dir, jobs=jobs, store_dir=args.store_dir, recompute=args.recompute)
+        print("Shapes:", X.shape, y.shape)
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        params = {}
+        if args.search:
+            with span("train.search"):
+                # Parallel over candidates and folds; each forest is then fitted on one core
+                search = GridSearchCV(RandomForestClassifier(n_estimators=N_ESTIMATORS, random_state=42),
+                                      PARAM_GRID, cv=StratifiedKFold(5, shuffle=True, random_state=42),
+                                      n_jobs=jobs)
+                search.fit(X_train, y_train)
+            params = search.best_params_
+            print(f"Best parameters: {params} (cv accuracy {search.best_score_:.4f})")
+        clf = RandomForestClassifier(n_estimators=N_ESTIMATORS, random_state=42, n_jobs=jobs, **params)
+        with span("train.fit"):
+            clf.fit(X_train, y_train)
+        with span("train.evaluate"):
+            print("Train acc:", clf.score(X_train, y_train))
+            print("Test acc:", clf.score(X_test, y_test))
+        if args.cv:
+            with span("train.cross_validate"):
+                scores = cross_val_score(RandomForestClassifier(n_estimators=N_ESTIMATORS, random_state=42, **params),
+                                         X, y, cv=StratifiedKFold(args.cv, shuffle=True, random_state=42), n_jobs=jobs)
+            print(f"{args.cv}-fold cv accuracy: {scores.mean():.4f} +/- {scores.std():.4f}")
+        # The API scores in its own worker pool; a saved n_jobs would oversubscribe it
+        clf.set_params(n_jobs=None)
+        # Recorded so load_model can refuse a model scored with different features
+        clf.vector_config = vector_config()
+        with span("train.save"):
+            joblib.dump(clf, args.out)
+        print("Saved model:", args.out)
+        with span("train.export"):
+            meta = export_forest(clf, forest_path(args.out), X_check=X)
+        print(f"Exported compiled forest: {forest_path(args.out)} ({meta['trees']} trees, {meta['nodes']} nodes, "
+              f"depth {meta['depth']}, verified against predict_proba)")
+
+    print("Stage timings:")
+    for stage, seconds in trace.spans.items():
+        print(f"  {stage:<22} {seconds:8.2f}s")
 
 if __name__ == "__main__":
     main()
-
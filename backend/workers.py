@@ -0,0 +1,237 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+from model import load_model, predict_from_file, extract_features, warm_up
+from epochs import analyze_recording
+from quality import QUALITY_TIERS
+from metrics import collect_spans, record, record_memory, record_spans, track_peak_memory
+
+logger = logging.getLogger(__name__)
+
+# Analysis pool configuration (overridable from the environment)
+ANALYSIS_EXECUTOR = os.environ.get("ANALYSIS_EXECUTOR", "process")  # "process" or "thread"
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", os.cpu_count() or 1))
+ANALYSIS_QUEUE_SIZE = int(os.environ.get("ANALYSIS_QUEUE_SIZE", ANALYSIS_WORKERS * 2))
+ANALYSIS_TIMEOUT = float(os.environ.get("ANALYSIS_TIMEOUT", 120))
+
+class PoolSaturated(Exception):
+    """Raised when the admission queue is full; carries a Retry-After hint in seconds"""
+    def __init__(self, retry_after: int):
+        super().__init__(f"Analysis queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class JobTimeout(Exception):
+    """Raised when an analysis job exceeds its time budget.
+
+    Only the caller stops waiting: a pool job cannot be interrupted, so it keeps
+    its worker and its admission slot until it finishes on its own. ``running``
+    is the job's future, for callers that want to wait for the worker.
+    """
+
+    def __init__(self, message, running=None):
+        super().__init__(message)
+        self.running = running
+
+class WorkerCrashed(Exception):
+    """Raised when the worker running a job died (e.g. killed for running out of memory)"""
+
+# Model instance owned by the current worker (process or main process for threads)
+_worker_model = None
+
+def _init_worker(model_path, warm=False):
+    global _worker_model
+    _worker_model = load_model(model_path)
+    if warm:
+        # Runs before the process takes its first job, so no request lands on a cold worker
+        try:
+            warm_up(_worker_model)
+        except Exception as e:
+            logger.warning("Worker warm-up failed: %s", e)
+
+def _worker_ready():
+    return os.getpid()
+
+def _traced(fn, submitted, *args):
+    """Run a job and return its result with the stage timings and peak memory it recorded in this worker"""
+    with collect_spans() as trace:
+        record("queue_wait", max(0.0, time.time() - submitted))
+        # Thread workers share the API process, so only process workers get a per-job reading
+        with track_peak_memory() if multiprocessing.parent_process() is not None else contextlib.nullcontext():
+            result = fn(*args)
+    return result, trace.spans, trace.peak_memory
+
+def run_analysis(source, filename=None, quality="full"):
+    """Job entry point executed inside the pool; ``source`` is a path or raw bytes.
+
+    ``quality`` is a tier from ``quality.QUALITY_TIERS`` and sets how much spectrogram work is done.
+    """
+    result = predict_from_file(source, _worker_model, filename=filename, spectrogram=QUALITY_TIERS[quality])
+    result["quality"] = quality
+    return result
+
+def run_feature_extraction(source, filename=None, spectrogram="analysis"):
+    """Feature-only job entry point; scoring is left to the caller (e.g. batched inference)"""
+    return extract_features(source, filename=filename, spectrogram=spectrogram)
+
+def run_recording_analysis(source, filename=None, progress=None):
+    """Long-recording (per-epoch) job entry point executed inside the pool"""
+    return analyze_recording(source, _worker_model, filename=filename, progress=progress)
+
+class AnalysisPool:
+    """Bounded executor for CPU-bound analysis jobs.
+
+    At most ``workers`` jobs run at once and at most ``queue_size`` more wait
+    for a worker; anything beyond that is rejected immediately with
+    ``PoolSaturated`` so the event loop never piles up unbounded work.
+    """
+
+    def __init__(self, workers=ANALYSIS_WORKERS, queue_size=ANALYSIS_QUEUE_SIZE,
+                 timeout=ANALYSIS_TIMEOUT, kind=ANALYSIS_EXECUTOR):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.kind = kind
+        self._executor = None
+        self._pending = 0
+        self._avg_duration = 5.0  # seconds, refined as jobs complete
+        self._start_args = None
+        self.restarts = 0
+        self.last_restart = None
+
+    def start(self, model_path, model=None, warm=False):
+        self._start_args = (model_path, model, warm)
+        if self.kind == "thread":
+            # Threads share the already-loaded model with the main process
+            global _worker_model
+            _worker_model = model
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        else:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker, initargs=(model_path, warm))
+            # Fork the workers now, before the warm-up threads start: a worker forked
+            # lazily by the first request could inherit a lock held by one of them
+            for _ in range(self.workers):
+                self._executor.submit(_worker_ready)
+
+    @property
+    def broken(self):
+        return bool(getattr(self._executor, "_broken", False))
+
+    def _restart(self, broken_executor):
+        """Replace a process pool that lost a worker; every job still in it has already failed"""
+        if self._executor is not broken_executor or self._start_args is None:
+            return  # already replaced by a concurrent caller, or shut down
+        logger.error("An analysis worker died; restarting the process pool")
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+        self.start(*self._start_args)
+        self.restarts += 1
+        self.last_restart = time.time()
+
+    def shutdown(self):
+        self._start_args = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def warm_up(self):
+        """Start every worker process and wait until each has run its warm-up.
+
+        Thread workers share the main process, which warms up on its own.
+        """
+        if self._executor is None or self.kind == "thread":
+            return
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _worker_ready)
+                               for _ in range(self.workers)))
+
+    @property
+    def capacity(self):
+        return self.workers + self.queue_size
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @property
+    def saturated(self):
+        return self._pending >= self.capacity
+
+    @property
+    def queued(self):
+        return max(0, self._pending - self.workers)
+
+    def retry_after(self):
+        waves = (self.queued + 1) / self.workers
+        return max(1, math.ceil(self._avg_duration * waves))
+
+    def stats(self):
+        return {
+            "executor": self.kind,
+            "workers": self.workers,
+            "in_flight": min(self._pending, self.workers),
+            "queued": self.queued,
+            "queue_size": self.queue_size,
+            "avg_job_seconds": round(self._avg_duration, 3),
+            "broken": self.broken,
+            "restarts": self.restarts,
+            "last_restart": self.last_restart,
+        }
+
+    def _job_done(self, started, executor, future):
+        # A slot is only released once the job has really finished, even if the
+        # caller already gave up on it, so capacity accounting stays honest.
+        self._pending -= 1
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * (time.monotonic() - started)
+        elif isinstance(error, BrokenProcessPool):
+            # Rebuild straight away rather than on the next request, so /health recovers too
+            self._restart(executor)
+
+    @contextlib.contextmanager
+    def reserve(self):
+        """Hold one admission slot for work that runs outside the pool (e.g. streaming uploads)"""
+        if self.saturated:
+            raise PoolSaturated(self.retry_after())
+        self._pending += 1
+        try:
+            yield
+        finally:
+            self._pending -= 1
+
+    async def submit(self, fn, *args, timeout=None):
+        if self._executor is None:
+            raise RuntimeError("Analysis pool has not been started")
+        if self.saturated:
+            raise PoolSaturated(self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            future = loop.run_in_executor(executor, _traced, fn, time.time(), *args)
+        except BrokenProcessPool:
+            # Broken before this job got in: it never ran, so resubmit it to a fresh pool
+            self._restart(executor)
+            executor = self._executor
+            future = loop.run_in_executor(executor, _traced, fn, time.time(), *args)
+        self._pending += 1
+        future.add_done_callback(lambda f, started=time.monotonic(): self._job_done(started, executor, f))
+        try:
+            result, spans, peak_memory = await asyncio.wait_for(asyncio.shield(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            # The shielded job keeps running and holds its worker and slot until it ends (see JobTimeout)
+            raise JobTimeout(f"Analysis did not finish within {timeout or self.timeout:.0f}s", future)
+        except BrokenProcessPool:
+            raise WorkerCrashed("The analysis worker exited unexpectedly (possibly out of memory); "
+                                "the pool has been restarted")
+        record_spans(spans)
+        record_memory(peak_memory)
+        return result